@@ -24,6 +24,7 @@ from .embedding_service import EmbeddingService
 from .db import ProductsDb
 from .gcs_service import GCSService
 from .yolo_detector import get_yolo_detector
+from .cpu_executor import configure_cpu_threads, cpu_stats, get_executor
 
 # Load environment from backend/.env explicitly so it works from any CWD
 load_dotenv(dotenv_path=Path(__file__).with_name('.env'))
@@ -31,6 +32,9 @@ load_dotenv(dotenv_path=Path(__file__).with_name('.env'))
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
 
+# Process-wide PyTorch threads and per-model core pinning are configured in cpu_executor.py
+configure_cpu_threads()
+
 app = FastAPI(title="Decor Detective Backend")
 
 app.add_middleware(
@@ -53,6 +57,33 @@ db = ProductsDb()
 gcs = GCSService()
 
 
+@app.on_event("startup")
+async def warmup_sam2():
+	"""Compile and warm up SAM2 before serving when SAM2_COMPILE=1 (otherwise it loads on first use)"""
+	if os.getenv("SAM2_COMPILE", "0") != "1":
+		return
+	try:
+		from backend.sam2.sam2.segment_api import warmup as _warmup
+	except ImportError:
+		from sam2.sam2.segment_api import warmup as _warmup
+	await get_executor("sam2").run_async(_warmup)
+
+
+def _apply_bbox_mask(crop: Image.Image, mask: Optional[str]) -> Image.Image:
+	"""Blank out the background of a box crop given a bbox-cropped mask
+	(JSON 2D list anchored at the box's top left corner, as returned by
+	/segment?mask_format=bbox_crop)."""
+	if not mask:
+		return crop
+	import json
+
+	mask_array = np.array(json.loads(mask), dtype=np.uint8)[: crop.height, : crop.width]
+	alpha = Image.new("L", crop.size, 0)
+	alpha.paste(Image.fromarray(mask_array * 255), (0, 0))
+	background = Image.new("RGB", crop.size, (255, 255, 255))
+	return Image.composite(crop, background, alpha)
+
+
 class BBox(BaseModel):
 	x: int
 	y: int
@@ -75,6 +106,31 @@ class MaskDto(BaseModel):
     mask: List[List[int]]  
     color: Optional[List[int]] = None
     colored_mask: Optional[List[List[List[int]]]] = None  
+    mask_format: str = "full"  # "bbox_crop": mask/colored_mask only cover the (x, y, width, height) box
+    image_id: Optional[str] = None  # pass to /refine to correct the mask with clicks
+    model_tier: Optional[str] = None  # SAM2 model picked for the current load, e.g. "large"
+    points_per_side: Optional[int] = None  # AMG point grid picked for the current load
+
+
+class RefineRequest(BaseModel):
+    image_id: str  # from /segment
+    points: List[List[float]]  # [x, y] clicks in image pixels
+    labels: List[int]  # 1 = positive click, 0 = negative click
+    low_res_logits: Optional[str] = None  # from the previous /refine of the same mask
+    mask_format: str = "full"
+
+
+class RefineDto(BaseModel):
+    image_id: str
+    x: int
+    y: int
+    width: int
+    height: int
+    score: float
+    mask: List[List[int]]
+    mask_format: str = "full"
+    low_res_logits: str  # base64 encoded float16 logits, square
+    model_tier: Optional[str] = None
 
 
 class CropRequest(BaseModel):
@@ -100,13 +156,15 @@ class ProductDto(BaseModel):
 
 
 @app.post("/segment", response_model=List[MaskDto])
-async def segment(image: UploadFile = File(...), use_yolo: bool = True):
+async def segment(image: UploadFile = File(...), use_yolo: bool = True, mask_format: str = "full"):
     """
     Segment an image using YOLO for detection and SAM2 for segmentation.
     
     Args:
         image: Input image file
         use_yolo: Whether to use YOLO for detection (True) or use SAM2 directly (False)
+        mask_format: "full" returns image-sized masks, "bbox_crop" only returns each
+            mask within its bounding box, which is much smaller for small objects
     """
     try:
         image_bytes = await image.read()
@@ -114,17 +172,23 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
         
         # Import from the sam2 package
         try:
+            from backend.sam2.sam2.segment_api import register_image as _register_image
             from backend.sam2.sam2.segment_api import segment_pil as _segment_pil
         except ImportError:
+            from sam2.sam2.segment_api import register_image as _register_image
             from sam2.sam2.segment_api import segment_pil as _segment_pil
         
+        # Keep the image around so /refine does not need it uploaded again
+        image_id = _register_image(pil)
+        
         # Initialize YOLO detector if needed
         yolo_detector = None
         if use_yolo:
             try:
-                yolo_detector = get_yolo_detector()
+                yolo = get_executor("yolo")
+                yolo_detector = await yolo.run_async(get_yolo_detector)
                 # Run YOLO detection with minimum box area of 2000 pixels
-                detections = yolo_detector.detect(pil, min_box_area=2000)
+                detections = await yolo.run_async(yolo_detector.detect, pil, min_box_area=2000)
                 print(f"✅ YOLO detected {len(detections)} objects after size filtering")
                 
                 # Log details about filtered detections
@@ -139,7 +203,7 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
         # If YOLO is not used or failed, use SAM2 directly
         if not use_yolo or not detections:
             print("ℹ️ Using SAM2 without YOLO detection")
-            masks = _segment_pil(pil)
+            masks = await get_executor("sam2").run_async(_segment_pil, pil, mask_format=mask_format)
         else:
             print(f"✅ Using {len(detections)} YOLO detections with SAM2")
             
@@ -165,11 +229,11 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
             
             try:
                 # Try with boxes parameter if supported
-                masks = _segment_pil(pil, boxes=boxes)
+                masks = await get_executor("sam2").run_async(_segment_pil, pil, boxes=boxes, mask_format=mask_format, image_id=image_id)
             except Exception as e:
                 print(f"⚠️ Error using box prompts, falling back to standard segmentation: {e}")
                 # Fall back to standard segmentation if boxes parameter is not supported
-                masks = _segment_pil(pil)
+                masks = await get_executor("sam2").run_async(_segment_pil, pil, mask_format=mask_format)
         
         # Process masks and calculate bounding boxes with colorful visualization
         processed_masks = []
@@ -186,11 +250,14 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
             elif not isinstance(mask_array, np.ndarray):
                 continue
                 
+            # Bbox-cropped masks are anchored at the mask's bounding box
+            offset_x, offset_y = (m["x"], m["y"]) if mask_format == "bbox_crop" else (0, 0)
+                
             # Calculate bounding box from mask
             coords = np.where(mask_array > 0)
             if len(coords[0]) > 0:
-                y_min, y_max = coords[0].min(), coords[0].max()
-                x_min, x_max = coords[1].min(), coords[1].max()
+                y_min, y_max = coords[0].min() + offset_y, coords[0].max() + offset_y
+                x_min, x_max = coords[1].min() + offset_x, coords[1].max() + offset_x
                 
                 # Create purple mask for visualization
                 purple = [128, 0, 255]  # RGB for purple
@@ -212,7 +279,11 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
                     "score": float(score),
                     "mask": mask_array.astype(int).tolist(),
  "color": purple,
-                    "colored_mask": colored_mask.tolist()
+                    "colored_mask": colored_mask.tolist(),
+                    "mask_format": mask_format,
+                    "image_id": image_id,
+                    "model_tier": m.get("model_tier"),
+                    "points_per_side": m.get("points_per_side"),
                 }
                 processed_masks.append(mask_dto)
         
@@ -230,6 +301,51 @@ async def segment(image: UploadFile = File(...), use_yolo: bool = True):
         }
         print(f"❌ Segmentation failed: {detail}")
         raise HTTPException(status_code=500, detail=detail)
+
+
+@app.post("/refine", response_model=RefineDto)
+async def refine(req: RefineRequest):
+    """
+    Refine a mask of a segmented image with positive/negative clicks.
+    Reuses the image features cached by /segment, so only the SAM2 prompt
+    encoder and mask decoder run.
+    """
+    import base64
+    
+    try:
+        from backend.sam2.sam2.segment_api import refine_pil as _refine_pil
+    except ImportError:
+        from sam2.sam2.segment_api import refine_pil as _refine_pil
+    
+    if len(req.points) == 0 or len(req.points) != len(req.labels):
+        raise HTTPException(status_code=400, detail="points and labels must be non-empty and of the same length")
+    try:
+        low_res_logits = None
+        if req.low_res_logits:
+            # Invalid base64, an odd number of bytes or non-square logits raise ValueError (400)
+            low_res_logits = np.frombuffer(
+                base64.b64decode(req.low_res_logits, validate=True), dtype=np.float16
+            )
+            side = int(math.isqrt(low_res_logits.size))
+            if side == 0 or side * side != low_res_logits.size:
+                raise ValueError(f"low_res_logits must be a square array, got {low_res_logits.size} values")
+            low_res_logits = low_res_logits.reshape(side, side)
+        result = await get_executor("sam2").run_async(
+            _refine_pil,
+            req.image_id,
+            req.points,
+            req.labels,
+            low_res_logits=low_res_logits,
+            mask_format=req.mask_format,
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result["low_res_logits"] = base64.b64encode(result["low_res_logits"].astype(np.float16).tobytes()).decode()
+    return RefineDto(mask_format=req.mask_format, **result)
+
+
 @app.post("/crop", response_model=dict)
 async def crop_image(
 	image: UploadFile = File(...),
@@ -380,6 +496,7 @@ async def crop_bbox(
 	y: int = Form(...),
 	width: int = Form(...),
 	height: int = Form(...),
+	mask: Optional[str] = Form(None),  # optional bbox-cropped mask of the object
 ):
 	"""Crop an image based on bounding box coordinates"""
 	try:
@@ -396,7 +513,7 @@ async def crop_bbox(
 		y_max = min(pil.height, y + height)
 		
 		# Crop the image
-		cropped = pil.crop((x, y, x_max, y_max))
+		cropped = _apply_bbox_mask(pil.crop((x, y, x_max, y_max)), mask)
 		
 		# Convert to base64 for response
 		buffer = io.BytesIO()
@@ -465,7 +582,9 @@ async def embed_siglip(image: UploadFile = File(...)):
 	try:
 		image_bytes = await image.read()
 		pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-		embedding = get_embedder().compute_embedding(pil)
+		siglip = get_executor("siglip")
+		embedder = await siglip.run_async(get_embedder)
+		embedding = await siglip.run_async(embedder.compute_embedding, pil)
 		print(f"✅ SigLIP2 embedding generated: {len(embedding)} dimensions")
 		return embedding
 	except Exception as e:
@@ -485,13 +604,16 @@ async def embed(
 	y: int = Form(...),
 	width: int = Form(...),
 	height: int = Form(...),
+	mask: Optional[str] = Form(None),  # optional bbox-cropped mask of the object
 ):
 	"""Generate embedding for a cropped image region"""
 	try:
 		image_bytes = await image.read()
 		pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-		crop = pil.crop((x, y, x + width, y + height))
-		embedding = get_embedder().compute_embedding(crop)
+		crop = _apply_bbox_mask(pil.crop((x, y, x + width, y + height)), mask)
+		siglip = get_executor("siglip")
+		embedder = await siglip.run_async(get_embedder)
+		embedding = await siglip.run_async(embedder.compute_embedding, crop)
 		print(f"✅ Embedding generated: {len(embedding)} dimensions")
 		return embedding
 	except Exception as e:
@@ -505,6 +627,12 @@ async def embed(
 		raise HTTPException(status_code=500, detail=detail)
 
 
+@app.get("/cpu_stats")
+async def get_cpu_stats():
+	"""Per-model CPU execution settings (threads, workers, pinned cores) and usage"""
+	return cpu_stats()
+
+
 @app.post("/search", response_model=List[ProductDto])
 async def search(req: SearchRequest):
     """Search for similar furniture using vector similarity in MongoDB"""
@@ -0,0 +1,144 @@
+"""
+Throughput of the backend models at 1..N concurrent requests, with every model on
+PyTorch's default thread pool (as before cpu_executor.py) and with each model
+pinned to its own share of the cores (with the process-wide intra-op thread count
+set to the smallest share, as configure_cpu_threads does).
+
+Each request runs YOLO detection, SAM2 box segmentation and a SigLIP embedding,
+like /segment followed by /embed. YOLO and SigLIP are only part of the requests
+if ultralytics / transformers are installed (and the SigLIP weights available).
+
+Run from the repository root:
+    python -m backend.benchmark_cpu_exec --concurrency 1 2 4 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .cpu_executor import ModelExecConfig, ModelExecutor
+
+
+def load_models(sam2_cfg, sam2_checkpoint):
+    """The available models, as {name: fn(image)} running one request stage."""
+    from sam2.build_sam import build_sam2
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+    sam2_model = build_sam2(sam2_cfg, sam2_checkpoint, device="cpu")
+
+    def run_sam2(image):
+        predictor = SAM2ImagePredictor(sam2_model)
+        predictor.set_image(image)
+        w, h = image.size
+        predictor.predict(box=np.array([w // 4, h // 4, 3 * w // 4, 3 * h // 4]), multimask_output=False)
+
+    models = {"sam2": run_sam2}
+    try:
+        from .yolo_detector import YOLODetector
+
+        models["yolo"] = YOLODetector(device="cpu").detect
+    except Exception as e:
+        print(f"ℹ️ Benchmarking without YOLO: {e}")
+    try:
+        from .embedding_service import EmbeddingService
+
+        models["siglip"] = EmbeddingService().compute_embedding
+    except Exception as e:
+        print(f"ℹ️ Benchmarking without SigLIP: {e}")
+    return models
+
+
+def pinned_configs(names, shares):
+    """Split the cores of the process among the models in proportion to their shares."""
+    cores = sorted(os.sched_getaffinity(0))
+    weights = np.array([shares[name] for name in names], dtype=float)
+    counts = np.maximum(1, np.floor(len(cores) * weights / weights.sum()).astype(int))
+    configs, start = {}, 0
+    for name, count in zip(names, counts):
+        if start + count > len(cores):
+            # fewer cores than models: the last models share the last core
+            start = max(0, len(cores) - count)
+        model_cores = cores[start : start + count]
+        configs[name] = ModelExecConfig(name, workers=1, cores=model_cores)
+        start += count
+    return configs
+
+
+def run_requests(models, executors, image, num_requests, concurrency):
+    """Send num_requests requests from `concurrency` clients, returns requests/s."""
+    order = [name for name in ("yolo", "sam2", "siglip") if name in models]
+
+    def request(_):
+        for name in order:
+            executors[name].run(models[name], image)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(request, range(num_requests)))
+    return num_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sam2_cfg", type=str, default="configs/sam2.1/sam2.1_hiera_t.yaml")
+    parser.add_argument("--sam2_checkpoint", type=str, default=None, help="random weights if not given")
+    parser.add_argument("--image_size", type=int, nargs=2, default=[1024, 768], help="width height")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests_per_client", type=int, default=2)
+    parser.add_argument(
+        "--shares",
+        type=float,
+        nargs=3,
+        default=[2.0, 1.0, 1.0],
+        metavar=("SAM2", "SIGLIP", "YOLO"),
+        help="relative number of cores of each model when pinned",
+    )
+    args = parser.parse_args()
+
+    models = load_models(args.sam2_cfg, args.sam2_checkpoint)
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (args.image_size[1], args.image_size[0], 3), dtype=np.uint8))
+    shares = dict(zip(("sam2", "siglip", "yolo"), args.shares))
+    configs = {
+        # every model on PyTorch's default threads, as many requests at once as clients
+        "default": {name: ModelExecConfig(name, workers=max(args.concurrency)) for name in models},
+        "pinned": pinned_configs(list(models), shares),
+    }
+    default_threads = torch.get_num_threads()
+    pinned_threads = min(len(config.cores) for config in configs["pinned"].values())
+    for name, config in configs["pinned"].items():
+        print(f"pinned {name}: {config.as_dict()}")
+    print(
+        f"models: {', '.join(models)}, intra-op threads: {default_threads} (default), "
+        f"{pinned_threads} (pinned)"
+    )
+
+    rows = []
+    for concurrency in args.concurrency:
+        row = [concurrency]
+        for mode in ("default", "pinned"):
+            torch.set_num_threads(default_threads if mode == "default" else pinned_threads)
+            executors = {name: ModelExecutor(config) for name, config in configs[mode].items()}
+            run_requests(models, executors, image, 1, 1)  # warm up
+            num_requests = concurrency * args.requests_per_client
+            row.append(run_requests(models, executors, image, num_requests, concurrency))
+            if concurrency == max(args.concurrency):
+                for name, executor in executors.items():
+                    stats = executor.stats()
+                    print(f"{mode} {name} @ {concurrency} clients: {stats}")
+            for executor in executors.values():
+                executor.shutdown()
+        rows.append(row)
+
+    print("| concurrent requests | default (req/s) | pinned (req/s) | speedup |")
+    print("|---|---|---|---|")
+    for concurrency, default_rps, pinned_rps in rows:
+        print(f"| {concurrency} | {default_rps:.3f} | {pinned_rps:.3f} | {pinned_rps / default_rps:.2f}x |")
+
+
+if __name__ == "__main__":
+    main()
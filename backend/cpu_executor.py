@@ -0,0 +1,261 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+# Models served by the backend, each run by its own executor
+MODELS = ("sam2", "siglip", "yolo")
+
+# Default number of concurrent requests per model. SAM2 requests must reach the
+# segment_api TierController, which serializes them on the models itself and
+# picks their quality level from the number of requests queued there.
+DEFAULT_WORKERS = {"sam2": 8, "siglip": 1, "yolo": 1}
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a Linux CPU list such as "0-3,8,10-11" into a sorted list of core ids."""
+    cores = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cores.update(range(int(start), int(end) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def numa_node_cpus(node: int) -> List[int]:
+    """The cores of a NUMA node, as listed by the kernel."""
+    with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+        return parse_cpu_list(f.read())
+
+
+def _read_core_times() -> Dict[int, tuple]:
+    """(busy, total) jiffies of every core from /proc/stat (empty if unavailable)."""
+    times = {}
+    try:
+        with open("/proc/stat") as f:
+            for line in f:
+                if not line.startswith("cpu") or line.startswith("cpu "):
+                    continue
+                fields = line.split()
+                values = [int(v) for v in fields[1:]]
+                idle = values[3] + (
+                    values[4] if len(values) > 4 else 0
+                )  # idle + iowait
+                total = sum(values[:8])  # guest time is already counted in user time
+                times[int(fields[0][3:])] = (total - idle, total)
+    except OSError:
+        pass
+    return times
+
+
+class ModelExecConfig:
+    """
+    CPU execution settings of one model, read from the environment with the model
+    name as prefix (e.g. SAM2_CPU_WORKERS):
+        {MODEL}_CPU_WORKERS: number of requests the model runs concurrently
+            (default: DEFAULT_WORKERS)
+        {MODEL}_CPU_CORES: cores to pin the workers to, as a CPU list like "0-3,8"
+        {MODEL}_NUMA_NODE: NUMA node to pin the workers to (if no cores are given)
+
+    The number of intra-op threads is not a per-model setting: PyTorch keeps a single
+    value for the whole process (see configure_cpu_threads). Models that need their
+    own thread count have to run in separate processes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int = 1,
+        cores: Optional[List[int]] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"{name}: workers must be positive, got {workers}")
+        self.name = name
+        self.workers = workers
+        self.cores = sorted(cores) if cores else None
+
+    @classmethod
+    def from_env(cls, name: str) -> "ModelExecConfig":
+        prefix = name.upper()
+        if os.getenv(f"{prefix}_CPU_THREADS"):
+            print(
+                f"⚠️ {prefix}_CPU_THREADS is ignored: PyTorch's intra-op thread count "
+                "is shared by all models, set CPU_INTRAOP_THREADS instead"
+            )
+        cores = os.getenv(f"{prefix}_CPU_CORES")
+        numa_node = os.getenv(f"{prefix}_NUMA_NODE")
+        if cores:
+            cores = parse_cpu_list(cores)
+        elif numa_node:
+            cores = numa_node_cpus(int(numa_node))
+        return cls(
+            name,
+            workers=int(
+                os.getenv(f"{prefix}_CPU_WORKERS", DEFAULT_WORKERS.get(name, 1))
+            ),
+            cores=cores or None,
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "cores": self.cores,
+        }
+
+
+class ModelExecutor:
+    """
+    Runs the calls of one model on a dedicated pool of worker threads. Each worker
+    pins itself to the configured cores, and the OpenMP threads it starts inherit
+    its affinity, so that models pinned to disjoint cores don't compete for them.
+    All the workers use the process-wide intra-op thread count.
+    """
+
+    def __init__(self, config: ModelExecConfig):
+        self.config = config
+        self._pool = ThreadPoolExecutor(
+            max_workers=config.workers,
+            thread_name_prefix=f"{config.name}-cpu",
+            initializer=self._init_worker,
+        )
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._busy_s = 0.0
+        self._thread_cpu_s = 0.0
+        self._queue_wait_s = 0.0
+        self._start_time = time.time()
+        self._start_core_times = _read_core_times()
+
+    def _init_worker(self):
+        if self.config.cores and hasattr(os, "sched_setaffinity"):
+            # pid 0 is the calling thread; the OpenMP threads it spawns inherit the mask
+            os.sched_setaffinity(0, self.config.cores)
+
+    def _timed_call(self, submit_time: float, fn: Callable, args, kwargs):
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            end, end_cpu = time.perf_counter(), time.thread_time()
+            with self._stats_lock:
+                self._calls += 1
+                self._busy_s += end - start
+                self._thread_cpu_s += end_cpu - start_cpu
+                self._queue_wait_s += start - submit_time
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self._pool.submit(
+            self._timed_call, time.perf_counter(), fn, args, kwargs
+        )
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) on a worker of this model and wait for the result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn: Callable, *args, **kwargs):
+        """Same as run, awaitable from the event loop without blocking it."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            calls, busy_s = self._calls, self._busy_s
+            thread_cpu_s, queue_wait_s = self._thread_cpu_s, self._queue_wait_s
+        elapsed_s = time.time() - self._start_time
+        stats = {
+            **self.config.as_dict(),
+            "calls": calls,
+            "busy_s": busy_s,
+            "mean_latency_ms": 1000 * busy_s / calls if calls else None,
+            "mean_queue_wait_ms": 1000 * queue_wait_s / calls if calls else None,
+            # busy_s / elapsed_s > 1 means several calls of the model ran concurrently
+            "busy_fraction": busy_s / elapsed_s if elapsed_s > 0 else 0.0,
+            # CPU time of the calling threads only (not of their OpenMP threads)
+            "thread_cpu_s": thread_cpu_s,
+        }
+        if self.config.cores:
+            # utilization of the pinned cores since the executor started (pinned cores
+            # are only shared with other models if their core sets overlap)
+            busy, total = 0, 0
+            core_times = _read_core_times()
+            for core in self.config.cores:
+                if core in core_times and core in self._start_core_times:
+                    busy += core_times[core][0] - self._start_core_times[core][0]
+                    total += core_times[core][1] - self._start_core_times[core][1]
+            stats["core_utilization"] = busy / total if total > 0 else None
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_executors: Dict[str, ModelExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ModelExecutor:
+    """Get or create the executor of a model, configured from the environment."""
+    if name not in MODELS:
+        raise ValueError(f"unknown model {name}, expected one of {MODELS}")
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ModelExecutor(ModelExecConfig.from_env(name))
+        return _executors[name]
+
+
+def default_intra_op_threads() -> Optional[int]:
+    """
+    The size of the smallest core set the models are pinned to, so that no pinned
+    model runs more threads than it has cores (None if no model is pinned).
+    """
+    core_counts = [
+        len(config.cores)
+        for config in (ModelExecConfig.from_env(name) for name in MODELS)
+        if config.cores
+    ]
+    return min(core_counts) if core_counts else None
+
+
+def configure_cpu_threads():
+    """
+    Size PyTorch's thread pools, which are shared by the whole process, so this is
+    called once at startup, before any model runs:
+        CPU_INTRAOP_THREADS: intra-op threads of every call (default: the size of
+            the smallest pinned core set, or PyTorch's default if no model is pinned).
+            Setting it from a worker thread would change it for all the models.
+        CPU_INTEROP_THREADS: inter-op threads, which can only be set before any
+            inter-op parallel work has started.
+    """
+    intra_op_threads = os.getenv("CPU_INTRAOP_THREADS")
+    intra_op_threads = (
+        int(intra_op_threads) if intra_op_threads else default_intra_op_threads()
+    )
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+
+    threads = os.getenv("CPU_INTEROP_THREADS")
+    if threads:
+        try:
+            torch.set_num_interop_threads(int(threads))
+        except RuntimeError as e:
+            print(f"⚠️ Could not set inter-op threads to {threads}: {e}")
+
+
+def cpu_stats() -> Dict[str, Any]:
+    """Per-model execution settings and CPU usage of the executors created so far."""
+    with _executors_lock:
+        executors = dict(_executors)
+    return {
+        "cpu_count": os.cpu_count(),
+        "intra_op_threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "models": {name: executor.stats() for name, executor in executors.items()},
+    }
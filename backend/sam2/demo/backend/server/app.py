@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+from threading import Thread
 from typing import Any, Generator
 
 from app_conf import (
@@ -11,6 +12,8 @@ from app_conf import (
     GALLERY_PREFIX,
     POSTERS_PATH,
     POSTERS_PREFIX,
+    PROPAGATION_BUFFER_FRAMES,
+    PROPAGATION_BUFFER_POLICY,
     UPLOADS_PATH,
     UPLOADS_PREFIX,
 )
@@ -21,6 +24,7 @@ from flask import Flask, make_response, Request, request, Response, send_from_di
 from flask_cors import CORS
 from inference.data_types import PropagateDataResponse, PropagateInVideoRequest
 from inference.multipart import MultipartResponseBuilder
+from inference.output_buffer import OutputBuffer
 from inference.predictor import InferenceAPI
 from strawberry.flask.views import GraphQLView
 
@@ -92,25 +96,57 @@ def gen_track_with_mask_stream(
     session_id: str,
     start_frame_index: int,
 ) -> Generator[bytes, None, None]:
-    with inference_api.autocast_context():
-        request = PropagateInVideoRequest(
-            type="propagate_in_video",
-            session_id=session_id,
-            start_frame_index=start_frame_index,
-        )
-
-        for chunk in inference_api.propagate_in_video(request=request):
-            yield MultipartResponseBuilder.build(
-                boundary=boundary,
-                headers={
-                    "Content-Type": "application/json; charset=utf-8",
-                    "Frame-Current": "-1",
-                    # Total frames minus the reference frame
-                    "Frame-Total": "-1",
-                    "Mask-Type": "RLE[]",
-                },
-                body=chunk.to_json().encode("UTF-8"),
-            ).get_message()
+    # The propagation runs in a producer thread that writes the encoded frames into a
+    # bounded buffer, which this generator drains as fast as the client reads them, so
+    # that a slow client doesn't slow down the model.
+    buffer = OutputBuffer(PROPAGATION_BUFFER_FRAMES, PROPAGATION_BUFFER_POLICY)
+
+    def produce() -> None:
+        try:
+            with inference_api.autocast_context():
+                request = PropagateInVideoRequest(
+                    type="propagate_in_video",
+                    session_id=session_id,
+                    start_frame_index=start_frame_index,
+                )
+
+                chunks = inference_api.propagate_in_video(request=request)
+                try:
+                    for chunk in chunks:
+                        message = MultipartResponseBuilder.build(
+                            boundary=boundary,
+                            headers={
+                                "Content-Type": "application/json; charset=utf-8",
+                                "Frame-Current": "-1",
+                                # Total frames minus the reference frame
+                                "Frame-Total": "-1",
+                                "Mask-Type": "RLE[]",
+                            },
+                            body=chunk.to_json().encode("UTF-8"),
+                        ).get_message()
+                        if not buffer.put(message):
+                            break  # the client disconnected
+                finally:
+                    chunks.close()
+        except Exception as e:
+            logger.exception(f"propagation failed in session {session_id}")
+            buffer.finish(e)
+        else:
+            buffer.finish()
+        if buffer.num_dropped > 0 or buffer.num_pauses > 0:
+            logger.info(
+                f"propagation output buffer in session {session_id}: "
+                f"{buffer.num_dropped} frames dropped, paused {buffer.num_pauses} "
+                f"times for the client, up to {buffer.max_buffered} frames buffered"
+            )
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        yield from buffer
+    finally:
+        # stops the producer if the client disconnected
+        buffer.close()
 
 
 class MyGraphQLView(GraphQLView):
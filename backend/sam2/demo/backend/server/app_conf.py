@@ -19,6 +19,48 @@ logger.info(f"using model size {MODEL_SIZE}")
 
 FFMPEG_NUM_THREADS = int(os.getenv("FFMPEG_NUM_THREADS", "1"))
 
+# Budget in MiB of the backbone features cached per session, so that revisiting a
+# frame doesn't rerun the image encoder (about 16 MiB per frame in float32, 0 to only
+# keep the last frame). It adds up with the frames buffered per session (see
+# STREAM_VIDEO_FRAMES), so enable it according to the memory of the host, e.g. 512
+FEATURE_CACHE_MAX_MB = int(os.getenv("FEATURE_CACHE_MAX_MB", "0"))
+
+# Whether to keep the cached features in CPU memory (saves GPU memory at the cost of
+# a copy on every cache hit) and/or in float16 (halves their size)
+OFFLOAD_CACHED_FEATURES_TO_CPU = os.getenv("OFFLOAD_CACHED_FEATURES_TO_CPU", "0") == "1"
+CACHED_FEATURES_FP16 = os.getenv("CACHED_FEATURES_FP16", "0") == "1"
+
+# Whether to decode the video frames of a session on demand (holding a bounded window
+# of uint8 frames) instead of decoding the whole video to float32 at session start
+STREAM_VIDEO_FRAMES = os.getenv("STREAM_VIDEO_FRAMES", "1") == "1"
+
+# Number of encoded frames a propagation can produce ahead of the client reading them,
+# and what it does when the client is that far behind: "pause" until the client
+# catches up, or "drop" the oldest frames not sent yet (so that the model time never
+# depends on the client bandwidth, but the client may miss frames)
+PROPAGATION_BUFFER_FRAMES = int(os.getenv("PROPAGATION_BUFFER_FRAMES", "64"))
+PROPAGATION_BUFFER_POLICY = os.getenv("PROPAGATION_BUFFER_POLICY", "pause")
+
+# Number of threads RLE-encoding the masks of the propagated frames, while the model
+# tracks the next frame
+RLE_ENCODING_WORKERS = int(os.getenv("RLE_ENCODING_WORKERS", "2"))
+
+# Sessions unused for longer than this many seconds are closed (0 to keep them until
+# they're closed by the client), checked every SESSION_REAPER_INTERVAL_SECONDS
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_REAPER_INTERVAL_SECONDS = float(
+    os.getenv("SESSION_REAPER_INTERVAL_SECONDS", "60")
+)
+
+# Budget in MiB of the memory held by all live sessions (0 for no budget). Beyond it,
+# the least recently used sessions that have been idle for at least
+# SESSION_MIN_IDLE_SECONDS are evicted, and new sessions are rejected if that's not
+# enough. With SAVE_EVICTED_SESSIONS, evicted sessions are saved to disk and restored
+# on their next request.
+SESSIONS_MAX_MEMORY_MB = int(os.getenv("SESSIONS_MAX_MEMORY_MB", "0"))
+SESSION_MIN_IDLE_SECONDS = float(os.getenv("SESSION_MIN_IDLE_SECONDS", "30"))
+SAVE_EVICTED_SESSIONS = os.getenv("SAVE_EVICTED_SESSIONS", "1") == "1"
+
 # Path for all data used in API
 DATA_PATH = Path(os.getenv("DATA_PATH", "/data"))
 
@@ -48,8 +90,12 @@ POSTERS_PREFIX = "posters"
 # Path where all posters are stored
 POSTERS_PATH = DATA_PATH / POSTERS_PREFIX
 
+# Path where saved inference sessions are stored
+SESSIONS_PATH = DATA_PATH / "sessions"
+
 # Make sure any of those paths exist
 os.makedirs(DATA_PATH, exist_ok=True)
 os.makedirs(GALLERY_PATH, exist_ok=True)
 os.makedirs(UPLOADS_PATH, exist_ok=True)
 os.makedirs(POSTERS_PATH, exist_ok=True)
+os.makedirs(SESSIONS_PATH, exist_ok=True)
@@ -0,0 +1,51 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from pycocotools.mask import encode as encode_masks
+
+
+def masks_to_host(
+    video_res_masks: torch.Tensor, score_thresh: float
+) -> Tuple[torch.Tensor, Optional[torch.cuda.Event]]:
+    """
+    Threshold the [N, 1, H, W] mask logits of a frame on their device and start copying
+    the binary masks of all the objects to the host at once. On CUDA, the copy goes to
+    pinned memory without blocking, and the returned event marks its completion.
+
+    The masks are returned as a [N, W, H] tensor, whose numpy transpose is the
+    Fortran-order [H, W, N] array that pycocotools encodes in a single call. On a GPU,
+    they're laid out that way (as uint8) on the device. Otherwise, they're laid out by
+    `encode_host_masks`, so that the copy runs in the encoding thread.
+    """
+    masks = (video_res_masks > score_thresh)[:, 0].permute(0, 2, 1)
+    if masks.device.type != "cuda":
+        return masks.cpu(), None
+    masks = masks.to(torch.uint8).contiguous()
+    host_masks = torch.empty(masks.shape, dtype=torch.uint8, pin_memory=True)
+    host_masks.copy_(masks, non_blocking=True)
+    copied = torch.cuda.Event()
+    copied.record()
+    return host_masks, copied
+
+
+def encode_host_masks(
+    host_masks: torch.Tensor, copied: Optional[torch.cuda.Event] = None
+) -> List[Dict[str, Any]]:
+    """
+    RLE-encode the masks returned by `masks_to_host` (waiting for their copy to end),
+    returning the {"size": [H, W], "counts": str} RLE of each object.
+    """
+    if copied is not None:
+        copied.synchronize()
+    # (a no-op for the masks laid out on a GPU)
+    masks = np.asfortranarray(host_masks.numpy().transpose(2, 1, 0), dtype=np.uint8)
+    mask_rles = encode_masks(masks)
+    for mask_rle in mask_rles:
+        mask_rle["counts"] = mask_rle["counts"].decode()
+    return mask_rles
@@ -0,0 +1,85 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import deque
+from threading import Condition
+from typing import Any, Deque, Iterator, Optional
+
+
+class OutputBuffer:
+    """
+    A bounded FIFO of outputs between a producer thread (e.g. a propagation) and a
+    consumer (e.g. the HTTP response streaming them to a client), so that the producer
+    doesn't wait for each output to be consumed.
+
+    When the buffer is full, the "pause" policy makes the producer wait for the
+    consumer to catch up, and the "drop" policy drops the oldest buffered output so
+    that the producer never waits.
+    """
+
+    POLICIES = ("pause", "drop")
+
+    def __init__(self, max_items: int, policy: str = "pause") -> None:
+        if policy not in self.POLICIES:
+            raise ValueError(f"invalid output buffer policy: {policy}")
+        assert max_items >= 1
+        self.max_items = max_items
+        self.policy = policy
+        self._items: Deque[Any] = deque()
+        self._cond = Condition()
+        self._finished = False
+        self._closed = False
+        self._exception: Optional[BaseException] = None
+        self.num_dropped = 0
+        self.num_pauses = 0
+        self.max_buffered = 0
+
+    def put(self, item: Any) -> bool:
+        """
+        Add an output (from the producer). Returns False if the consumer is gone, in
+        which case the producer should stop.
+        """
+        with self._cond:
+            if self.policy == "pause" and len(self._items) >= self.max_items:
+                self.num_pauses += 1
+                while len(self._items) >= self.max_items and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                return False
+            if len(self._items) >= self.max_items:
+                self._items.popleft()
+                self.num_dropped += 1
+            self._items.append(item)
+            self.max_buffered = max(self.max_buffered, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def finish(self, exception: Optional[BaseException] = None) -> None:
+        """Mark the end of the outputs (from the producer), optionally with an error."""
+        with self._cond:
+            self._finished = True
+            self._exception = exception
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Stop consuming (e.g. when the client disconnects), which stops the producer."""
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
+    def __iter__(self) -> Iterator[Any]:
+        """Consume the outputs until the producer finishes, raising its error if any."""
+        while True:
+            with self._cond:
+                while len(self._items) == 0 and not self._finished:
+                    self._cond.wait()
+                if len(self._items) == 0:
+                    if self._exception is not None:
+                        raise RuntimeError("Failure in producer") from self._exception
+                    return
+                item = self._items.popleft()
+                self._cond.notify_all()
+            yield item
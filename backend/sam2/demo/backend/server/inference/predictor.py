@@ -6,14 +6,29 @@
 import contextlib
 import logging
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from threading import Lock
-from typing import Any, Dict, Generator, List
+from threading import Thread
+from typing import Any, Dict, Generator, List, Optional
 
-import numpy as np
 import torch
-from app_conf import APP_ROOT, MODEL_SIZE
+from app_conf import (
+    APP_ROOT,
+    CACHED_FEATURES_FP16,
+    FEATURE_CACHE_MAX_MB,
+    MODEL_SIZE,
+    OFFLOAD_CACHED_FEATURES_TO_CPU,
+    RLE_ENCODING_WORKERS,
+    SAVE_EVICTED_SESSIONS,
+    SESSION_MIN_IDLE_SECONDS,
+    SESSION_REAPER_INTERVAL_SECONDS,
+    SESSION_TTL_SECONDS,
+    SESSIONS_MAX_MEMORY_MB,
+    SESSIONS_PATH,
+    STREAM_VIDEO_FRAMES,
+)
 from inference.data_types import (
     AddMaskRequest,
     AddPointsRequest,
@@ -24,16 +39,24 @@ from inference.data_types import (
     ClearPointsInVideoResponse,
     CloseSessionRequest,
     CloseSessionResponse,
+    LoadSessionRequest,
+    LoadSessionResponse,
     Mask,
     PropagateDataResponse,
     PropagateDataValue,
     PropagateInVideoRequest,
     RemoveObjectRequest,
     RemoveObjectResponse,
+    RenewSessionRequest,
+    RenewSessionResponse,
+    SaveSessionRequest,
+    SaveSessionResponse,
     StartSessionRequest,
     StartSessionResponse,
 )
-from pycocotools.mask import decode as decode_masks, encode as encode_masks
+from inference.mask_encoding import encode_host_masks, masks_to_host
+from inference.scheduler import InferenceScheduler
+from pycocotools.mask import decode as decode_masks
 from sam2.build_sam import build_sam2_video_predictor
 
 
@@ -89,7 +112,17 @@ class InferenceAPI:
         self.predictor = build_sam2_video_predictor(
             model_cfg, checkpoint, device=device
         )
-        self.inference_lock = Lock()
+        # interleaves the per-frame work of the sessions on the model
+        self.scheduler = InferenceScheduler()
+        # RLE-encodes the masks of propagated frames off the tracking thread
+        self.rle_pool = ThreadPoolExecutor(
+            max_workers=RLE_ENCODING_WORKERS, thread_name_prefix="rle"
+        )
+
+        # close the sessions left idle (e.g. by abandoned browser tabs)
+        if SESSION_TTL_SECONDS > 0:
+            self.reaper_thread = Thread(target=self.__reap_idle_sessions, daemon=True)
+            self.reaper_thread.start()
 
     def autocast_context(self):
         if self.device.type == "cuda":
@@ -98,29 +131,88 @@ class InferenceAPI:
             return contextlib.nullcontext()
 
     def start_session(self, request: StartSessionRequest) -> StartSessionResponse:
-        with self.autocast_context(), self.inference_lock:
-            session_id = str(uuid.uuid4())
+        session_id = str(uuid.uuid4())
+        with self.autocast_context(), self.scheduler.turn(session_id, interactive=True):
+            # admission control: reject the session if evicting idle sessions doesn't
+            # free up some of the memory budget
+            if not self.__enforce_memory_budget(headroom=True):
+                raise RuntimeError(
+                    "Cannot start a new session: the sessions memory budget is used "
+                    f"by active sessions; {self.__get_session_stats()}"
+                )
             # for MPS devices, we offload the video frames to CPU by default to avoid
             # memory fragmentation in MPS (which sometimes crashes the entire process)
             offload_video_to_cpu = self.device.type == "mps"
             inference_state = self.predictor.init_state(
                 request.path,
                 offload_video_to_cpu=offload_video_to_cpu,
+                async_loading_frames=STREAM_VIDEO_FRAMES,
+                **self.__feature_cache_options(),
             )
-            self.session_states[session_id] = {
-                "canceled": False,
-                "state": inference_state,
-            }
+            self.__add_session(session_id, inference_state)
+            self.__enforce_memory_budget(keep_session_id=session_id)
             return StartSessionResponse(session_id=session_id)
 
+    def save_session(self, request: SaveSessionRequest) -> SaveSessionResponse:
+        """
+        Save the prompts and tracking outputs (including the memory features) of a
+        session to disk, without its video frames, so that it can be restored with
+        `load_session` (e.g. after it's evicted from memory) without tracking again.
+        """
+        session_id = request.session_id
+        with self.autocast_context(), self.__session_turn(session_id):
+            session = self.__get_session(session_id)
+            path = self.__get_session_path(session_id)
+            self.predictor.save_state(session["state"], path)
+            logger.info(
+                f"saved session {session_id} to {path} "
+                f"({os.path.getsize(path) // 1024**2} MiB)"
+            )
+            return SaveSessionResponse(session_id=session_id)
+
+    def load_session(self, request: LoadSessionRequest) -> LoadSessionResponse:
+        """
+        Restore a session saved with `save_session` (its video frames are loaded again
+        from the video file). A session that's still in memory is kept as is. Sessions
+        evicted from memory are also restored on any other request.
+        """
+        with self.autocast_context(), self.__session_turn(request.session_id):
+            self.__get_session(request.session_id)
+            return LoadSessionResponse(session_id=request.session_id)
+
+    def renew_session(self, request: RenewSessionRequest) -> RenewSessionResponse:
+        """Mark a session as used, e.g. while its user is idle but still on the page."""
+        session = self.session_states.get(request.session_id, None)
+        path = self.__get_session_path(request.session_id)
+        if session is not None:
+            session["last_use_time"] = time.time()
+        elif os.path.exists(path):
+            # an evicted session: keep its saved state from expiring
+            os.utime(path)
+        else:
+            raise RuntimeError(
+                f"Cannot find session {request.session_id}; it might have expired"
+            )
+        return RenewSessionResponse(session_id=request.session_id)
+
     def close_session(self, request: CloseSessionRequest) -> CloseSessionResponse:
-        is_successful = self.__clear_session_state(request.session_id)
+        session_id = request.session_id
+        # stop any ongoing propagation, which holds the session until it ends
+        session = self.session_states.get(session_id, None)
+        if session is not None:
+            session["canceled"] = True
+        with self.__session_turn(session_id):
+            is_successful = self.__clear_session_state(session_id)
+            path = self.__get_session_path(session_id)
+            if os.path.exists(path):
+                os.remove(path)
+        self.scheduler.remove_session(session_id)
         return CloseSessionResponse(success=is_successful)
 
     def add_points(
         self, request: AddPointsRequest, test: str = ""
     ) -> PropagateDataResponse:
-        with self.autocast_context(), self.inference_lock:
+        with self.autocast_context(), self.__session_turn(request.session_id):
             session = self.__get_session(request.session_id)
             inference_state = session["state"]
 
@@ -141,11 +233,7 @@ class InferenceAPI:
                 normalize_coords=False,
             )
 
-            masks_binary = (masks > self.score_thresh)[:, 0].cpu().numpy()
-
-            rle_mask_list = self.__get_rle_mask_list(
-                object_ids=object_ids, masks=masks_binary
-            )
+            rle_mask_list = self.__get_rle_mask_list(object_ids=object_ids, masks=masks)
 
             return PropagateDataResponse(
                 frame_index=frame_idx,
@@ -158,7 +246,7 @@ class InferenceAPI:
         - mask is a numpy array of shape [H_im, W_im] (containing 1 for foreground and 0 for background).
         Note: providing an input mask would overwrite any previous input points on this frame.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.autocast_context(), self.__session_turn(request.session_id):
             session_id = request.session_id
             frame_idx = request.frame_index
             obj_id = request.object_id
@@ -181,10 +269,8 @@ class InferenceAPI:
                 obj_id=obj_id,
                 mask=torch.tensor(mask > 0),
             )
-            masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-
             rle_mask_list = self.__get_rle_mask_list(
-                object_ids=obj_ids, masks=masks_binary
+                object_ids=obj_ids, masks=video_res_masks
             )
 
             return PropagateDataResponse(
@@ -198,7 +284,7 @@ class InferenceAPI:
         """
         Remove all input points in a specific frame.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.autocast_context(), self.__session_turn(request.session_id):
             session_id = request.session_id
             frame_idx = request.frame_index
             obj_id = request.object_id
@@ -213,10 +299,8 @@ class InferenceAPI:
                     inference_state, frame_idx, obj_id
                 )
             )
-            masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-
             rle_mask_list = self.__get_rle_mask_list(
-                object_ids=obj_ids, masks=masks_binary
+                object_ids=obj_ids, masks=video_res_masks
             )
 
             return PropagateDataResponse(
@@ -230,7 +314,7 @@ class InferenceAPI:
         """
         Remove all input points in all frames throughout the video.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.autocast_context(), self.__session_turn(request.session_id):
             session_id = request.session_id
             logger.info(f"clear all inputs across the video in session {session_id}")
             session = self.__get_session(session_id)
@@ -242,7 +326,7 @@ class InferenceAPI:
         """
         Remove an object id from the tracking state.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.autocast_context(), self.__session_turn(request.session_id):
             session_id = request.session_id
             obj_id = request.object_id
             logger.info(f"remove object in session {session_id}: {obj_id=}")
@@ -254,9 +338,8 @@ class InferenceAPI:
 
             results = []
             for frame_index, video_res_masks in updated_frames:
-                masks = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
                 rle_mask_list = self.__get_rle_mask_list(
-                    object_ids=new_obj_ids, masks=masks
+                    object_ids=new_obj_ids, masks=video_res_masks
                 )
                 results.append(
                     PropagateDataResponse(
@@ -282,17 +365,20 @@ class InferenceAPI:
         # Note that as this method is a generator, we also need to use autocast_context
         # in caller to this method to ensure that it's called under the correct context
         # (we've added `autocast_context` to `gen_track_with_mask_stream` in app.py).
-        with self.autocast_context(), self.inference_lock:
+        # The session is held for the whole propagation (its other requests wait until
+        # it ends), but the model is only held for one frame at a time, so that other
+        # sessions' clicks and propagations run in between.
+        with self.autocast_context(), self.scheduler.session_lock(session_id):
             logger.info(
                 f"propagate in video in session {session_id}: "
                 f"{propagation_direction=}, {start_frame_idx=}, {max_frame_num_to_track=}"
             )
 
             try:
-                session = self.__get_session(session_id)
+                with self.scheduler.turn(session_id, interactive=False):
+                    session = self.__get_session(session_id)
                 session["canceled"] = False
 
-                inference_state = session["state"]
                 if propagation_direction not in ["both", "forward", "backward"]:
                     raise ValueError(
                         f"invalid propagation direction: {propagation_direction}"
@@ -300,113 +386,340 @@ class InferenceAPI:
 
                 # First doing the forward propagation
                 if propagation_direction in ["both", "forward"]:
-                    for outputs in self.predictor.propagate_in_video(
-                        inference_state=inference_state,
-                        start_frame_idx=start_frame_idx,
-                        max_frame_num_to_track=max_frame_num_to_track,
+                    yield from self.__propagate_in_direction(
+                        session_id,
+                        session,
+                        start_frame_idx,
+                        max_frame_num_to_track,
                         reverse=False,
-                    ):
-                        if session["canceled"]:
-                            return None
-
-                        frame_idx, obj_ids, video_res_masks = outputs
-                        masks_binary = (
-                            (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                        )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
+                    )
 
                 # Then doing the backward propagation (reverse in time)
                 if propagation_direction in ["both", "backward"]:
-                    for outputs in self.predictor.propagate_in_video(
-                        inference_state=inference_state,
-                        start_frame_idx=start_frame_idx,
-                        max_frame_num_to_track=max_frame_num_to_track,
+                    yield from self.__propagate_in_direction(
+                        session_id,
+                        session,
+                        start_frame_idx,
+                        max_frame_num_to_track,
                         reverse=True,
-                    ):
-                        if session["canceled"]:
-                            return None
+                    )
+            finally:
+                with self.scheduler.turn(session_id, interactive=False):
+                    session = self.session_states.get(session_id, None)
+                    if session is not None:
+                        session["last_use_time"] = time.time()
+                        # the tracking outputs added to this session might exceed the budget
+                        self.__enforce_memory_budget(keep_session_id=session_id)
+                    # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
+                    # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
+                    logger.info(
+                        f"propagation ended in session {session_id}; {self.__get_session_stats()}"
+                    )
 
+    def __propagate_in_direction(
+        self,
+        session_id: str,
+        session: Dict[str, Any],
+        start_frame_idx: int,
+        max_frame_num_to_track: Optional[int],
+        reverse: bool,
+    ) -> Generator[PropagateDataResponse, None, None]:
+        """
+        Propagate in one direction, taking a turn on the model for each frame. The masks
+        of a frame are RLE-encoded in `rle_pool` while the next frame is tracked.
+        """
+        if session["canceled"]:
+            return
+        frames = self.predictor.propagate_in_video(
+            inference_state=session["state"],
+            start_frame_idx=start_frame_idx,
+            max_frame_num_to_track=max_frame_num_to_track,
+            reverse=reverse,
+        )
+        # the encoding of the previous frame, yielded once the next frame is tracked
+        pending = None
+        try:
+            while True:
+                encoding = None
+                with self.scheduler.turn(session_id, interactive=False):
+                    outputs = next(frames, None)
+                    if outputs is not None:
                         frame_idx, obj_ids, video_res_masks = outputs
-                        masks_binary = (
-                            (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                        )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
+                        host_masks, copied = masks_to_host(
+                            video_res_masks, self.score_thresh
                         )
+                if session["canceled"]:
+                    return
+                if outputs is not None:
+                    encoding = self.rle_pool.submit(
+                        self.__get_frame_response,
+                        frame_idx,
+                        obj_ids,
+                        host_masks,
+                        copied,
+                    )
 
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
-            finally:
-                # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
-                # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
-                logger.info(
-                    f"propagation ended in session {session_id}; {self.__get_session_stats()}"
-                )
+                if pending is not None:
+                    yield pending.result()
+                if encoding is None:
+                    return
+                pending = encoding
+        finally:
+            if pending is not None:
+                pending.cancel()
+            frames.close()
 
     def cancel_propagate_in_video(
         self, request: CancelPropagateInVideoRequest
     ) -> CancelPorpagateResponse:
-        session = self.__get_session(request.session_id)
+        # (a session evicted from memory isn't being propagated)
+        session = self.__get_session(request.session_id, restore=False)
         session["canceled"] = True
         return CancelPorpagateResponse(success=True)
 
     def __get_rle_mask_list(
-        self, object_ids: List[int], masks: np.ndarray
+        self, object_ids: List[int], masks: torch.Tensor
     ) -> List[PropagateDataValue]:
         """
-        Return a list of data values, i.e. list of object/mask combos.
+        Return a list of data values, i.e. list of object/mask combos, from the
+        [N, 1, H, W] mask logits of a frame.
+        """
+        return self.__get_data_values(
+            object_ids, *masks_to_host(masks, self.score_thresh)
+        )
+
+    def __get_frame_response(
+        self,
+        frame_idx: int,
+        object_ids: List[int],
+        host_masks: torch.Tensor,
+        copied: Optional[torch.cuda.Event],
+    ) -> PropagateDataResponse:
+        """Encode the masks of a propagated frame (in `rle_pool`)."""
+        return PropagateDataResponse(
+            frame_index=frame_idx,
+            results=self.__get_data_values(object_ids, host_masks, copied),
+        )
+
+    def __get_data_values(
+        self,
+        object_ids: List[int],
+        host_masks: torch.Tensor,
+        copied: Optional[torch.cuda.Event],
+    ) -> List[PropagateDataValue]:
+        """
+        Create the data values of the object/mask combos of a frame, encoding all
+        the masks at once.
         """
         return [
-            self.__get_mask_for_object(object_id=object_id, mask=mask)
-            for object_id, mask in zip(object_ids, masks)
+            PropagateDataValue(
+                object_id=object_id,
+                mask=Mask(
+                    size=mask_rle["size"],
+                    counts=mask_rle["counts"],
+                ),
+            )
+            for object_id, mask_rle in zip(
+                object_ids, encode_host_masks(host_masks, copied)
+            )
         ]
 
-    def __get_mask_for_object(
-        self, object_id: int, mask: np.ndarray
-    ) -> PropagateDataValue:
+    @contextlib.contextmanager
+    def __session_turn(self, session_id: str, interactive: bool = True):
+        """Hold a session (waiting for its propagation to end) and a turn on the model."""
+        with self.scheduler.session_lock(session_id), self.scheduler.turn(
+            session_id, interactive
+        ):
+            yield
+
+    def __feature_cache_options(self) -> Dict[str, Any]:
+        return {
+            "feature_cache_max_bytes": FEATURE_CACHE_MAX_MB * 1024**2,
+            "offload_cached_features_to_cpu": OFFLOAD_CACHED_FEATURES_TO_CPU,
+            "cached_features_fp16": CACHED_FEATURES_FP16,
+        }
+
+    def __add_session(self, session_id: str, inference_state: Dict[str, Any]):
+        now = time.time()
+        self.session_states[session_id] = {
+            "canceled": False,
+            "state": inference_state,
+            "start_time": now,
+            "last_use_time": now,
+        }
+
+    def __get_session_path(self, session_id: str) -> Path:
+        # session ids come from clients, so we only take their file name part
+        return SESSIONS_PATH / f"{Path(session_id).name}.pt"
+
+    def __get_session(self, session_id: str, restore: bool = True):
         """
-        Create a data value for an object/mask combo.
+        Get a live session. If `restore`, a session evicted from memory is restored
+        from its saved state (which must be done while holding the inference lock).
         """
-        mask_rle = encode_masks(np.array(mask, dtype=np.uint8, order="F"))
-        mask_rle["counts"] = mask_rle["counts"].decode()
-        return PropagateDataValue(
-            object_id=object_id,
-            mask=Mask(
-                size=mask_rle["size"],
-                counts=mask_rle["counts"],
-            ),
-        )
-
-    def __get_session(self, session_id: str):
         session = self.session_states.get(session_id, None)
+        if session is None and restore:
+            session = self.__restore_session(session_id)
         if session is None:
             raise RuntimeError(
                 f"Cannot find session {session_id}; it might have expired"
             )
+        session["last_use_time"] = time.time()
         return session
 
+    def __restore_session(self, session_id: str):
+        path = self.__get_session_path(session_id)
+        if not os.path.exists(path):
+            return None
+        if not self.__enforce_memory_budget(headroom=True):
+            raise RuntimeError(
+                f"Cannot restore session {session_id}: the sessions memory budget is "
+                f"used by active sessions; {self.__get_session_stats()}"
+            )
+        inference_state = self.predictor.load_state(
+            path, **self.__feature_cache_options()
+        )
+        self.__add_session(session_id, inference_state)
+        self.__enforce_memory_budget(keep_session_id=session_id)
+        logger.info(
+            f"restored session {session_id} from {path}; {self.__get_session_stats()}"
+        )
+        return self.session_states[session_id]
+
+    def __get_session_nbytes(self, session) -> int:
+        return self.predictor.state_nbytes(session["state"])["total"]
+
+    def __enforce_memory_budget(
+        self, keep_session_id: Optional[str] = None, headroom: bool = False
+    ) -> bool:
+        """
+        Evict the least recently used sessions idle for at least SESSION_MIN_IDLE_SECONDS
+        (other than `keep_session_id`) while the live sessions exceed the memory budget
+        (or use all of it, with `headroom`). Returns whether they're within the budget
+        (or below it, with `headroom`).
+        """
+        if SESSIONS_MAX_MEMORY_MB <= 0:
+            return True
+        budget = SESSIONS_MAX_MEMORY_MB * 1024**2
+        session_nbytes = {
+            session_id: self.__get_session_nbytes(session)
+            for session_id, session in self.session_states.items()
+        }
+        total = sum(session_nbytes.values())
+
+        def within_budget():
+            return total < budget if headroom else total <= budget
+
+        now = time.time()
+        idle_sessions = sorted(
+            (session["last_use_time"], session_id)
+            for session_id, session in self.session_states.items()
+            if session_id != keep_session_id
+            and now - session["last_use_time"] >= SESSION_MIN_IDLE_SECONDS
+            # (e.g. propagating, or waiting for a turn)
+            and not self.scheduler.is_session_busy(session_id)
+        )
+        for _, session_id in idle_sessions:
+            if within_budget():
+                break
+            if self.__evict_session(session_id):
+                total -= session_nbytes[session_id]
+        return within_budget()
+
+    def __evict_session(self, session_id: str) -> bool:
+        """
+        Remove a session from memory (saving it first, with SAVE_EVICTED_SESSIONS).
+        The session is kept in memory if it can't be saved. Returns whether it was
+        evicted.
+        """
+        session = self.session_states[session_id]
+        if SAVE_EVICTED_SESSIONS:
+            path = self.__get_session_path(session_id)
+            # (so that a failed save never leaves a partial session to restore)
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            try:
+                self.predictor.save_state(session["state"], tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                logger.exception(f"failed to save session {session_id}, not evicted")
+                tmp_path.unlink(missing_ok=True)
+                return False
+        self.session_states.pop(session_id)
+        logger.info(
+            f"evicted session {session_id} from memory "
+            f"({'saved' if SAVE_EVICTED_SESSIONS else 'not saved'}); "
+            f"{self.__get_session_stats()}"
+        )
+        return True
+
+    def __reap_idle_sessions(self):
+        """Periodically close the sessions unused for longer than SESSION_TTL_SECONDS."""
+        while True:
+            time.sleep(SESSION_REAPER_INTERVAL_SECONDS)
+            try:
+                deadline = time.time() - SESSION_TTL_SECONDS
+                with self.scheduler.turn(None, interactive=False):
+                    expired_session_ids = [
+                        session_id
+                        for session_id, session in self.session_states.items()
+                        if session["last_use_time"] < deadline
+                        and not self.scheduler.is_session_busy(session_id)
+                    ]
+                    for session_id in expired_session_ids:
+                        logger.info(
+                            f"closing session {session_id} unused for more than "
+                            f"{SESSION_TTL_SECONDS} s"
+                        )
+                        self.__clear_session_state(session_id)
+                        self.__get_session_path(session_id).unlink(missing_ok=True)
+                        self.scheduler.remove_session(session_id)
+                    # and the saved states of evicted sessions (and any partial
+                    # one left by a crash while saving)
+                    for path in SESSIONS_PATH.glob("*.pt*"):
+                        if path.stat().st_mtime < deadline:
+                            path.unlink(missing_ok=True)
+            except Exception:
+                logger.exception("failed to close idle sessions")
+
     def __get_session_stats(self):
         """Get a statistics string for live sessions and their GPU usage."""
-        # print both the session ids and their video frame numbers
-        live_session_strs = [
-            f"'{session_id}' ({session['state']['num_frames']} frames, "
-            f"{len(session['state']['obj_ids'])} objects)"
-            for session_id, session in self.session_states.items()
-        ]
+        # print the session ids, their video frame numbers and feature cache usage
+        live_session_strs = []
+        total_nbytes = 0
+        for session_id, session in self.session_states.items():
+            cache_stats = session["state"]["cached_features"].stats()
+            nbytes = self.predictor.state_nbytes(session["state"])
+            total_nbytes += nbytes["total"]
+            queueing = self.scheduler.queueing_stats(session_id)
+            live_session_strs.append(
+                f"'{session_id}' ({session['state']['num_frames']} frames, "
+                f"{len(session['state']['obj_ids'])} objects, "
+                f"{nbytes['total'] // 1024**2} MiB held: "
+                f"{nbytes['frames'] // 1024**2} MiB of frames, "
+                f"{nbytes['features'] // 1024**2} MiB of features, "
+                f"{nbytes['outputs'] // 1024**2} MiB of outputs, "
+                f"idle for {time.time() - session['last_use_time']:.0f} s, "
+                f"queued {queueing['interactive']['mean_ms']:.0f} ms on average "
+                f"(max {queueing['interactive']['max_ms']:.0f} ms) over "
+                f"{queueing['interactive']['count']} interactive requests and "
+                f"{queueing['background']['mean_ms']:.0f} ms "
+                f"(max {queueing['background']['max_ms']:.0f} ms) over "
+                f"{queueing['background']['count']} propagation steps, feature cache: "
+                f"{cache_stats['frames']} frames in {cache_stats['bytes'] // 1024**2} MiB, "
+                f"{cache_stats['hit_rate']:.0%} hit rate over "
+                f"{cache_stats['hits'] + cache_stats['misses']} lookups, "
+                f"{cache_stats['evictions']} evictions)"
+            )
         session_stats_str = (
             "Test String Here - -"
-            f"live sessions: [{', '.join(live_session_strs)}], GPU memory: "
+            f"live sessions: [{', '.join(live_session_strs)}], "
+            f"{total_nbytes // 1024**2} MiB held by sessions"
+            + (
+                f" (budget: {SESSIONS_MAX_MEMORY_MB} MiB)"
+                if SESSIONS_MAX_MEMORY_MB > 0
+                else ""
+            )
+            + ", GPU memory: "
             f"{torch.cuda.memory_allocated() // 1024**2} MiB used and "
             f"{torch.cuda.memory_reserved() // 1024**2} MiB reserved"
             f" (max over time: {torch.cuda.max_memory_allocated() // 1024**2} MiB used "
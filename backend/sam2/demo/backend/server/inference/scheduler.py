@@ -0,0 +1,135 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import itertools
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from threading import Condition, Lock
+from typing import Dict, Iterator, List, Optional
+
+
+@dataclass
+class _Ticket:
+    session_id: Optional[str]
+    interactive: bool
+    seq: int
+
+
+class QueueingStats:
+    """The time spent waiting for turns by one kind of work of a session."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def add(self, wait_s: float) -> None:
+        self.count += 1
+        self.total_s += wait_s
+        self.max_s = max(self.max_s, wait_s)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total_s / self.count if self.count > 0 else 0.0,
+            "max_ms": 1000 * self.max_s,
+        }
+
+
+class InferenceScheduler:
+    """
+    Grants turns on the model to one work item at a time, so that the work of
+    different sessions is interleaved rather than serialized: a propagation takes a
+    turn per frame instead of holding the model until it ends.
+
+    Interactive work (e.g. adding clicks) is granted before any background work
+    (propagation frames), in arrival order. Background work is granted to the waiting
+    session that was least recently granted a turn, so that concurrent propagations
+    progress in round robin. Each session also has a lock, held over multi-turn work
+    (e.g. a whole propagation) so that its other requests wait until it ends.
+    """
+
+    def __init__(self) -> None:
+        self._cond = Condition()
+        self._busy = False
+        self._waiting: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._grants = itertools.count()
+        # session id -> number of the last turn granted to it
+        self._last_granted: Dict[Optional[str], int] = {}
+        # session id -> {"interactive" or "background": queueing stats}
+        self._queueing: Dict[Optional[str], Dict[str, QueueingStats]] = defaultdict(
+            lambda: {"interactive": QueueingStats(), "background": QueueingStats()}
+        )
+        self._session_locks: Dict[str, Lock] = {}
+        self._session_locks_lock = Lock()
+
+    def session_lock(self, session_id: str) -> Lock:
+        """The lock to hold over the work on a session (acquire it before turns)."""
+        with self._session_locks_lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = Lock()
+            return lock
+
+    def is_session_busy(self, session_id: str) -> bool:
+        """Whether a request is working on the session (e.g. propagating it)."""
+        with self._session_locks_lock:
+            lock = self._session_locks.get(session_id)
+        return lock is not None and lock.locked()
+
+    def _next_ticket(self) -> _Ticket:
+        interactive = [t for t in self._waiting if t.interactive]
+        if len(interactive) > 0:
+            return min(interactive, key=lambda t: t.seq)
+        return min(
+            self._waiting,
+            key=lambda t: (self._last_granted.get(t.session_id, -1), t.seq),
+        )
+
+    @contextlib.contextmanager
+    def turn(self, session_id: Optional[str], interactive: bool) -> Iterator[None]:
+        """Wait for a turn on the model and hold it in the context."""
+        start = time.perf_counter()
+        with self._cond:
+            ticket = _Ticket(session_id, interactive, next(self._seq))
+            self._waiting.append(ticket)
+            try:
+                while self._busy or self._next_ticket() is not ticket:
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            self._busy = True
+            self._last_granted[session_id] = next(self._grants)
+            kind = "interactive" if interactive else "background"
+            self._queueing[session_id][kind].add(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def queueing_stats(self, session_id: Optional[str]) -> Dict[str, Dict[str, float]]:
+        """The number of turns of a session and their mean and max waiting times."""
+        with self._cond:
+            queueing = self._queueing.get(session_id)
+            if queueing is None:
+                queueing = {
+                    "interactive": QueueingStats(),
+                    "background": QueueingStats(),
+                }
+            return {kind: stats.to_dict() for kind, stats in queueing.items()}
+
+    def remove_session(self, session_id: str) -> None:
+        """Forget a closed session."""
+        with self._cond:
+            self._last_granted.pop(session_id, None)
+            self._queueing.pop(session_id, None)
+        with self._session_locks_lock:
+            self._session_locks.pop(session_id, None)
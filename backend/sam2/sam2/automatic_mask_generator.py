@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 # Adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/automatic_mask_generator.py
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
@@ -23,10 +24,13 @@ from sam2.utils.amg import (
     coco_encode_rle,
     generate_crop_boxes,
     is_box_near_crop_edge,
+    mask_crop_to_rle,
     mask_to_rle_pytorch,
     MaskData,
-    remove_small_regions,
+    remove_small_regions_in_crop,
+    rle_to_bbox_crop,
     rle_to_mask,
+    rle_to_mask_crop,
     uncrop_boxes_xyxy,
     uncrop_masks,
     uncrop_points,
@@ -53,6 +57,7 @@ class SAM2AutomaticMaskGenerator:
         output_mode: str = "binary_mask",
         use_m2m: bool = False,
         multimask_output: bool = True,
+        crops_per_batch: int = 4,
         **kwargs,
     ) -> None:
         """
@@ -96,11 +101,15 @@ class SAM2AutomaticMaskGenerator:
             to remove disconnected regions and holes in masks with area smaller
             than min_mask_region_area. Requires opencv.
           output_mode (str): The form masks are returned in. Can be 'binary_mask',
-            'uncompressed_rle', or 'coco_rle'. 'coco_rle' requires pycocotools.
-            For large resolutions, 'binary_mask' may consume large amounts of
-            memory.
+            'uncompressed_rle', 'coco_rle', or 'bbox_crop'. 'coco_rle' requires
+            pycocotools. For large resolutions, 'binary_mask' may consume large
+            amounts of memory. 'bbox_crop' only keeps each binary mask within its
+            bounding box, which is much smaller for many small objects.
           use_m2m (bool): Whether to add a one step refinement using previous mask predictions.
           multimask_output (bool): Whether to output multimask at each point of the grid.
+          crops_per_batch (int): Sets the number of crops of the same crop layer
+            whose embeddings are computed together in one batched forward pass
+            of the image encoder. Higher numbers may be faster but use more memory.
         """
 
         assert (points_per_side is None) != (
@@ -121,6 +130,7 @@ class SAM2AutomaticMaskGenerator:
             "binary_mask",
             "uncompressed_rle",
             "coco_rle",
+            "bbox_crop",
         ], f"Unknown output_mode {output_mode}."
         if output_mode == "coco_rle":
             try:
@@ -148,6 +158,7 @@ class SAM2AutomaticMaskGenerator:
         self.output_mode = output_mode
         self.use_m2m = use_m2m
         self.multimask_output = multimask_output
+        self.crops_per_batch = crops_per_batch
 
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2AutomaticMaskGenerator":
@@ -178,8 +189,10 @@ class SAM2AutomaticMaskGenerator:
            list(dict(str, any)): A list over records for masks. Each record is
              a dict containing the following keys:
                segmentation (dict(str, any) or np.ndarray): The mask. If
-                 output_mode='binary_mask', is an array of shape HW. Otherwise,
-                 is a dictionary containing the RLE.
+                 output_mode='binary_mask', is an array of shape HW. If
+                 output_mode='bbox_crop', is a dictionary containing the image
+                 'size', the XY 'offset' of the bounding box and the binary
+                 'mask' within it. Otherwise, is a dictionary containing the RLE.
                bbox (list(float)): The box around the mask, in XYWH format.
                area (int): The area in pixels of the mask.
                predicted_iou (float): The model's own prediction of the mask's
@@ -194,7 +207,31 @@ class SAM2AutomaticMaskGenerator:
 
         # Generate masks
         mask_data = self._generate_masks(image)
+        return self._write_mask_records(mask_data)
 
+    @torch.no_grad()
+    def generate_batch(self, images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """
+        Generates masks for a batch of images. The embeddings of all images are
+        computed in a single forward pass of the image encoder, while point grid
+        decoding, filtering and NMS are run separately for each image.
+
+        Arguments:
+          images (list(np.ndarray)): The images to generate masks for, each in
+            HWC uint8 format.
+
+        Returns:
+           list(list(dict(str, any))): For each image, a list over records for
+             masks, in the same format as returned by 'generate'.
+        """
+        full_image_boxes = [[0, 0, image.shape[1], image.shape[0]] for image in images]
+        full_image_datas = self._process_crop_batch(images, full_image_boxes, 0)
+        return [
+            self._write_mask_records(self._generate_crop_layer_masks(image, data))
+            for image, data in zip(images, full_image_datas)
+        ]
+
+    def _write_mask_records(self, mask_data: MaskData) -> List[Dict[str, Any]]:
         # Encode masks
         if self.output_mode == "coco_rle":
             mask_data["segmentations"] = [
@@ -202,6 +239,10 @@ class SAM2AutomaticMaskGenerator:
             ]
         elif self.output_mode == "binary_mask":
             mask_data["segmentations"] = [rle_to_mask(rle) for rle in mask_data["rles"]]
+        elif self.output_mode == "bbox_crop":
+            mask_data["segmentations"] = [
+                rle_to_bbox_crop(rle) for rle in mask_data["rles"]
+            ]
         else:
             mask_data["segmentations"] = mask_data["rles"]
 
@@ -222,16 +263,31 @@ class SAM2AutomaticMaskGenerator:
         return curr_anns
 
     def _generate_masks(self, image: np.ndarray) -> MaskData:
+        orig_h, orig_w = image.shape[:2]
+        data = self._process_crop(image, [0, 0, orig_w, orig_h], 0, (orig_h, orig_w))
+        return self._generate_crop_layer_masks(image, data)
+
+    def _generate_crop_layer_masks(self, image: np.ndarray, data: MaskData) -> MaskData:
+        # The first crop box is always the full image, whose masks are given in data
         orig_size = image.shape[:2]
         crop_boxes, layer_idxs = generate_crop_boxes(
             orig_size, self.crop_n_layers, self.crop_overlap_ratio
         )
 
-        # Iterate over image crops
-        data = MaskData()
-        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
-            crop_data = self._process_crop(image, crop_box, layer_idx, orig_size)
-            data.cat(crop_data)
+        # Iterate over the remaining crops, encoding the crops of each layer in batches
+        for layer_idx in range(1, self.crop_n_layers + 1):
+            layer_crop_boxes = [
+                crop_box
+                for crop_box, crop_layer_idx in zip(crop_boxes, layer_idxs)
+                if crop_layer_idx == layer_idx
+            ]
+            for (batch_crop_boxes,) in batch_iterator(
+                self.crops_per_batch, layer_crop_boxes
+            ):
+                for crop_data in self._process_crop_batch(
+                    [image] * len(batch_crop_boxes), batch_crop_boxes, layer_idx
+                ):
+                    data.cat(crop_data)
 
         # Remove duplicate masks between crops
         if len(crop_boxes) > 1:
@@ -258,9 +314,49 @@ class SAM2AutomaticMaskGenerator:
         # Crop the image and calculate embeddings
         x0, y0, x1, y1 = crop_box
         cropped_im = image[y0:y1, x0:x1, :]
-        cropped_im_size = cropped_im.shape[:2]
         self.predictor.set_image(cropped_im)
+        data = self._process_crop_features(
+            crop_box, cropped_im.shape[:2], crop_layer_idx, orig_size
+        )
+        self.predictor.reset_predictor()
+        return data
 
+    def _process_crop_batch(
+        self,
+        images: List[np.ndarray],
+        crop_boxes: List[List[int]],
+        crop_layer_idx: int,
+    ) -> List[MaskData]:
+        # Crop each image with its crop box and calculate embeddings for all
+        # crops in one forward pass
+        cropped_ims = [
+            image[y0:y1, x0:x1, :]
+            for image, (x0, y0, x1, y1) in zip(images, crop_boxes)
+        ]
+        self.predictor.set_image_batch(cropped_ims)
+        crop_datas = [
+            self._process_crop_features(
+                crop_box,
+                cropped_im.shape[:2],
+                crop_layer_idx,
+                image.shape[:2],
+                img_idx=img_idx,
+            )
+            for img_idx, (image, crop_box, cropped_im) in enumerate(
+                zip(images, crop_boxes, cropped_ims)
+            )
+        ]
+        self.predictor.reset_predictor()
+        return crop_datas
+
+    def _process_crop_features(
+        self,
+        crop_box: List[int],
+        cropped_im_size: Tuple[int, ...],
+        crop_layer_idx: int,
+        orig_size: Tuple[int, ...],
+        img_idx: int = -1,
+    ) -> MaskData:
         # Get points for this crop
         points_scale = np.array(cropped_im_size)[None, ::-1]
         points_for_image = self.point_grids[crop_layer_idx] * points_scale
@@ -269,11 +365,15 @@ class SAM2AutomaticMaskGenerator:
         data = MaskData()
         for (points,) in batch_iterator(self.points_per_batch, points_for_image):
             batch_data = self._process_batch(
-                points, cropped_im_size, crop_box, orig_size, normalize=True
+                points,
+                cropped_im_size,
+                crop_box,
+                orig_size,
+                normalize=True,
+                img_idx=img_idx,
             )
             data.cat(batch_data)
             del batch_data
-        self.predictor.reset_predictor()
 
         # Remove duplicates within this crop.
         keep_by_nms = batched_nms(
@@ -298,6 +398,7 @@ class SAM2AutomaticMaskGenerator:
         crop_box: List[int],
         orig_size: Tuple[int, ...],
         normalize=False,
+        img_idx: int = -1,
     ) -> MaskData:
         orig_h, orig_w = orig_size
 
@@ -316,6 +417,7 @@ class SAM2AutomaticMaskGenerator:
             in_labels[:, None],
             multimask_output=self.multimask_output,
             return_logits=True,
+            img_idx=img_idx,
         )
 
         # Serialize predictions and store in MaskData
@@ -349,7 +451,11 @@ class SAM2AutomaticMaskGenerator:
                 in_points.shape[0], dtype=torch.int, device=in_points.device
             )
             masks, ious = self.refine_with_m2m(
-                in_points, labels, data["low_res_masks"], self.points_per_batch
+                in_points,
+                labels,
+                data["low_res_masks"],
+                self.points_per_batch,
+                img_idx=img_idx,
             )
             data["masks"] = masks.squeeze(1)
             data["iou_preds"] = ious.squeeze(1)
@@ -385,11 +491,16 @@ class SAM2AutomaticMaskGenerator:
 
     @staticmethod
     def postprocess_small_regions(
-        mask_data: MaskData, min_area: int, nms_thresh: float
+        mask_data: MaskData,
+        min_area: int,
+        nms_thresh: float,
+        num_workers: Optional[int] = None,
     ) -> MaskData:
         """
         Removes small disconnected regions and holes in masks, then reruns
-        box NMS to remove any new duplicates.
+        box NMS to remove any new duplicates. Masks are processed within their
+        bounding boxes in a thread pool of num_workers threads (opencv releases
+        the GIL), and RLEs are only recomputed for masks that have changed.
 
         Edits mask_data in place.
 
@@ -398,25 +509,29 @@ class SAM2AutomaticMaskGenerator:
         if len(mask_data["rles"]) == 0:
             return mask_data
 
-        # Filter small disconnected regions and holes
-        new_masks = []
-        scores = []
-        for rle in mask_data["rles"]:
-            mask = rle_to_mask(rle)
-
-            mask, changed = remove_small_regions(mask, min_area, mode="holes")
-            unchanged = not changed
-            mask, changed = remove_small_regions(mask, min_area, mode="islands")
-            unchanged = unchanged and not changed
+        def _process_rle(rle):
+            orig_h, orig_w = rle["size"]
+            mask_crop, crop_box = rle_to_mask_crop(rle)
+            if mask_crop.size == 0:
+                return mask_crop, crop_box, False
+            return remove_small_regions_in_crop(
+                mask_crop, crop_box, orig_h, orig_w, min_area
+            )
 
-            new_masks.append(torch.as_tensor(mask).unsqueeze(0))
-            # Give score=0 to changed masks and score=1 to unchanged masks
-            # so NMS will prefer ones that didn't need postprocessing
-            scores.append(float(unchanged))
+        # Filter small disconnected regions and holes
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_process_rle, mask_data["rles"]))
+        # Give score=0 to changed masks and score=1 to unchanged masks
+        # so NMS will prefer ones that didn't need postprocessing
+        scores = [float(not changed) for _, _, changed in results]
 
         # Recalculate boxes and remove any new duplicates
-        masks = torch.cat(new_masks, dim=0)
-        boxes = batched_mask_to_box(masks)
+        boxes = torch.tensor(
+            [
+                [x0, y0, max(x0, x1 - 1), max(y0, y1 - 1)]
+                for _, (x0, y0, x1, y1), _ in results
+            ]
+        )
         keep_by_nms = batched_nms(
             boxes.float(),
             torch.as_tensor(scores),
@@ -427,14 +542,19 @@ class SAM2AutomaticMaskGenerator:
         # Only recalculate RLEs for masks that have changed
         for i_mask in keep_by_nms:
             if scores[i_mask] == 0.0:
-                mask_torch = masks[i_mask].unsqueeze(0)
-                mask_data["rles"][i_mask] = mask_to_rle_pytorch(mask_torch)[0]
+                mask_crop, crop_box, _ = results[i_mask]
+                orig_h, orig_w = mask_data["rles"][i_mask]["size"]
+                mask_data["rles"][i_mask] = mask_crop_to_rle(
+                    mask_crop, crop_box, orig_h, orig_w
+                )
                 mask_data["boxes"][i_mask] = boxes[i_mask]  # update res directly
         mask_data.filter(keep_by_nms)
 
         return mask_data
 
-    def refine_with_m2m(self, points, point_labels, low_res_masks, points_per_batch):
+    def refine_with_m2m(
+        self, points, point_labels, low_res_masks, points_per_batch, img_idx=-1
+    ):
         new_masks = []
         new_iou_preds = []
 
@@ -447,6 +567,7 @@ class SAM2AutomaticMaskGenerator:
                 mask_input=low_res_mask[:, None, :],
                 multimask_output=False,
                 return_logits=True,
+                img_idx=img_idx,
             )
             new_masks.append(best_masks)
             new_iou_preds.append(best_iou_preds)
@@ -75,9 +75,18 @@ def build_sam2(
     mode="eval",
     hydra_overrides_extra=[],
     apply_postprocessing=True,
+    image_size=None,
     **kwargs,
 ):
 
+    if image_size is not None:
+        # run the model at a different input resolution than it was trained at; the
+        # Hiera position embeddings are interpolated to the resulting feature size
+        assert (
+            image_size % 32 == 0
+        ), f"image_size must be a multiple of 32, got {image_size}"
+        hydra_overrides_extra = hydra_overrides_extra.copy()
+        hydra_overrides_extra += [f"++model.image_size={image_size}"]
     if apply_postprocessing:
         hydra_overrides_extra = hydra_overrides_extra.copy()
         hydra_overrides_extra += [
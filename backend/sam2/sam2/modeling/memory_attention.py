@@ -4,7 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn, Tensor
@@ -63,11 +63,34 @@ class MemoryAttentionLayer(nn.Module):
         tgt = tgt + self.dropout1(tgt2)
         return tgt
 
-    def _forward_ca(self, tgt, memory, query_pos, pos, num_k_exclude_rope=0):
+    def project_memory(self, memory, pos) -> Tuple[Tensor, Tensor]:
+        """Cross-attention keys and values of one memory frame (batch first), see `RoPEAttention.project_memory`."""
+        assert isinstance(self.cross_attn_image, RoPEAttention)
+        return self.cross_attn_image.project_memory(
+            k=memory + pos if self.pos_enc_at_cross_attn_keys else memory,
+            v=memory,
+        )
+
+    def memory_kv(self, projected_memories, pos_offsets) -> Tuple[Tensor, Tensor]:
+        """Cross-attention keys and values of memory frames projected by `project_memory`, with their pos offsets."""
+        keys, values = [], []
+        for projected, pos_offset in zip(projected_memories, pos_offsets):
+            k, v = self.cross_attn_image.memory_kv(
+                projected, pos_offset if self.pos_enc_at_cross_attn_keys else None
+            )
+            keys.append(k)
+            values.append(v)
+        return torch.cat(keys, dim=-2), torch.cat(values, dim=-2)
+
+    def _forward_ca(
+        self, tgt, memory, query_pos, pos, num_k_exclude_rope=0, memory_kv=None
+    ):
         kwds = {}
         if num_k_exclude_rope > 0:
             assert isinstance(self.cross_attn_image, RoPEAttention)
             kwds = {"num_k_exclude_rope": num_k_exclude_rope}
+        if memory_kv is not None:
+            kwds["memory_kv"] = memory_kv
 
         # Cross-Attention
         tgt2 = self.norm2(tgt)
@@ -87,11 +110,14 @@ class MemoryAttentionLayer(nn.Module):
         pos: Optional[Tensor] = None,
         query_pos: Optional[Tensor] = None,
         num_k_exclude_rope: int = 0,
+        memory_kv: Optional[Tuple[Tensor, Tensor]] = None,
     ) -> torch.Tensor:
 
         # Self-Attn, Cross-Attn
         tgt = self._forward_sa(tgt, query_pos)
-        tgt = self._forward_ca(tgt, memory, query_pos, pos, num_k_exclude_rope)
+        tgt = self._forward_ca(
+            tgt, memory, query_pos, pos, num_k_exclude_rope, memory_kv
+        )
         # MLP
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -116,6 +142,19 @@ class MemoryAttention(nn.Module):
         self.pos_enc_at_input = pos_enc_at_input
         self.batch_first = batch_first
 
+    def project_memory(self, memory: Tensor, memory_pos: Tensor) -> List:
+        """
+        Projects the cross-attention keys and values of one memory frame for all
+        layers, to be passed to `forward` as part of `projected_memories` on
+        every frame that attends to this memory frame (instead of projecting it
+        again as part of `memory`). memory and memory_pos (seq first) must not
+        include offsets that change across frames, such as temporal encodings.
+        """
+        if self.batch_first:
+            memory = memory.transpose(0, 1)
+            memory_pos = memory_pos.transpose(0, 1)
+        return [layer.project_memory(memory, memory_pos) for layer in self.layers]
+
     def forward(
         self,
         curr: torch.Tensor,  # self-attention inputs
@@ -123,7 +162,15 @@ class MemoryAttention(nn.Module):
         curr_pos: Optional[Tensor] = None,  # pos_enc for self-attention inputs
         memory_pos: Optional[Tensor] = None,  # pos_enc for cross-attention inputs
         num_obj_ptr_tokens: int = 0,  # number of object pointer *tokens*
+        projected_memories: Optional[List] = None,  # from project_memory
+        projected_memory_pos: Optional[List[Tensor]] = None,  # their pos offsets
     ):
+        """
+        If projected_memories is given, the cross-attention inputs are these
+        memory frames (from `project_memory`, each with its 1 x 1 x C pos
+        offset in projected_memory_pos, added to its memory_pos), followed by
+        the `memory` tokens, which then must all be object pointer tokens.
+        """
         if isinstance(curr, list):
             assert isinstance(curr_pos, list)
             assert len(curr) == len(curr_pos) == 1
@@ -147,10 +194,15 @@ class MemoryAttention(nn.Module):
             memory = memory.transpose(0, 1)
             memory_pos = memory_pos.transpose(0, 1)
 
-        for layer in self.layers:
+        for i, layer in enumerate(self.layers):
             kwds = {}
             if isinstance(layer.cross_attn_image, RoPEAttention):
                 kwds = {"num_k_exclude_rope": num_obj_ptr_tokens}
+            if projected_memories is not None:
+                kwds["memory_kv"] = layer.memory_kv(
+                    [projected[i] for projected in projected_memories],
+                    projected_memory_pos,
+                )
 
             output = layer(
                 tgt=output,
@@ -6,7 +6,7 @@
 
 import math
 from functools import partial
-from typing import Tuple, Type
+from typing import Optional, Tuple, Type
 
 import torch
 import torch.nn.functional as F
@@ -272,8 +272,53 @@ class RoPEAttention(Attention):
         )
         self.rope_k_repeat = rope_k_repeat
 
+    def _update_freqs_cis(self, num_tokens: int, device: torch.device) -> None:
+        # the rope frequencies of a square feature map of num_tokens tokens
+        w = h = math.sqrt(num_tokens)
+        self.freqs_cis = self.freqs_cis.to(device)
+        if self.freqs_cis.shape[0] != num_tokens:
+            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(device)
+
+    def _rotate(self, x: Tensor) -> Tensor:
+        # rope-encode x (B x N_heads x N_tokens x C_per_head), one token per position
+        self._update_freqs_cis(x.shape[-2], x.device)
+        x, _ = apply_rotary_enc(x, x[:, :, :0], freqs_cis=self.freqs_cis)
+        return x
+
+    def project_memory(self, k: Tensor, v: Tensor) -> Tuple[Tensor, Tensor]:
+        """
+        Projects the keys and values of one memory frame (B x N_tokens x C, with
+        one token per position of the queries' feature map), separated into
+        heads. The keys are rope-encoded and *without* the k_proj bias, which is
+        added back with a key offset in `memory_kv`, so they can be reused while
+        a memory offset such as its temporal encoding changes.
+        """
+        k = self._separate_heads(F.linear(k, self.k_proj.weight), self.num_heads)
+        v = self._separate_heads(self.v_proj(v), self.num_heads)
+        return self._rotate(k), v
+
+    def memory_kv(
+        self, projected: Tuple[Tensor, Tensor], k_offset: Optional[Tensor]
+    ) -> Tuple[Tensor, Tensor]:
+        """
+        The keys and values of a memory frame projected by `project_memory`,
+        as `forward` would compute them from `k + k_offset` and `v`, where
+        k_offset (1 x 1 x C) is added to all the keys (or None for no offset).
+        """
+        k, v = projected
+        if k_offset is None:
+            k_offset = k.new_zeros(1, 1, self.kv_in_dim)
+        k_offset = self.k_proj(k_offset).expand(k.shape[0], k.shape[2], -1)
+        k_offset = self._rotate(self._separate_heads(k_offset, self.num_heads))
+        return k + k_offset, v
+
     def forward(
-        self, q: Tensor, k: Tensor, v: Tensor, num_k_exclude_rope: int = 0
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        num_k_exclude_rope: int = 0,
+        memory_kv: Optional[Tuple[Tensor, Tensor]] = None,
     ) -> Tensor:
         # Input projections
         q = self.q_proj(q)
@@ -286,12 +331,9 @@ class RoPEAttention(Attention):
         v = self._separate_heads(v, self.num_heads)
 
         # Apply rotary position encoding
-        w = h = math.sqrt(q.shape[-2])
-        self.freqs_cis = self.freqs_cis.to(q.device)
-        if self.freqs_cis.shape[0] != q.shape[-2]:
-            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(q.device)
+        self._update_freqs_cis(q.shape[-2], q.device)
         if q.shape[-2] != k.shape[-2]:
-            assert self.rope_k_repeat
+            assert self.rope_k_repeat or memory_kv is not None
 
         num_k_rope = k.size(-2) - num_k_exclude_rope
         q, k[:, :, :num_k_rope] = apply_rotary_enc(
@@ -300,6 +342,11 @@ class RoPEAttention(Attention):
             freqs_cis=self.freqs_cis,
             repeat_freqs_k=self.rope_k_repeat,
         )
+        if memory_kv is not None:
+            # keys (already rope-encoded) and values of memories projected beforehand
+            assert num_k_rope == 0, "memory_kv must hold all the rope-encoded keys"
+            k = torch.cat([memory_kv[0], k], dim=-2)
+            v = torch.cat([memory_kv[1], v], dim=-2)
 
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
@@ -93,8 +93,13 @@ class SAM2Base(torch.nn.Module):
         # extra arguments used to construct the SAM mask decoder; if not None, it should be a dict of kwargs to be passed into `MaskDecoder` class.
         sam_mask_decoder_extra_args=None,
         compile_image_encoder: bool = False,
+        # whether to keep the projected keys/values of each memory frame (in the
+        # "memory_kv_cache" of output_dict) and reuse them while the frame stays in the
+        # memory window during evaluation, rather than projecting all memories on each frame
+        use_memory_kv_cache: bool = False,
     ):
         super().__init__()
+        self.use_memory_kv_cache = use_memory_kv_cache
 
         # Part 1: the image backbone
         self.image_encoder = image_encoder
@@ -494,6 +499,242 @@ class SAM2Base(torch.nn.Module):
 
         return backbone_out, vision_feats, vision_pos_embeds, feat_sizes
 
+    def _select_memory_frames(
+        self, frame_idx, output_dict, num_frames, track_in_reverse=False
+    ):
+        """
+        Select the previous frame outputs that a (non initial conditioning) frame attends
+        to. Returns the (t_pos, output) pairs of its spatial memories (with a None output
+        for each missing frame) and the (temporal position, output) pairs of its object
+        pointers.
+        """
+        # Add conditioning frames's output first (all cond frames have t_pos=0 for
+        # when getting temporal positional embedding below)
+        assert len(output_dict["cond_frame_outputs"]) > 0
+        # Select a maximum number of temporally closest cond frames for cross attention
+        cond_outputs = output_dict["cond_frame_outputs"]
+        selected_cond_outputs, unselected_cond_outputs = select_closest_cond_frames(
+            frame_idx, cond_outputs, self.max_cond_frames_in_attn
+        )
+        t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
+        # Add last (self.num_maskmem - 1) frames before current frame for non-conditioning memory
+        # the earliest one has t_pos=1 and the latest one has t_pos=self.num_maskmem-1
+        # We also allow taking the memory frame non-consecutively (with stride>1), in which case
+        # we take (self.num_maskmem - 2) frames among every stride-th frames plus the last frame.
+        stride = 1 if self.training else self.memory_temporal_stride_for_eval
+        for t_pos in range(1, self.num_maskmem):
+            t_rel = self.num_maskmem - t_pos  # how many frames before current frame
+            if t_rel == 1:
+                # for t_rel == 1, we take the last frame (regardless of r)
+                if not track_in_reverse:
+                    # the frame immediately before this frame (i.e. frame_idx - 1)
+                    prev_frame_idx = frame_idx - t_rel
+                else:
+                    # the frame immediately after this frame (i.e. frame_idx + 1)
+                    prev_frame_idx = frame_idx + t_rel
+            else:
+                # for t_rel >= 2, we take the memory frame from every r-th frames
+                if not track_in_reverse:
+                    # first find the nearest frame among every r-th frames before this frame
+                    # for r=1, this would be (frame_idx - 2)
+                    prev_frame_idx = ((frame_idx - 2) // stride) * stride
+                    # then seek further among every r-th frames
+                    prev_frame_idx = prev_frame_idx - (t_rel - 2) * stride
+                else:
+                    # first find the nearest frame among every r-th frames after this frame
+                    # for r=1, this would be (frame_idx + 2)
+                    prev_frame_idx = -(-(frame_idx + 2) // stride) * stride
+                    # then seek further among every r-th frames
+                    prev_frame_idx = prev_frame_idx + (t_rel - 2) * stride
+            out = output_dict["non_cond_frame_outputs"].get(prev_frame_idx, None)
+            if out is None:
+                # If an unselected conditioning frame is among the last (self.num_maskmem - 1)
+                # frames, we still attend to it as if it's a non-conditioning frame.
+                out = unselected_cond_outputs.get(prev_frame_idx, None)
+            t_pos_and_prevs.append((t_pos, out))
+
+        # Construct the list of past object pointers
+        pos_and_ptr_outs = []
+        if self.use_obj_ptrs_in_encoder:
+            max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
+            # First add those object pointers from selected conditioning frames
+            # (optionally, only include object pointers in the past during evaluation)
+            if not self.training and self.only_obj_ptrs_in_the_past_for_eval:
+                ptr_cond_outputs = {
+                    t: out
+                    for t, out in selected_cond_outputs.items()
+                    if (t >= frame_idx if track_in_reverse else t <= frame_idx)
+                }
+            else:
+                ptr_cond_outputs = selected_cond_outputs
+            tpos_sign_mul = -1 if track_in_reverse else 1
+            pos_and_ptr_outs = [
+                # Temporal pos encoding contains how far away each pointer is from current frame
+                (
+                    (
+                        (frame_idx - t) * tpos_sign_mul
+                        if self.use_signed_tpos_enc_to_obj_ptrs
+                        else abs(frame_idx - t)
+                    ),
+                    out,
+                )
+                for t, out in ptr_cond_outputs.items()
+            ]
+            # Add up to (max_obj_ptrs_in_encoder - 1) non-conditioning frames before current frame
+            for t_diff in range(1, max_obj_ptrs_in_encoder):
+                t = frame_idx + t_diff if track_in_reverse else frame_idx - t_diff
+                if t < 0 or (num_frames is not None and t >= num_frames):
+                    break
+                out = output_dict["non_cond_frame_outputs"].get(
+                    t, unselected_cond_outputs.get(t, None)
+                )
+                if out is not None:
+                    pos_and_ptr_outs.append((t_diff, out))
+        return t_pos_and_prevs, pos_and_ptr_outs
+
+    def _memory_layout(
+        self, frame_idx, output_dict, num_frames, track_in_reverse=False
+    ):
+        """
+        The layout of the memories that a (non initial conditioning) frame attends to:
+        the temporal positions of its memory frames and its number of object pointers.
+        Objects tracked independently (each with its own output dict) can be run as one
+        batch on a frame if their memory layouts on this frame are the same.
+        """
+        t_pos_and_prevs, pos_and_ptr_outs = self._select_memory_frames(
+            frame_idx, output_dict, num_frames, track_in_reverse
+        )
+        t_pos = tuple(t_pos for t_pos, prev in t_pos_and_prevs if prev is not None)
+        return t_pos, len(pos_and_ptr_outs)
+
+    def _gather_memories(
+        self, frame_idx, output_dict, num_frames, track_in_reverse, B, device
+    ):
+        """
+        Gather the memories that a (non initial conditioning) frame attends to. Returns
+        the memory and memory pos tokens to concatenate, the number of object pointer
+        tokens among them, and the projected memory frames and their pos offsets (or
+        None if the memory K/V cache is not used).
+        """
+        C = self.hidden_dim
+        t_pos_and_prevs, pos_and_ptr_outs = self._select_memory_frames(
+            frame_idx, output_dict, num_frames, track_in_reverse
+        )
+        # Retrieve the memories encoded with the maskmem backbone
+        to_cat_memory, to_cat_memory_pos_embed = [], []
+        use_kv_cache = self.use_memory_kv_cache and not self.training
+        # id of memory frame outputs -> (output, its memory features, their
+        # projected keys/values for each layer)
+        kv_cache = output_dict.get("memory_kv_cache", {}) if use_kv_cache else None
+        new_kv_cache = {}
+        projected_memories, projected_memory_pos = [], []
+        for t_pos, prev in t_pos_and_prevs:
+            if prev is None:
+                continue  # skip padding frames
+            tpos_enc = self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
+            cached = kv_cache.get(id(prev)) if use_kv_cache else None
+            if cached is not None and cached[1] is prev["maskmem_features"]:
+                # projected while this frame was already in the memory window
+                projected = cached[2]
+            else:
+                # "maskmem_features" might have been offloaded to CPU in demo use cases,
+                # so we load it back to GPU (it's a no-op if it's already on GPU).
+                feats = prev["maskmem_features"].to(device, non_blocking=True)
+                feats = feats.flatten(2).permute(2, 0, 1)
+                # Spatial positional encoding (it might have been offloaded to CPU in eval)
+                maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
+                maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
+                if not use_kv_cache:
+                    to_cat_memory.append(feats)
+                    # Temporal positional encoding
+                    to_cat_memory_pos_embed.append(maskmem_enc + tpos_enc)
+                    continue
+                # (as torch.cat would promote bfloat16 memories with the other memories)
+                dtype = torch.promote_types(feats.dtype, maskmem_enc.dtype)
+                projected = self.memory_attention.project_memory(
+                    feats.to(dtype), maskmem_enc
+                )
+            # keep the output itself so that its id is not reused while cached
+            new_kv_cache[id(prev)] = (prev, prev["maskmem_features"], projected)
+            projected_memories.append(projected)
+            projected_memory_pos.append(tpos_enc)
+        if use_kv_cache:
+            # only keep the frames that are still in the memory window
+            output_dict["memory_kv_cache"] = new_kv_cache
+        else:
+            projected_memories, projected_memory_pos = None, None
+
+        # If we have at least one object pointer, add them to the across attention
+        num_obj_ptr_tokens = 0
+        if len(pos_and_ptr_outs) > 0:
+            pos_list, ptr_outs = zip(*pos_and_ptr_outs)
+            # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
+            obj_ptrs = torch.stack([out["obj_ptr"] for out in ptr_outs], dim=0)
+            # a temporal positional embedding based on how far each object pointer is from
+            # the current frame (sine embedding normalized by the max pointer num).
+            if self.add_tpos_enc_to_obj_ptrs:
+                max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
+                t_diff_max = max_obj_ptrs_in_encoder - 1
+                tpos_dim = C if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
+                obj_pos = torch.tensor(pos_list).to(device=device, non_blocking=True)
+                obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
+                obj_pos = self.obj_ptr_tpos_proj(obj_pos)
+                obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
+            else:
+                obj_pos = obj_ptrs.new_zeros(len(pos_list), B, self.mem_dim)
+            if self.mem_dim < C:
+                # split a pointer into (C // self.mem_dim) tokens for self.mem_dim < C
+                obj_ptrs = obj_ptrs.reshape(-1, B, C // self.mem_dim, self.mem_dim)
+                obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
+                obj_pos = obj_pos.repeat_interleave(C // self.mem_dim, dim=0)
+            to_cat_memory.append(obj_ptrs)
+            to_cat_memory_pos_embed.append(obj_pos)
+            num_obj_ptr_tokens = obj_ptrs.shape[0]
+
+        return (
+            to_cat_memory,
+            to_cat_memory_pos_embed,
+            num_obj_ptr_tokens,
+            projected_memories,
+            projected_memory_pos,
+        )
+
+    def _cat_gathered_memories(self, per_obj_memories):
+        """
+        Concatenate the memories gathered by `_gather_memories` for several objects with
+        the same memory layout into one batch.
+        """
+        to_cat_memory = [
+            torch.cat(tokens, dim=1)
+            for tokens in zip(*(memories[0] for memories in per_obj_memories))
+        ]
+        to_cat_memory_pos_embed = [
+            torch.cat(tokens, dim=1)
+            for tokens in zip(*(memories[1] for memories in per_obj_memories))
+        ]
+        num_obj_ptr_tokens = per_obj_memories[0][2]
+        projected_memories, projected_memory_pos = None, None
+        if per_obj_memories[0][3] is not None:
+            # for each memory frame and each layer, batch the (batch first) keys and values
+            projected_memories = [
+                [
+                    tuple(torch.cat(kv, dim=0) for kv in zip(*layer_kvs))
+                    for layer_kvs in zip(*frame_projected)
+                ]
+                for frame_projected in zip(
+                    *(memories[3] for memories in per_obj_memories)
+                )
+            ]
+            # the same temporal positions for all objects
+            projected_memory_pos = per_obj_memories[0][4]
+        return (
+            to_cat_memory,
+            to_cat_memory_pos_embed,
+            num_obj_ptr_tokens,
+            projected_memories,
+            projected_memory_pos,
+        )
+
     def _prepare_memory_conditioned_features(
         self,
         frame_idx,
@@ -505,7 +746,13 @@ class SAM2Base(torch.nn.Module):
         num_frames,
         track_in_reverse=False,  # tracking in reverse time order (for demo usage)
     ):
-        """Fuse the current frame's visual feature map with previous memory."""
+        """
+        Fuse the current frame's visual feature map with previous memory.
+
+        `output_dict` can also be a list with the output dict of each object in the
+        batch, for objects that are tracked independently (one object per output dict)
+        and have the same memory layout on this frame (see `_memory_layout`).
+        """
         B = current_vision_feats[-1].size(1)  # batch size on this frame
         C = self.hidden_dim
         H, W = feat_sizes[-1]  # top-level (lowest-resolution) feature size
@@ -517,137 +764,34 @@ class SAM2Base(torch.nn.Module):
             return pix_feat
 
         num_obj_ptr_tokens = 0
-        tpos_sign_mul = -1 if track_in_reverse else 1
+        projected_memories, projected_memory_pos = None, None
         # Step 1: condition the visual features of the current frame on previous memories
         if not is_init_cond_frame:
-            # Retrieve the memories encoded with the maskmem backbone
-            to_cat_memory, to_cat_memory_pos_embed = [], []
-            # Add conditioning frames's output first (all cond frames have t_pos=0 for
-            # when getting temporal positional embedding below)
-            assert len(output_dict["cond_frame_outputs"]) > 0
-            # Select a maximum number of temporally closest cond frames for cross attention
-            cond_outputs = output_dict["cond_frame_outputs"]
-            selected_cond_outputs, unselected_cond_outputs = select_closest_cond_frames(
-                frame_idx, cond_outputs, self.max_cond_frames_in_attn
-            )
-            t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
-            # Add last (self.num_maskmem - 1) frames before current frame for non-conditioning memory
-            # the earliest one has t_pos=1 and the latest one has t_pos=self.num_maskmem-1
-            # We also allow taking the memory frame non-consecutively (with stride>1), in which case
-            # we take (self.num_maskmem - 2) frames among every stride-th frames plus the last frame.
-            stride = 1 if self.training else self.memory_temporal_stride_for_eval
-            for t_pos in range(1, self.num_maskmem):
-                t_rel = self.num_maskmem - t_pos  # how many frames before current frame
-                if t_rel == 1:
-                    # for t_rel == 1, we take the last frame (regardless of r)
-                    if not track_in_reverse:
-                        # the frame immediately before this frame (i.e. frame_idx - 1)
-                        prev_frame_idx = frame_idx - t_rel
-                    else:
-                        # the frame immediately after this frame (i.e. frame_idx + 1)
-                        prev_frame_idx = frame_idx + t_rel
-                else:
-                    # for t_rel >= 2, we take the memory frame from every r-th frames
-                    if not track_in_reverse:
-                        # first find the nearest frame among every r-th frames before this frame
-                        # for r=1, this would be (frame_idx - 2)
-                        prev_frame_idx = ((frame_idx - 2) // stride) * stride
-                        # then seek further among every r-th frames
-                        prev_frame_idx = prev_frame_idx - (t_rel - 2) * stride
-                    else:
-                        # first find the nearest frame among every r-th frames after this frame
-                        # for r=1, this would be (frame_idx + 2)
-                        prev_frame_idx = -(-(frame_idx + 2) // stride) * stride
-                        # then seek further among every r-th frames
-                        prev_frame_idx = prev_frame_idx + (t_rel - 2) * stride
-                out = output_dict["non_cond_frame_outputs"].get(prev_frame_idx, None)
-                if out is None:
-                    # If an unselected conditioning frame is among the last (self.num_maskmem - 1)
-                    # frames, we still attend to it as if it's a non-conditioning frame.
-                    out = unselected_cond_outputs.get(prev_frame_idx, None)
-                t_pos_and_prevs.append((t_pos, out))
-
-            for t_pos, prev in t_pos_and_prevs:
-                if prev is None:
-                    continue  # skip padding frames
-                # "maskmem_features" might have been offloaded to CPU in demo use cases,
-                # so we load it back to GPU (it's a no-op if it's already on GPU).
-                feats = prev["maskmem_features"].to(device, non_blocking=True)
-                to_cat_memory.append(feats.flatten(2).permute(2, 0, 1))
-                # Spatial positional encoding (it might have been offloaded to CPU in eval)
-                maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
-                maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
-                # Temporal positional encoding
-                maskmem_enc = (
-                    maskmem_enc + self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
-                )
-                to_cat_memory_pos_embed.append(maskmem_enc)
-
-            # Construct the list of past object pointers
-            if self.use_obj_ptrs_in_encoder:
-                max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
-                # First add those object pointers from selected conditioning frames
-                # (optionally, only include object pointers in the past during evaluation)
-                if not self.training and self.only_obj_ptrs_in_the_past_for_eval:
-                    ptr_cond_outputs = {
-                        t: out
-                        for t, out in selected_cond_outputs.items()
-                        if (t >= frame_idx if track_in_reverse else t <= frame_idx)
-                    }
-                else:
-                    ptr_cond_outputs = selected_cond_outputs
-                pos_and_ptrs = [
-                    # Temporal pos encoding contains how far away each pointer is from current frame
-                    (
-                        (
-                            (frame_idx - t) * tpos_sign_mul
-                            if self.use_signed_tpos_enc_to_obj_ptrs
-                            else abs(frame_idx - t)
-                        ),
-                        out["obj_ptr"],
+            if isinstance(output_dict, list):
+                assert len(output_dict) == B
+                per_obj_memories = [
+                    self._gather_memories(
+                        frame_idx,
+                        obj_output_dict,
+                        num_frames,
+                        track_in_reverse,
+                        1,
+                        device,
                     )
-                    for t, out in ptr_cond_outputs.items()
+                    for obj_output_dict in output_dict
                 ]
-                # Add up to (max_obj_ptrs_in_encoder - 1) non-conditioning frames before current frame
-                for t_diff in range(1, max_obj_ptrs_in_encoder):
-                    t = frame_idx + t_diff if track_in_reverse else frame_idx - t_diff
-                    if t < 0 or (num_frames is not None and t >= num_frames):
-                        break
-                    out = output_dict["non_cond_frame_outputs"].get(
-                        t, unselected_cond_outputs.get(t, None)
-                    )
-                    if out is not None:
-                        pos_and_ptrs.append((t_diff, out["obj_ptr"]))
-                # If we have at least one object pointer, add them to the across attention
-                if len(pos_and_ptrs) > 0:
-                    pos_list, ptrs_list = zip(*pos_and_ptrs)
-                    # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
-                    obj_ptrs = torch.stack(ptrs_list, dim=0)
-                    # a temporal positional embedding based on how far each object pointer is from
-                    # the current frame (sine embedding normalized by the max pointer num).
-                    if self.add_tpos_enc_to_obj_ptrs:
-                        t_diff_max = max_obj_ptrs_in_encoder - 1
-                        tpos_dim = C if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
-                        obj_pos = torch.tensor(pos_list).to(
-                            device=device, non_blocking=True
-                        )
-                        obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
-                        obj_pos = self.obj_ptr_tpos_proj(obj_pos)
-                        obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
-                    else:
-                        obj_pos = obj_ptrs.new_zeros(len(pos_list), B, self.mem_dim)
-                    if self.mem_dim < C:
-                        # split a pointer into (C // self.mem_dim) tokens for self.mem_dim < C
-                        obj_ptrs = obj_ptrs.reshape(
-                            -1, B, C // self.mem_dim, self.mem_dim
-                        )
-                        obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
-                        obj_pos = obj_pos.repeat_interleave(C // self.mem_dim, dim=0)
-                    to_cat_memory.append(obj_ptrs)
-                    to_cat_memory_pos_embed.append(obj_pos)
-                    num_obj_ptr_tokens = obj_ptrs.shape[0]
-                else:
-                    num_obj_ptr_tokens = 0
+                memories = self._cat_gathered_memories(per_obj_memories)
+            else:
+                memories = self._gather_memories(
+                    frame_idx, output_dict, num_frames, track_in_reverse, B, device
+                )
+            (
+                to_cat_memory,
+                to_cat_memory_pos_embed,
+                num_obj_ptr_tokens,
+                projected_memories,
+                projected_memory_pos,
+            ) = memories
         else:
             # for initial conditioning frames, encode them without using any previous memory
             if self.directly_add_no_mem_embed:
@@ -661,6 +805,16 @@ class SAM2Base(torch.nn.Module):
             to_cat_memory_pos_embed = [self.no_mem_pos_enc.expand(1, B, self.mem_dim)]
 
         # Step 2: Concatenate the memories and forward through the transformer encoder
+        kwds = {}
+        if projected_memories is not None:
+            # the spatial memories are passed projected, and only the object pointers as is
+            kwds = {
+                "projected_memories": projected_memories,
+                "projected_memory_pos": projected_memory_pos,
+            }
+            if len(to_cat_memory) == 0:
+                to_cat_memory = [current_vision_feats[-1].new_zeros(0, B, self.mem_dim)]
+                to_cat_memory_pos_embed = to_cat_memory
         memory = torch.cat(to_cat_memory, dim=0)
         memory_pos_embed = torch.cat(to_cat_memory_pos_embed, dim=0)
 
@@ -670,6 +824,7 @@ class SAM2Base(torch.nn.Module):
             memory=memory,
             memory_pos=memory_pos_embed,
             num_obj_ptr_tokens=num_obj_ptr_tokens,
+            **kwds,
         )
         # reshape the output (HW)BC => BCHW
         pix_feat_with_mem = pix_feat_with_mem.permute(1, 2, 0).view(B, C, H, W)
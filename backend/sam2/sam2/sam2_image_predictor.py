@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
 
 from typing import List, Optional, Tuple, Union
 
@@ -13,6 +14,7 @@ import torch
 from PIL.Image import Image
 
 from sam2.modeling.sam2_base import SAM2Base
+from sam2.utils.amg import batched_mask_to_bbox_crops
 
 from sam2.utils.transforms import SAM2Transforms
 
@@ -24,6 +26,8 @@ class SAM2ImagePredictor:
         mask_threshold=0.0,
         max_hole_area=0.0,
         max_sprinkle_area=0.0,
+        compile_model=False,
+        compile_cache_path=None,
         **kwargs,
     ) -> None:
         """
@@ -38,6 +42,13 @@ class SAM2ImagePredictor:
             the maximum area of max_hole_area in low_res_masks.
           max_sprinkle_area (int): If max_sprinkle_area > 0, we remove small sprinkles up to
             the maximum area of max_sprinkle_area in low_res_masks.
+          compile_model (bool): If true, the image encoder and mask decoder of
+            sam_model are compiled with torch.compile (static shapes), which is
+            shared by all predictors of the model. Each new input shape is
+            compiled on its first call, so call 'warmup' before serving.
+          compile_cache_path (str): A file to load the compiled artifacts from,
+            if it exists, and that 'warmup' saves them to, so that restarts skip
+            most of the compilation.
         """
         super().__init__()
         self.model = sam_model
@@ -59,11 +70,12 @@ class SAM2ImagePredictor:
         self.mask_threshold = mask_threshold
 
         # Spatial dim for backbone feature maps
-        self._bb_feat_sizes = [
-            (256, 256),
-            (128, 128),
-            (64, 64),
-        ]
+        hires_size = self.model.image_size // 4
+        self._bb_feat_sizes = [[hires_size // (2**k)] * 2 for k in range(3)]
+
+        self.compile_cache_path = compile_cache_path
+        if compile_model:
+            self._compile_model()
 
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2ImagePredictor":
@@ -181,19 +193,27 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         normalize_coords=True,
+        output_mode: str = "binary_mask",
     ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
         """This function is very similar to predict(...), however it is used for batched mode, when the model is expected to generate predictions on multiple images.
         It returns a tuple of lists of masks, ious, and low_res_masks_logits.
+
+        The prompts of all images are decoded together in a single run of the
+        prompt encoder and mask decoder when all images have the same number of
+        points per prompt (counting a box as two points) and their mask inputs can
+        be stacked. Otherwise, e.g. when only some images have a mask input or an
+        image has no point or box prompt, the prompts of each image are decoded
+        separately, so that the outputs of an image never depend on the other
+        images of the batch.
         """
         assert self._is_batch, "This function should only be used when in batched mode"
+        self._check_output_mode(output_mode, return_logits)
         if not self._is_image_set:
             raise RuntimeError(
                 "An image must be set with .set_image_batch(...) before mask prediction."
             )
         num_images = len(self._features["image_embed"])
-        all_masks = []
-        all_ious = []
-        all_low_res_masks = []
+        all_prompts = []
         for img_idx in range(num_images):
             # Transform input prompts
             point_coords = (
@@ -206,24 +226,43 @@ class SAM2ImagePredictor:
             mask_input = (
                 mask_input_batch[img_idx] if mask_input_batch is not None else None
             )
-            mask_input, unnorm_coords, labels, unnorm_box = self._prep_prompts(
-                point_coords,
-                point_labels,
-                box,
-                mask_input,
-                normalize_coords,
-                img_idx=img_idx,
+            all_prompts.append(
+                self._prep_prompts(
+                    point_coords,
+                    point_labels,
+                    box,
+                    mask_input,
+                    normalize_coords,
+                    img_idx=img_idx,
+                )
             )
-            masks, iou_predictions, low_res_masks = self._predict(
-                unnorm_coords,
-                labels,
-                unnorm_box,
-                mask_input,
-                multimask_output,
-                return_logits=return_logits,
-                img_idx=img_idx,
+
+        if self._can_batch_prompts(all_prompts):
+            all_outputs = self._predict_batched_prompts(
+                all_prompts, multimask_output, return_logits=return_logits
             )
-            masks_np = masks.squeeze(0).float().detach().cpu().numpy()
+        else:
+            # Fall back to decoding the prompts of each image separately
+            all_outputs = [
+                self._predict(
+                    unnorm_coords,
+                    labels,
+                    unnorm_box,
+                    mask_input,
+                    multimask_output,
+                    return_logits=return_logits,
+                    img_idx=img_idx,
+                )
+                for img_idx, (mask_input, unnorm_coords, labels, unnorm_box) in (
+                    enumerate(all_prompts)
+                )
+            ]
+
+        all_masks = []
+        all_ious = []
+        all_low_res_masks = []
+        for masks, iou_predictions, low_res_masks in all_outputs:
+            masks_np = self._masks_to_output(masks.squeeze(0), output_mode)
             iou_predictions_np = (
                 iou_predictions.squeeze(0).float().detach().cpu().numpy()
             )
@@ -243,6 +282,7 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         normalize_coords=True,
+        output_mode: str = "binary_mask",
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -267,6 +307,11 @@ class SAM2ImagePredictor:
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
           normalize_coords (bool): If true, the point coordinates will be normalized to the range [0,1] and point_coords is expected to be wrt. image dimensions.
+          output_mode (str): The form masks are returned in. Can be 'binary_mask'
+            or 'bbox_crop'. 'bbox_crop' returns a list of length C of dicts
+            holding the image 'size', the XY 'offset' of the mask's bounding box
+            and the binary 'mask' within it (see sam2.utils.amg.rle_to_bbox_crop),
+            which avoids transferring full size masks of small objects.
 
         Returns:
           (np.ndarray): The output masks in CxHxW format, where C is the
@@ -281,6 +326,7 @@ class SAM2ImagePredictor:
             raise RuntimeError(
                 "An image must be set with .set_image(...) before mask prediction."
             )
+        self._check_output_mode(output_mode, return_logits)
 
         # Transform input prompts
 
@@ -297,11 +343,27 @@ class SAM2ImagePredictor:
             return_logits=return_logits,
         )
 
-        masks_np = masks.squeeze(0).float().detach().cpu().numpy()
+        masks_np = self._masks_to_output(masks.squeeze(0), output_mode)
         iou_predictions_np = iou_predictions.squeeze(0).float().detach().cpu().numpy()
         low_res_masks_np = low_res_masks.squeeze(0).float().detach().cpu().numpy()
         return masks_np, iou_predictions_np, low_res_masks_np
 
+    @staticmethod
+    def _check_output_mode(output_mode: str, return_logits: bool) -> None:
+        assert output_mode in [
+            "binary_mask",
+            "bbox_crop",
+        ], f"Unknown output_mode {output_mode}."
+        assert not (
+            return_logits and output_mode == "bbox_crop"
+        ), "output_mode='bbox_crop' requires thresholded masks."
+
+    @staticmethod
+    def _masks_to_output(masks: torch.Tensor, output_mode: str):
+        if output_mode == "bbox_crop":
+            return batched_mask_to_bbox_crops(masks)
+        return masks.float().detach().cpu().numpy()
+
     def _prep_prompts(
         self, point_coords, point_labels, box, mask_logits, normalize_coords, img_idx=-1
     ):
@@ -384,25 +446,8 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image(...) before mask prediction."
             )
 
-        if point_coords is not None:
-            concat_points = (point_coords, point_labels)
-        else:
-            concat_points = None
-
         # Embed prompts
-        if boxes is not None:
-            box_coords = boxes.reshape(-1, 2, 2)
-            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
-            box_labels = box_labels.repeat(boxes.size(0), 1)
-            # we merge "boxes" and "points" into a single "concat_points" input (where
-            # boxes are added at the beginning) to sam_prompt_encoder
-            if concat_points is not None:
-                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
-                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
-                concat_points = (concat_coords, concat_labels)
-            else:
-                concat_points = (box_coords, box_labels)
-
+        concat_points = self._concat_points(point_coords, point_labels, boxes)
         sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
             points=concat_points,
             boxes=None,
@@ -437,6 +482,135 @@ class SAM2ImagePredictor:
 
         return masks, iou_predictions, low_res_masks
 
+    @staticmethod
+    def _concat_points(
+        point_coords: Optional[torch.Tensor],
+        point_labels: Optional[torch.Tensor],
+        boxes: Optional[torch.Tensor],
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        if point_coords is not None:
+            concat_points = (point_coords, point_labels)
+        else:
+            concat_points = None
+
+        if boxes is not None:
+            box_coords = boxes.reshape(-1, 2, 2)
+            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
+            box_labels = box_labels.repeat(boxes.size(0), 1)
+            # we merge "boxes" and "points" into a single "concat_points" input (where
+            # boxes are added at the beginning) to sam_prompt_encoder
+            if concat_points is not None:
+                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
+                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
+                concat_points = (concat_coords, concat_labels)
+            else:
+                concat_points = (box_coords, box_labels)
+        return concat_points
+
+    @staticmethod
+    def _can_batch_prompts(all_prompts: List[Tuple]) -> bool:
+        """
+        Whether the prompts prepared by _prep_prompts for each image can be
+        decoded together by _predict_batched_prompts.
+        """
+        mask_shapes = set()
+        # (padding prompts to a common number of points would change their outputs)
+        num_points = set()
+        for mask_input, unnorm_coords, _, unnorm_box in all_prompts:
+            if unnorm_coords is None and unnorm_box is None:
+                return False
+            num_prompts = (
+                unnorm_coords.shape[0]
+                if unnorm_coords is not None
+                else unnorm_box.reshape(-1, 4).shape[0]
+            )
+            num_points.add(
+                (unnorm_coords.shape[1] if unnorm_coords is not None else 0)
+                + (2 if unnorm_box is not None else 0)
+            )
+            if mask_input is None:
+                mask_shapes.add(None)
+            elif mask_input.shape[0] != num_prompts:
+                return False
+            else:
+                mask_shapes.add(mask_input.shape[1:])
+        return len(mask_shapes) == 1 and len(num_points) == 1
+
+    @torch.no_grad()
+    def _predict_batched_prompts(
+        self,
+        all_prompts: List[Tuple],
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Predict masks for the prompts of all images of the current batch at once.
+
+        Arguments:
+          all_prompts (list(tuple)): For each image, the (mask_input, point_coords,
+            point_labels, boxes) tensors prepared by _prep_prompts. Must satisfy
+            _can_batch_prompts.
+          multimask_output (bool): If true, the model will return three masks.
+          return_logits (bool): If true, returns un-thresholded masks logits
+            instead of a binary mask.
+
+        Returns:
+          (list(tuple(torch.Tensor, torch.Tensor, torch.Tensor))): For each image,
+            the masks, iou predictions and low res masks, as returned by _predict
+            for that image alone.
+        """
+        concat_points = [
+            self._concat_points(point_coords, point_labels, boxes)
+            for _, point_coords, point_labels, boxes in all_prompts
+        ]
+        num_prompts = [coords.shape[0] for coords, _ in concat_points]
+        concat_coords = torch.cat([coords for coords, _ in concat_points], dim=0)
+        concat_labels = torch.cat([labels for _, labels in concat_points], dim=0)
+        if all_prompts[0][0] is not None:
+            mask_input = torch.cat([prompts[0] for prompts in all_prompts], dim=0)
+        else:
+            mask_input = None
+
+        sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
+            points=(concat_coords, concat_labels),
+            boxes=None,
+            masks=mask_input,
+        )
+
+        # Each prompt is decoded against the features of its own image
+        img_ids = torch.repeat_interleave(
+            torch.arange(len(all_prompts), device=self.device),
+            torch.tensor(num_prompts, device=self.device),
+        )
+        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+            image_embeddings=self._features["image_embed"][img_ids],
+            image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=multimask_output,
+            repeat_image=False,
+            high_res_features=[
+                feat_level[img_ids] for feat_level in self._features["high_res_feats"]
+            ],
+        )
+
+        outputs = []
+        for img_idx, (img_low_res_masks, img_iou_predictions) in enumerate(
+            zip(
+                low_res_masks.split(num_prompts),
+                iou_predictions.split(num_prompts),
+            )
+        ):
+            # Upscale the masks to the original image resolution
+            masks = self._transforms.postprocess_masks(
+                img_low_res_masks, self._orig_hw[img_idx]
+            )
+            img_low_res_masks = torch.clamp(img_low_res_masks, -32.0, 32.0)
+            if not return_logits:
+                masks = masks > self.mask_threshold
+            outputs.append((masks, img_iou_predictions, img_low_res_masks))
+        return outputs
+
     def get_image_embedding(self) -> torch.Tensor:
         """
         Returns the image embeddings for the currently set image, with
@@ -452,6 +626,147 @@ class SAM2ImagePredictor:
         ), "Features must exist if an image has been set."
         return self._features["image_embed"]
 
+    def save_features(self, path: str, half: bool = False) -> None:
+        """
+        Saves the image embeddings of the currently set image or image batch,
+        so they can be restored with 'load_features' instead of running
+        'set_image' again on the same image.
+
+        Arguments:
+          path (str): The file to save the features to.
+          half (bool): If true, the features are stored in float16, halving the
+            file size at a small loss of precision.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) before saving features."
+            )
+        dtype = torch.float16 if half else torch.float32
+        state = {
+            "image_embed": self._features["image_embed"].to("cpu", dtype),
+            "high_res_feats": [
+                feat.to("cpu", dtype) for feat in self._features["high_res_feats"]
+            ],
+            "orig_hw": [tuple(int(x) for x in hw) for hw in self._orig_hw],
+            "is_batch": self._is_batch,
+        }
+        torch.save(state, path)
+
+    @torch.no_grad()
+    def load_features(self, path: str, mmap: bool = True) -> None:
+        """
+        Loads image embeddings saved with 'save_features', allowing masks to be
+        predicted with the 'predict' (or 'predict_batch') method without
+        computing the image embeddings again.
+
+        Arguments:
+          path (str): The file to load the features from.
+          mmap (bool): If true, the file is memory-mapped rather than read into
+            memory. Float32 features on a CPU model are then used in place.
+        """
+        self.reset_predictor()
+        state = torch.load(path, map_location="cpu", mmap=mmap, weights_only=True)
+        self._features = {
+            "image_embed": state["image_embed"].to(self.device, torch.float32),
+            "high_res_feats": [
+                feat.to(self.device, torch.float32) for feat in state["high_res_feats"]
+            ],
+        }
+        self._orig_hw = [tuple(hw) for hw in state["orig_hw"]]
+        self._is_image_set = True
+        self._is_batch = state["is_batch"]
+
+    def _compile_model(self) -> None:
+        if getattr(self.model, "_image_predictor_compiled", False):
+            # already compiled by another predictor of the same model
+            return
+        if self.compile_cache_path is not None and os.path.exists(
+            self.compile_cache_path
+        ):
+            with open(self.compile_cache_path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            logging.info(f"Loaded compiled artifacts from {self.compile_cache_path}")
+        logging.info("Compiling the image encoder and mask decoder.")
+        self.model.image_encoder.forward = torch.compile(
+            self.model.image_encoder.forward,
+            fullgraph=True,
+            dynamic=False,
+        )
+        compiled_decoder = torch.compile(
+            self.model.sam_mask_decoder.forward,
+            fullgraph=True,
+            dynamic=False,
+        )
+
+        def decoder_forward(*args, **kwargs):
+            # The number of prompt tokens (the points of a prompt, a box being two
+            # points) varies with every click, so it's the only dynamic dimension:
+            # one graph serves every number of clicks, with or without a box.
+            sparse_prompt_embeddings = kwargs.get("sparse_prompt_embeddings")
+            if sparse_prompt_embeddings is None:
+                sparse_prompt_embeddings = args[2]
+            torch._dynamo.mark_dynamic(sparse_prompt_embeddings, 1)
+            return compiled_decoder(*args, **kwargs)
+
+        self.model.sam_mask_decoder.forward = decoder_forward
+        self.model._image_predictor_compiled = True
+
+    @torch.no_grad()
+    def warmup(self, prompt_batch_sizes: Tuple[int, ...] = (1,)) -> None:
+        """
+        Runs the model on a blank image to compile it for the usual input shapes
+        (a no-op on the first call without 'compile_model'), then saves the
+        compiled artifacts to 'compile_cache_path' if it is set. The image
+        encoder always sees the same shape. The number of prompt tokens is a
+        dynamic dimension of the compiled mask decoder, which is compiled for
+        each number of prompts per call in prompt_batch_sizes (e.g. the
+        'points_per_batch' of SAM2AutomaticMaskGenerator), with and without
+        multimask output. The warmup runs single-click, box and multi-click
+        prompts (with and without a mask input) through each of them, so that
+        these prompts don't compile on their first call.
+
+        Arguments:
+          prompt_batch_sizes (tuple(int)): The numbers of prompts per call to
+            compile the mask decoder for.
+        """
+        size = self.model.image_size
+        self.set_image(np.zeros((size, size, 3), dtype=np.uint8))
+        low_res_size = size // 4
+        for num_prompts in prompt_batch_sizes:
+            box = np.tile(
+                [size / 4, size / 4, 3 * size / 4, 3 * size / 4], (num_prompts, 1)
+            )
+            for num_clicks in (1, 2, 3):
+                point_coords = np.full((num_prompts, num_clicks, 2), size / 2)
+                point_labels = np.ones((num_prompts, num_clicks), dtype=np.int64)
+                for multimask_output in (True, False):
+                    self.predict(
+                        point_coords, point_labels, multimask_output=multimask_output
+                    )
+            for multimask_output in (True, False):
+                self.predict(box=box, multimask_output=multimask_output)
+            # a click refining the mask of the previous prediction
+            self.predict(
+                point_coords,
+                point_labels,
+                mask_input=np.zeros((num_prompts, 1, low_res_size, low_res_size)),
+                multimask_output=False,
+            )
+        self.reset_predictor()
+
+        if self.compile_cache_path is not None and getattr(
+            self.model, "_image_predictor_compiled", False
+        ):
+            artifacts = torch.compiler.save_cache_artifacts()
+            if artifacts is not None:
+                os.makedirs(
+                    os.path.dirname(os.path.abspath(self.compile_cache_path)),
+                    exist_ok=True,
+                )
+                with open(self.compile_cache_path, "wb") as f:
+                    f.write(artifacts[0])
+                logging.info(f"Saved compiled artifacts to {self.compile_cache_path}")
+
     @property
     def device(self) -> torch.device:
         return self.model.device
@@ -4,6 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import contextlib
 import warnings
 from collections import OrderedDict
 
@@ -13,7 +14,16 @@ import torch.nn.functional as F
 from tqdm import tqdm
 
 from sam2.modeling.sam2_base import NO_OBJ_SCORE, SAM2Base
-from sam2.utils.misc import concat_points, fill_holes_in_mask_scores, load_video_frames
+from sam2.utils.misc import (
+    AsyncVideoFrameLoader,
+    concat_points,
+    fill_holes_in_mask_scores,
+    FrameFeatureCache,
+    FramePrefetcher,
+    load_video_frames,
+    SpillingFrameOutputs,
+    StreamingVideoFrameLoader,
+)
 
 
 class SAM2VideoPredictor(SAM2Base):
@@ -30,6 +40,16 @@ class SAM2VideoPredictor(SAM2Base):
         # if `add_all_frames_to_correct_as_cond` is True, we also append to the conditioning frame list any frame that receives a later correction click
         # if `add_all_frames_to_correct_as_cond` is False, we conditioning frame list to only use those initial conditioning frames
         add_all_frames_to_correct_as_cond=False,
+        # whether to track all the objects with the same memory layout on a frame as one batch in
+        # `propagate_in_video` (instead of running memory attention, the mask decoder and the memory
+        # encoder once per object); each object's outputs and memories are still kept separately.
+        # None (default) batches them on CUDA only, since batching is slower on CPU
+        batch_objects_in_propagation=None,
+        # number of frames whose backbone features are computed ahead (in the processing order) on a
+        # background thread while `propagate_in_video` tracks the current frame (0 to disable), and the
+        # budget of those waiting to be tracked; on CPU, the two threads share the intra-op thread pool
+        backbone_prefetch_frames=0,
+        backbone_prefetch_max_bytes=1024**3,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -37,6 +57,9 @@ class SAM2VideoPredictor(SAM2Base):
         self.non_overlap_masks = non_overlap_masks
         self.clear_non_cond_mem_around_input = clear_non_cond_mem_around_input
         self.add_all_frames_to_correct_as_cond = add_all_frames_to_correct_as_cond
+        self.batch_objects_in_propagation = batch_objects_in_propagation
+        self.backbone_prefetch_frames = backbone_prefetch_frames
+        self.backbone_prefetch_max_bytes = backbone_prefetch_max_bytes
 
     @torch.inference_mode()
     def init_state(
@@ -45,8 +68,28 @@ class SAM2VideoPredictor(SAM2Base):
         offload_video_to_cpu=False,
         offload_state_to_cpu=False,
         async_loading_frames=False,
+        feature_cache_max_bytes=0,
+        offload_cached_features_to_cpu=False,
+        cached_features_fp16=False,
+        spill_frame_outputs_to=None,
     ):
-        """Initialize an inference state."""
+        """
+        Initialize an inference state.
+
+        The backbone features of recently visited frames are kept in an LRU cache of
+        `feature_cache_max_bytes` (the most recent frame is always kept, and by default
+        only that one), so that revisiting a frame doesn't rerun the image encoder. Each
+        cached frame takes about 16 MiB in float32 at the default 1024 resolution. The
+        cached features can be moved to CPU memory (`offload_cached_features_to_cpu`)
+        and/or stored in float16 (`cached_features_fp16`, which halves their size but
+        makes cache hits slightly differ numerically from recomputing the features) to
+        fit more frames.
+
+        With `spill_frame_outputs_to` set to "cpu" or to a directory, the tracking outputs
+        on non-conditioning frames that memory attention can no longer attend to are
+        spilled (losslessly compressed) to CPU memory or to files in that directory, and
+        recalled when needed again, so that the session memory stays flat on long videos.
+        """
         compute_device = self.device  # device of the model
         images, video_height, video_width = load_video_frames(
             video_path=video_path,
@@ -56,7 +99,10 @@ class SAM2VideoPredictor(SAM2Base):
             compute_device=compute_device,
         )
         inference_state = {}
+        # the video source (to reload the frames when restoring a saved session)
+        inference_state["video_path"] = video_path
         inference_state["images"] = images
+        inference_state["async_loading_frames"] = async_loading_frames
         inference_state["num_frames"] = len(images)
         # whether to offload the video frames to CPU memory
         # turning on this option saves the GPU memory with only a very small overhead
@@ -74,11 +120,20 @@ class SAM2VideoPredictor(SAM2Base):
             inference_state["storage_device"] = torch.device("cpu")
         else:
             inference_state["storage_device"] = compute_device
+        # where to spill the non-conditioning frame outputs out of the memory window
+        inference_state["spill_frame_outputs_to"] = spill_frame_outputs_to
         # inputs on each frame
         inference_state["point_inputs_per_obj"] = {}
         inference_state["mask_inputs_per_obj"] = {}
         # visual features on a small number of recently visited frames for quick interactions
-        inference_state["cached_features"] = {}
+        inference_state["cached_features"] = FrameFeatureCache(
+            max_bytes=feature_cache_max_bytes,
+            compute_device=compute_device,
+            storage_device=(
+                torch.device("cpu") if offload_cached_features_to_cpu else None
+            ),
+            dtype=torch.float16 if cached_features_fp16 else None,
+        )
         # values that don't change across frames (so we only need to hold one copy of them)
         inference_state["constants"] = {}
         # mapping between client-side object id and model-side object index
@@ -98,6 +153,239 @@ class SAM2VideoPredictor(SAM2Base):
         self._get_image_feature(inference_state, frame_idx=0, batch_size=1)
         return inference_state
 
+    # the init_state options restored with a saved session (unless overridden)
+    _SAVED_STATE_OPTIONS = (
+        "offload_video_to_cpu",
+        "offload_state_to_cpu",
+        "async_loading_frames",
+        "spill_frame_outputs_to",
+    )
+    # the frame output tensors kept on the storage device (the others are on the device)
+    _STORAGE_DEVICE_KEYS = ("maskmem_features", "pred_masks")
+
+    def save_state(self, inference_state, path):
+        """
+        Saves the prompts and tracking outputs (including the memory features) of an
+        inference session, but not its video frames or cached features, so that it can
+        be restored with 'load_state' without tracking the video again, e.g. to evict an
+        idle session from memory and resume it later.
+
+        Arguments:
+          inference_state (dict): The inference session to save.
+          path (str): The file to save the session to.
+        """
+
+        def pack_outputs(outputs):
+            # the spilled outputs are saved as spilled (compressed), without recalling
+            # them to memory
+            if isinstance(outputs, SpillingFrameOutputs):
+                exported = outputs.export()
+            else:
+                exported = {frame_idx: (out, {}) for frame_idx, out in outputs.items()}
+            packed = {}
+            for frame_idx, (out, spilled) in exported.items():
+                out = {k: _to_device(v, "cpu") for k, v in out.items()}
+                # "maskmem_pos_enc" is the same on all frames, it's restored from the
+                # session constants (we only keep whether the output has it)
+                out["maskmem_pos_enc"] = out["maskmem_pos_enc"] is not None
+                if spilled:
+                    out["spilled"] = {
+                        key: (data, dtype, tuple(shape))
+                        for key, (data, dtype, shape) in spilled.items()
+                    }
+                packed[frame_idx] = out
+            return packed
+
+        def pack_output_dicts(output_dict_per_obj):
+            return {
+                obj_idx: {
+                    "cond_frame_outputs": pack_outputs(v["cond_frame_outputs"]),
+                    "non_cond_frame_outputs": pack_outputs(v["non_cond_frame_outputs"]),
+                }
+                for obj_idx, v in output_dict_per_obj.items()
+            }
+
+        video_path = inference_state["video_path"]
+        state = {
+            # video content passed as bytes isn't saved (pass it again to 'load_state')
+            "video_path": video_path if isinstance(video_path, str) else None,
+            "num_frames": inference_state["num_frames"],
+            "options": {k: inference_state[k] for k in self._SAVED_STATE_OPTIONS},
+            "constants": _to_device(inference_state["constants"], "cpu"),
+            "obj_id_to_idx": dict(inference_state["obj_id_to_idx"]),
+            "obj_idx_to_id": dict(inference_state["obj_idx_to_id"]),
+            "obj_ids": list(inference_state["obj_ids"]),
+            "point_inputs_per_obj": _to_device(
+                inference_state["point_inputs_per_obj"], "cpu"
+            ),
+            "mask_inputs_per_obj": _to_device(
+                inference_state["mask_inputs_per_obj"], "cpu"
+            ),
+            "output_dict_per_obj": pack_output_dicts(
+                inference_state["output_dict_per_obj"]
+            ),
+            "temp_output_dict_per_obj": pack_output_dicts(
+                inference_state["temp_output_dict_per_obj"]
+            ),
+            "frames_tracked_per_obj": inference_state["frames_tracked_per_obj"],
+        }
+        torch.save(state, path)
+
+    @torch.inference_mode()
+    def load_state(self, path, video_path=None, **kwargs):
+        """
+        Restores an inference session saved with 'save_state'. Its video frames are
+        loaded again from the video, while its prompts and tracking outputs are restored
+        as they were saved.
+
+        Arguments:
+          path (str): The file to load the session from.
+          video_path (str or bytes or None): The video of the session, if it was saved
+            from bytes or has moved since.
+          **kwargs: Additional arguments to pass to 'init_state' (e.g. the feature
+            cache options), overriding the saved ones.
+
+        Returns:
+          (dict): The restored inference session.
+        """
+        state = torch.load(path, map_location="cpu", weights_only=True)
+        if video_path is None:
+            video_path = state["video_path"]
+        if video_path is None:
+            raise ValueError(
+                "The session was saved from video bytes; please pass its video_path."
+            )
+        inference_state = self.init_state(
+            video_path=video_path, **{**state["options"], **kwargs}
+        )
+        if inference_state["num_frames"] != state["num_frames"]:
+            raise RuntimeError(
+                f"The video has {inference_state['num_frames']} frames but the saved "
+                f"session has {state['num_frames']} frames."
+            )
+        device = inference_state["device"]
+        storage_device = inference_state["storage_device"]
+        constants = _to_device(state["constants"], device)
+        inference_state["constants"] = constants
+
+        def unpack_outputs(packed, outputs):
+            for frame_idx, out in packed.items():
+                spilled = out.pop("spilled", {})
+                if not isinstance(outputs, SpillingFrameOutputs):
+                    for key, (data, dtype, shape) in spilled.items():
+                        out[key] = SpillingFrameOutputs.decompress(data, dtype, shape)
+                    spilled = {}
+                out = {
+                    k: _to_device(
+                        v, storage_device if k in self._STORAGE_DEVICE_KEYS else device
+                    )
+                    for k, v in out.items()
+                }
+                if out["maskmem_pos_enc"]:
+                    batch_size = (
+                        spilled["pred_masks"][2][0]
+                        if "pred_masks" in spilled
+                        else out["pred_masks"].size(0)
+                    )
+                    out["maskmem_pos_enc"] = [
+                        x.expand(batch_size, -1, -1, -1)
+                        for x in constants["maskmem_pos_enc"]
+                    ]
+                else:
+                    out["maskmem_pos_enc"] = None
+                if spilled:
+                    outputs.add_spilled(frame_idx, out, spilled, storage_device)
+                else:
+                    outputs[frame_idx] = out
+            return outputs
+
+        def unpack_output_dicts(packed, is_temp):
+            return {
+                obj_idx: {
+                    "cond_frame_outputs": unpack_outputs(v["cond_frame_outputs"], {}),
+                    "non_cond_frame_outputs": unpack_outputs(
+                        v["non_cond_frame_outputs"],
+                        (
+                            {}
+                            if is_temp
+                            else self._new_non_cond_frame_outputs(inference_state)
+                        ),
+                    ),
+                }
+                for obj_idx, v in packed.items()
+            }
+
+        inference_state["obj_id_to_idx"] = OrderedDict(state["obj_id_to_idx"])
+        inference_state["obj_idx_to_id"] = OrderedDict(state["obj_idx_to_id"])
+        inference_state["obj_ids"] = state["obj_ids"]
+        inference_state["point_inputs_per_obj"] = _to_device(
+            state["point_inputs_per_obj"], device
+        )
+        inference_state["mask_inputs_per_obj"] = _to_device(
+            state["mask_inputs_per_obj"], device
+        )
+        inference_state["output_dict_per_obj"] = unpack_output_dicts(
+            state["output_dict_per_obj"], is_temp=False
+        )
+        inference_state["temp_output_dict_per_obj"] = unpack_output_dicts(
+            state["temp_output_dict_per_obj"], is_temp=True
+        )
+        inference_state["frames_tracked_per_obj"] = state["frames_tracked_per_obj"]
+        return inference_state
+
+    def state_nbytes(self, inference_state):
+        """
+        The memory held by an inference session, in bytes: its video frames (those
+        loaded or buffered so far with `async_loading_frames`), its cached backbone
+        features, and its tracking outputs and inputs (including the outputs spilled to
+        CPU memory, but not those spilled to files). Tensors sharing memory (e.g. views
+        of the same batch outputs) are counted once.
+        """
+        seen = set()
+
+        def nbytes(obj):
+            if isinstance(obj, torch.Tensor):
+                storage = obj.untyped_storage()
+                if storage.data_ptr() in seen:
+                    return 0
+                seen.add(storage.data_ptr())
+                return storage.nbytes()
+            if isinstance(obj, SpillingFrameOutputs):
+                # (reading its outputs would recall the spilled ones)
+                stats = obj.stats()
+                spilled_bytes = stats["spilled_bytes"] if obj.spill_dir is None else 0
+                return stats["in_memory_bytes"] + spilled_bytes
+            if isinstance(obj, dict):
+                return sum(nbytes(v) for v in obj.values())
+            if isinstance(obj, (list, tuple)):
+                return sum(nbytes(v) for v in obj)
+            return 0
+
+        images = inference_state["images"]
+        if isinstance(images, StreamingVideoFrameLoader):
+            frames_bytes = images.stats()["buffered_bytes"]
+        elif isinstance(images, AsyncVideoFrameLoader):
+            frames_bytes = nbytes(images.images)
+        else:
+            frames_bytes = nbytes(images)
+        features_bytes = inference_state["cached_features"].stats()["bytes"]
+        outputs_bytes = sum(
+            nbytes(inference_state[k])
+            for k in [
+                "constants",
+                "point_inputs_per_obj",
+                "mask_inputs_per_obj",
+                "output_dict_per_obj",
+                "temp_output_dict_per_obj",
+            ]
+        )
+        return {
+            "frames": frames_bytes,
+            "features": features_bytes,
+            "outputs": outputs_bytes,
+            "total": frames_bytes + features_bytes + outputs_bytes,
+        }
+
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2VideoPredictor":
         """
@@ -134,7 +422,10 @@ class SAM2VideoPredictor(SAM2Base):
             inference_state["mask_inputs_per_obj"][obj_idx] = {}
             inference_state["output_dict_per_obj"][obj_idx] = {
                 "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
-                "non_cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
+                # dict containing {frame_idx: <out>} (possibly spilling old outputs)
+                "non_cond_frame_outputs": self._new_non_cond_frame_outputs(
+                    inference_state
+                ),
             }
             inference_state["temp_output_dict_per_obj"][obj_idx] = {
                 "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
@@ -149,6 +440,20 @@ class SAM2VideoPredictor(SAM2Base):
                 f"Please call 'reset_state' to restart from scratch."
             )
 
+    def _new_non_cond_frame_outputs(self, inference_state):
+        """The dict of an object's non-conditioning frame outputs (see `init_state`)."""
+        spill_to = inference_state.get("spill_frame_outputs_to")
+        if spill_to is None:
+            return {}
+        # the farthest frames that memory attention reads from a frame, i.e. the last
+        # (num_maskmem - 1) memory frames at the temporal stride and the object pointers
+        window = (self.num_maskmem - 1) * self.memory_temporal_stride_for_eval + 1
+        if self.use_obj_ptrs_in_encoder:
+            window = max(window, self.max_obj_ptrs_in_encoder - 1)
+        return SpillingFrameOutputs(
+            window=window, spill_dir=None if spill_to == "cpu" else spill_to
+        )
+
     def _obj_idx_to_id(self, inference_state, obj_idx):
         """Map model-side object index to client-side object id."""
         return inference_state["obj_idx_to_id"][obj_idx]
@@ -580,54 +885,189 @@ class SAM2VideoPredictor(SAM2Base):
             )
             processing_order = range(start_frame_idx, end_frame_idx + 1)
 
-        for frame_idx in tqdm(processing_order, desc="propagate in video"):
-            pred_masks_per_obj = [None] * batch_size
-            for obj_idx in range(batch_size):
-                obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
-                # We skip those frames already in consolidated outputs (these are frames
-                # that received input clicks or mask). Note that we cannot directly run
-                # batched forward on them via `_run_single_frame_inference` because the
-                # number of clicks on each object might be different.
-                if frame_idx in obj_output_dict["cond_frame_outputs"]:
-                    storage_key = "cond_frame_outputs"
-                    current_out = obj_output_dict[storage_key][frame_idx]
-                    device = inference_state["device"]
-                    pred_masks = current_out["pred_masks"].to(device, non_blocking=True)
-                    if self.clear_non_cond_mem_around_input:
-                        # clear non-conditioning memory of the surrounding frames
-                        self._clear_obj_non_cond_mem_around_input(
-                            inference_state, frame_idx, obj_idx
+        # compute the backbone features of the next frames while tracking each frame
+        prefetcher = self._start_backbone_prefetch(inference_state, processing_order)
+        try:
+            for frame_idx in tqdm(processing_order, desc="propagate in video"):
+                pred_masks_per_obj = [None] * batch_size
+                obj_idxs_to_track = []
+                for obj_idx in range(batch_size):
+                    obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
+                    # We skip those frames already in consolidated outputs (these are frames
+                    # that received input clicks or mask). Note that we cannot directly run
+                    # batched forward on them via `_run_single_frame_inference` because the
+                    # number of clicks on each object might be different.
+                    if frame_idx in obj_output_dict["cond_frame_outputs"]:
+                        storage_key = "cond_frame_outputs"
+                        current_out = obj_output_dict[storage_key][frame_idx]
+                        device = inference_state["device"]
+                        pred_masks = current_out["pred_masks"].to(
+                            device, non_blocking=True
                         )
-                else:
-                    storage_key = "non_cond_frame_outputs"
+                        if self.clear_non_cond_mem_around_input:
+                            # clear non-conditioning memory of the surrounding frames
+                            self._clear_obj_non_cond_mem_around_input(
+                                inference_state, frame_idx, obj_idx
+                            )
+                        inference_state["frames_tracked_per_obj"][obj_idx][
+                            frame_idx
+                        ] = {"reverse": reverse}
+                        pred_masks_per_obj[obj_idx] = pred_masks
+                    else:
+                        obj_idxs_to_track.append(obj_idx)
+
+                # Track the other objects, in batches of objects with the same memory layout
+                storage_key = "non_cond_frame_outputs"
+                for obj_idxs in self._batch_objects_to_track(
+                    inference_state, frame_idx, obj_idxs_to_track, reverse
+                ):
+                    output_dicts = [
+                        inference_state["output_dict_per_obj"][obj_idx]
+                        for obj_idx in obj_idxs
+                    ]
                     current_out, pred_masks = self._run_single_frame_inference(
                         inference_state=inference_state,
-                        output_dict=obj_output_dict,
+                        output_dict=(
+                            output_dicts if len(obj_idxs) > 1 else output_dicts[0]
+                        ),
                         frame_idx=frame_idx,
-                        batch_size=1,  # run on the slice of a single object
+                        batch_size=len(obj_idxs),
                         is_init_cond_frame=False,
                         point_inputs=None,
                         mask_inputs=None,
                         reverse=reverse,
                         run_mem_encoder=True,
                     )
-                    obj_output_dict[storage_key][frame_idx] = current_out
+                    for i, (obj_idx, obj_output_dict) in enumerate(
+                        zip(obj_idxs, output_dicts)
+                    ):
+                        obj_output_dict[storage_key][frame_idx] = (
+                            self._get_obj_slice_of_output(current_out, i)
+                            if len(obj_idxs) > 1
+                            else current_out
+                        )
+                        inference_state["frames_tracked_per_obj"][obj_idx][
+                            frame_idx
+                        ] = {"reverse": reverse}
+                        pred_masks_per_obj[obj_idx] = pred_masks[i : i + 1]
+
+                # Resize the output mask to the original video resolution (we directly use
+                # the mask scores on GPU for output to avoid any CPU conversion in between)
+                if len(pred_masks_per_obj) > 1:
+                    all_pred_masks = torch.cat(pred_masks_per_obj, dim=0)
+                else:
+                    all_pred_masks = pred_masks_per_obj[0]
+                _, video_res_masks = self._get_orig_video_res_output(
+                    inference_state, all_pred_masks
+                )
+                yield frame_idx, obj_ids, video_res_masks
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+                inference_state.pop("backbone_prefetcher", None)
+                inference_state["backbone_prefetch_stats"] = prefetcher.stats()
+
+    def _start_backbone_prefetch(self, inference_state, processing_order):
+        """
+        Start computing the backbone features of the frames in `processing_order` on a
+        background thread (taken by `_get_image_feature`), if backbone prefetching is on.
+        """
+        if self.backbone_prefetch_frames <= 0:
+            return None
+        # frames where all objects have consolidated outputs don't need their features
+        output_dict_per_obj = inference_state["output_dict_per_obj"]
+        frames_to_track = [
+            t
+            for t in processing_order
+            if any(
+                t not in d["cond_frame_outputs"] for d in output_dict_per_obj.values()
+            )
+        ]
+        device = inference_state["device"]
+        # inference and autocast modes are thread-local, so we carry them to the thread
+        autocast_dtype = None
+        if torch.is_autocast_enabled(device.type):
+            autocast_dtype = torch.get_autocast_dtype(device.type)
+        if device.type == "cuda":
+            # run the backbone on a side stream to overlap it with the tracking kernels
+            prefetch_stream = torch.cuda.Stream(device)
+            tracking_stream = torch.cuda.current_stream(device)
+        else:
+            prefetch_stream = None
 
-                inference_state["frames_tracked_per_obj"][obj_idx][frame_idx] = {
-                    "reverse": reverse
-                }
-                pred_masks_per_obj[obj_idx] = pred_masks
+        def compute_backbone_fpn(frame_idx):
+            stream_context = (
+                torch.cuda.stream(prefetch_stream)
+                if prefetch_stream is not None
+                else contextlib.nullcontext()
+            )
+            with torch.inference_mode(), torch.autocast(
+                device.type,
+                dtype=autocast_dtype,
+                enabled=autocast_dtype is not None,
+            ), stream_context:
+                image = inference_state["images"][frame_idx].to(device).float()
+                backbone_out = self.forward_image(image.unsqueeze(0))
+            # the position encodings are the same on all frames (and already in the
+            # feature cache), so we only keep the FPN features in the prefetch queue
+            backbone_fpn = backbone_out["backbone_fpn"]
+            if prefetch_stream is not None:
+                prefetch_stream.synchronize()
+                for feat in backbone_fpn:
+                    # don't let the side stream reuse the memory while still in use
+                    feat.record_stream(tracking_stream)
+            return backbone_fpn
+
+        prefetcher = FramePrefetcher(
+            frame_order=frames_to_track,
+            compute_fn=compute_backbone_fpn,
+            max_frames=self.backbone_prefetch_frames,
+            max_bytes=self.backbone_prefetch_max_bytes,
+            skip_fn=lambda t: t in inference_state["cached_features"],
+        )
+        inference_state["backbone_prefetcher"] = prefetcher
+        return prefetcher
 
-            # Resize the output mask to the original video resolution (we directly use
-            # the mask scores on GPU for output to avoid any CPU conversion in between)
-            if len(pred_masks_per_obj) > 1:
-                all_pred_masks = torch.cat(pred_masks_per_obj, dim=0)
-            else:
-                all_pred_masks = pred_masks_per_obj[0]
-            _, video_res_masks = self._get_orig_video_res_output(
-                inference_state, all_pred_masks
+    def _batch_objects_to_track(self, inference_state, frame_idx, obj_idxs, reverse):
+        """
+        Split the objects to track on a frame into batches of objects with the same
+        memory layout on this frame (which can run as one forward).
+        """
+        # the non-overlapping constraints in the memory encoder would apply across the
+        # objects of a batch, while each object is tracked independently otherwise
+        batch_objects = self.batch_objects_in_propagation
+        if batch_objects is None:
+            batch_objects = inference_state["device"].type == "cuda"
+        if not batch_objects or self.non_overlap_masks_for_mem_enc:
+            return [[obj_idx] for obj_idx in obj_idxs]
+        batches = {}
+        for obj_idx in obj_idxs:
+            layout = self._memory_layout(
+                frame_idx=frame_idx,
+                output_dict=inference_state["output_dict_per_obj"][obj_idx],
+                num_frames=inference_state["num_frames"],
+                track_in_reverse=reverse,
             )
-            yield frame_idx, obj_ids, video_res_masks
+            batches.setdefault(layout, []).append(obj_idx)
+        return list(batches.values())
+
+    def _get_obj_slice_of_output(self, current_out, i):
+        """The output of the i-th object in a (compact) frame output of a batch of objects."""
+        maskmem_features = current_out["maskmem_features"]
+        maskmem_pos_enc = current_out["maskmem_pos_enc"]
+        return {
+            "maskmem_features": (
+                maskmem_features[i : i + 1] if maskmem_features is not None else None
+            ),
+            "maskmem_pos_enc": (
+                [x[i : i + 1] for x in maskmem_pos_enc]
+                if maskmem_pos_enc is not None
+                else None
+            ),
+            "pred_masks": current_out["pred_masks"][i : i + 1],
+            "obj_ptr": current_out["obj_ptr"][i : i + 1],
+            "object_score_logits": current_out["object_score_logits"][i : i + 1],
+        }
 
     @torch.inference_mode()
     def clear_all_prompts_in_frame(
@@ -695,6 +1135,7 @@ class SAM2VideoPredictor(SAM2Base):
         for v in inference_state["output_dict_per_obj"].values():
             v["cond_frame_outputs"].clear()
             v["non_cond_frame_outputs"].clear()
+            v.pop("memory_kv_cache", None)
         for v in inference_state["temp_output_dict_per_obj"].values():
             v["cond_frame_outputs"].clear()
             v["non_cond_frame_outputs"].clear()
@@ -702,22 +1143,33 @@ class SAM2VideoPredictor(SAM2Base):
             v.clear()
 
     def _get_image_feature(self, inference_state, frame_idx, batch_size):
-        """Compute the image features on a given frame."""
+        """
+        Compute the image features on a given frame. The frame is only loaded to run
+        the image encoder on a cache miss, so the image returned in place of the
+        expanded frame is None (no caller reads it).
+        """
         # Look up in the cache first
-        image, backbone_out = inference_state["cached_features"].get(
-            frame_idx, (None, None)
-        )
+        backbone_out = inference_state["cached_features"].get(frame_idx)
         if backbone_out is None:
-            # Cache miss -- we will run inference on a single image
-            device = inference_state["device"]
-            image = inference_state["images"][frame_idx].to(device).float().unsqueeze(0)
-            backbone_out = self.forward_image(image)
-            # Cache the most recent frame's feature (for repeated interactions with
-            # a frame; we can use an LRU cache for more frames in the future).
-            inference_state["cached_features"] = {frame_idx: (image, backbone_out)}
+            # Cache miss -- take the features from the prefetch thread during propagation
+            # or we will run inference on a single image
+            prefetcher = inference_state.get("backbone_prefetcher")
+            backbone_fpn = None
+            if prefetcher is not None:
+                backbone_fpn = prefetcher.take(frame_idx)
+            if backbone_fpn is not None:
+                backbone_out = {
+                    "backbone_fpn": backbone_fpn,
+                    "vision_pos_enc": inference_state["cached_features"].vision_pos_enc,
+                }
+            else:
+                device = inference_state["device"]
+                image = inference_state["images"][frame_idx]
+                image = image.to(device).float().unsqueeze(0)
+                backbone_out = self.forward_image(image)
+            inference_state["cached_features"].put(frame_idx, backbone_out)
 
         # expand the features to have the same dimension as the number of objects
-        expanded_image = image.expand(batch_size, -1, -1, -1)
         expanded_backbone_out = {
             "backbone_fpn": backbone_out["backbone_fpn"].copy(),
             "vision_pos_enc": backbone_out["vision_pos_enc"].copy(),
@@ -731,7 +1183,7 @@ class SAM2VideoPredictor(SAM2Base):
             expanded_backbone_out["vision_pos_enc"][i] = pos
 
         features = self._prepare_backbone_features(expanded_backbone_out)
-        features = (expanded_image,) + features
+        features = (None,) + features
         return features
 
     def _run_single_frame_inference(
@@ -1221,3 +1673,14 @@ class SAM2VideoPredictorVOS(SAM2VideoPredictor):
             )
 
         return maskmem_features, maskmem_pos_enc
+
+
+def _to_device(obj, device):
+    """Move the tensors in nested dicts, lists and tuples to a device."""
+    if isinstance(obj, torch.Tensor):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_device(v, device)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_device(v, device) for v in obj)
+    return obj
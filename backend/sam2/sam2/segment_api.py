@@ -1,5 +1,11 @@
+import hashlib
 import os
 import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List, Dict, Tuple, Optional
 
 import numpy as np
@@ -12,50 +18,114 @@ sam2_root = os.path.dirname(current_dir)  # backend/sam2
 if sam2_root not in sys.path:
     sys.path.insert(0, sam2_root)
 
-# Constants for model files (SAM2 interprets these as relative to the package)
-CONFIG_FILE = "configs/sam2.1/sam2.1_hiera_l.yaml"
-CHECKPOINT_FILE = "../checkpoints/sam2.1_hiera_large.pt"
+# Model tiers, from best quality to fastest: name -> (config, checkpoint).
+# Configs are Hydra paths within the sam2 package, checkpoints are relative to this directory.
+MODEL_TIERS: Dict[str, Tuple[str, str]] = {
+    "large": ("configs/sam2.1/sam2.1_hiera_l.yaml", "../checkpoints/sam2.1_hiera_large.pt"),
+    "base_plus": ("configs/sam2.1/sam2.1_hiera_b+.yaml", "../checkpoints/sam2.1_hiera_base_plus.pt"),
+    "small": ("configs/sam2.1/sam2.1_hiera_s.yaml", "../checkpoints/sam2.1_hiera_small.pt"),
+    "tiny": ("configs/sam2.1/sam2.1_hiera_t.yaml", "../checkpoints/sam2.1_hiera_tiny.pt"),
+}
+# Relative cost of each tier (inverse of the SAM 2.1 reported FPS, large = 1)
+TIER_COSTS = {"large": 1.0, "base_plus": 0.62, "small": 0.47, "tiny": 0.43}
+# AMG point grids the controller may pick, from best recall to fastest
+POINTS_PER_SIDE_LEVELS = (16, 12, 8)
+# Grid points decoded per mask decoder call by the AMG
+AMG_POINTS_PER_BATCH = 64
+
+# SAM2_CONFIG / SAM2_CHECKPOINT select the default model (large if unset)
+DEFAULT_TIER = "large"
+if os.environ.get("SAM2_CONFIG"):
+    DEFAULT_TIER = next(
+        (name for name, (cfg, _) in MODEL_TIERS.items() if cfg == os.environ["SAM2_CONFIG"]),
+        "custom",
+    )
+    MODEL_TIERS[DEFAULT_TIER] = (
+        os.environ["SAM2_CONFIG"],
+        os.environ.get("SAM2_CHECKPOINT", MODEL_TIERS.get(DEFAULT_TIER, (None, ""))[1]),
+    )
+    TIER_COSTS.setdefault(DEFAULT_TIER, 1.0)
+elif os.environ.get("SAM2_CHECKPOINT"):
+    MODEL_TIERS[DEFAULT_TIER] = (MODEL_TIERS[DEFAULT_TIER][0], os.environ["SAM2_CHECKPOINT"])
+# Tiers kept loaded at once, comma separated, e.g. "large,small,tiny" (default: only the default tier)
+ENABLED_TIERS = [
+    name.strip() for name in os.environ.get("SAM2_MODEL_TIERS", DEFAULT_TIER).split(",") if name.strip()
+]
+# Target latency of a /segment request; under load the controller degrades quality to meet it
+LATENCY_SLO_S = float(os.environ.get("SAM2_LATENCY_SLO_MS", "15000")) / 1000.0
+
+# Optional reduced input resolution (e.g. 768), faster on CPU for large objects
+IMAGE_SIZE = int(os.environ["SAM2_IMAGE_SIZE"]) if os.environ.get("SAM2_IMAGE_SIZE") else None
+
+# Image features kept for refine_pil, as files written by SAM2ImagePredictor.save_features
+FEATURES_DIR = os.environ.get("SAM2_FEATURES_DIR", os.path.join(tempfile.gettempdir(), "sam2_features"))
+# Cached features unused for this long are deleted (0 to keep them), then the least recently
+# used ones while they take more than SAM2_FEATURES_MAX_MB of disk space (0 for no limit)
+FEATURES_TTL_S = float(os.environ.get("SAM2_FEATURES_TTL_S", "86400"))
+FEATURES_MAX_MB = float(os.environ.get("SAM2_FEATURES_MAX_MB", "2048"))
+# Temporary files older than this were left by a crash while saving features
+STALE_FEATURES_TMP_S = 3600
+# Registered images whose features are not computed yet are kept in memory up to this count
+MAX_PENDING_IMAGES = int(os.environ.get("SAM2_MAX_PENDING_IMAGES", "8"))
+
+# Compile the image encoder and mask decoder with torch.compile and warm them up when
+# the models are loaded (a slow first startup, faster decoding afterwards)
+COMPILE = os.environ.get("SAM2_COMPILE", "0") == "1"
+# Compiled artifacts are kept here across restarts
+COMPILE_CACHE_DIR = os.environ.get("SAM2_COMPILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sam2_compile"))
 
 try:
     from sam2.build_sam import build_sam2
     from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+    from sam2.utils.amg import bbox_crop_to_mask
 except ImportError:
     # Fallback: try to import from current directory
     try:
         from .build_sam import build_sam2
         from .automatic_mask_generator import SAM2AutomaticMaskGenerator
+        from .utils.amg import bbox_crop_to_mask
     except ImportError:
         # Last resort: try absolute imports
         from build_sam import build_sam2
         from automatic_mask_generator import SAM2AutomaticMaskGenerator
+        from utils.amg import bbox_crop_to_mask
 
-_model = None
-_mask_gen = None
+_models: Dict[str, torch.nn.Module] = {}  # tier -> loaded model
+_mask_gens: Dict[Tuple[str, int], "SAM2AutomaticMaskGenerator"] = {}  # (tier, points_per_side) -> AMG
+_refine_predictors: Dict[str, "SAM2ImagePredictor"] = {}  # tier -> predictor
+_refine_image: Optional[Tuple[str, str]] = None  # (tier, image_id) set on its refine predictor
+_pending_images: "OrderedDict[str, np.ndarray]" = OrderedDict()  # oldest first
+_pending_lock = threading.Lock()
+_load_lock = threading.Lock()
 
-def _mask_to_bbox(mask: np.ndarray) -> Dict[str, int]:
-    y_idx, x_idx = np.where(mask)
-    if x_idx.size == 0 or y_idx.size == 0:
-        return {"x": 0, "y": 0, "width": 0, "height": 0}
-    x_min, x_max = int(x_idx.min()), int(x_idx.max())
-    y_min, y_max = int(y_idx.min()), int(y_idx.max())
-    return {
-        "x": x_min,
-        "y": y_min,
-        "width": max(0, x_max - x_min + 1),
-        "height": max(0, y_max - y_min + 1),
-    }
+MASK_FORMATS = ("full", "bbox_crop")
+
+def _bbox_crop_to_bbox(segmentation: Dict) -> Dict[str, int]:
+    """Bounding box of a bbox-cropped mask (see sam2.utils.amg.rle_to_bbox_crop)."""
+    x, y = segmentation["offset"]
+    height, width = segmentation["mask"].shape
+    return {"x": int(x), "y": int(y), "width": int(width), "height": int(height)}
+
+def _resolve_checkpoint(ckpt_file: str) -> str:
+    """Resolve a checkpoint path given absolute, relative to the CWD, to backend/sam2 or to this directory."""
+    for base_dir in (os.getcwd(), sam2_root, current_dir):
+        ckpt_fs_path = os.path.abspath(os.path.join(base_dir, ckpt_file))
+        if os.path.exists(ckpt_fs_path):
+            return ckpt_fs_path
+    return os.path.abspath(os.path.join(current_dir, ckpt_file))
 
-def _verify_files_exist() -> Tuple[str, str]:
-    """Verify that the required model files exist and return their paths.
-    Note: CONFIG_FILE is a Hydra config path relative to the 'sam2' package, so we do not hard fail on os.path.exists for it.
+def _verify_files_exist(tier: str) -> Tuple[str, str]:
+    """Verify that the model files of a tier exist and return their paths.
+    Note: the config is a Hydra config path relative to the 'sam2' package, so we do not hard fail on os.path.exists for it.
     """
+    config_file, ckpt_file = MODEL_TIERS[tier]
     # Best-effort check for config file on disk relative to this module for debugging
-    config_fs_path = os.path.join(current_dir, CONFIG_FILE)
+    config_fs_path = os.path.join(current_dir, config_file)
     if not os.path.exists(config_fs_path):
         print(f"⚠️ Config file not found on filesystem at: {config_fs_path} (this may be fine if Hydra loads it from the package)")
     
     # Verify checkpoint file exists using a resolved absolute path
-    ckpt_fs_path = os.path.abspath(os.path.join(current_dir, CHECKPOINT_FILE))
+    ckpt_fs_path = _resolve_checkpoint(ckpt_file)
     if not os.path.exists(ckpt_fs_path):
         print(f"❌ Checkpoint file not found: {ckpt_fs_path}")
         print(f"Current directory: {os.getcwd()}")
@@ -68,7 +138,7 @@ def _verify_files_exist() -> Tuple[str, str]:
         raise FileNotFoundError(f"Checkpoint file not found: {ckpt_fs_path}")
     
     # Return Hydra-relative config path and ABSOLUTE checkpoint path for build_sam2
-    return CONFIG_FILE, ckpt_fs_path
+    return config_file, ckpt_fs_path
 
 def _get_device() -> str:
     """Determine the device to use for model inference."""
@@ -82,53 +152,262 @@ def _get_device() -> str:
     return "cpu"
 
 def _ensure_model() -> None:
-    """Ensure the SAM2 model is loaded and ready for inference."""
-    global _model, _mask_gen
-    if _model is not None and _mask_gen is not None:
+    """Ensure the SAM2 models of all enabled tiers are loaded and ready for inference."""
+    if all(tier in _models for tier in ENABLED_TIERS):
         return
+    with _load_lock:
+        device = _get_device()
+        print(f"Using device: {device}")
+        
+        for tier in ENABLED_TIERS:
+            if tier in _models:
+                continue
+            if tier not in MODEL_TIERS:
+                raise ValueError(f"Unknown SAM2 model tier {tier}, expected one of {list(MODEL_TIERS)}")
+            print(f"🔍 Loading SAM2 {tier} model from: {MODEL_TIERS[tier][0]}")
+            print(f"Checkpoint path: {MODEL_TIERS[tier][1]}")
+            
+            # Verify files exist and get their paths
+            config_file, ckpt_path = _verify_files_exist(tier)
+            try:
+                model = build_sam2(config_file=config_file, ckpt_path=ckpt_path, device=device, image_size=IMAGE_SIZE)
+                print(f"✅ SAM2 {tier} model loaded successfully")
+            except Exception as e:
+                print(f"❌ Error loading SAM2 {tier} model: {e}")
+                raise
+            if COMPILE:
+                _compile_model(model, tier)
+            _models[tier] = model
+
+def _compile_model(model: torch.nn.Module, tier: str) -> None:
+    """Compile a model and warm it up for the prompt batch sizes of the AMG and of box/click prompts."""
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
     
-    print(f"🔍 Loading SAM2 model from: {CONFIG_FILE}")
-    print(f"Checkpoint path: {CHECKPOINT_FILE}")
-    
-    # Verify files exist and get their paths
-    config_file, ckpt_path = _verify_files_exist()
-    device = _get_device()
-    
-    print(f"Using device: {device}")
-    
-    try:
-        _model = build_sam2(config_file=config_file, ckpt_path=ckpt_path, device=device)
+    suffix = f"_{IMAGE_SIZE}" if IMAGE_SIZE else ""
+    cache_path = os.path.join(COMPILE_CACHE_DIR, f"{tier}{suffix}_torch{torch.__version__}.bin")
+    prompt_batch_sizes = {1}
+    for points_per_side in POINTS_PER_SIDE_LEVELS:
+        num_points = points_per_side ** 2
+        if num_points >= AMG_POINTS_PER_BATCH:
+            prompt_batch_sizes.add(AMG_POINTS_PER_BATCH)
+        if num_points % AMG_POINTS_PER_BATCH:
+            prompt_batch_sizes.add(num_points % AMG_POINTS_PER_BATCH)
+    print(f"⏳ Compiling SAM2 {tier} model (cache: {cache_path}), this may take minutes the first time")
+    start = time.time()
+    predictor = SAM2ImagePredictor(model, compile_model=True, compile_cache_path=cache_path)
+    predictor.warmup(prompt_batch_sizes=tuple(sorted(prompt_batch_sizes)))
+    print(f"✅ SAM2 {tier} model compiled and warmed up in {time.time() - start:.1f}s")
+
+def warmup() -> None:
+    """Load the models of all enabled tiers (and compile them with SAM2_COMPILE=1) ahead of the first request."""
+    _ensure_model()
+
+def _get_mask_gen(tier: str, points_per_side: int) -> "SAM2AutomaticMaskGenerator":
+    """The automatic mask generator of a tier for a point grid (they share the tier's model)."""
+    key = (tier, points_per_side)
+    if key not in _mask_gens:
         # More permissive defaults to increase recall on household scenes
-        _mask_gen = SAM2AutomaticMaskGenerator(
-            _model,
-            points_per_side=16,
+        _mask_gens[key] = SAM2AutomaticMaskGenerator(
+            _models[tier],
+            points_per_side=points_per_side,
             pred_iou_thresh=0.5,           # lower to include more masks
             stability_score_thresh=0.6,    # slightly lower than default
             min_mask_region_area=50,       # allow small objects
+            points_per_batch=AMG_POINTS_PER_BATCH,
+            output_mode="bbox_crop",       # keep masks only within their boxes
         )
-        print("✅ SAM2 model loaded successfully")
-    except Exception as e:
-        print(f"❌ Error loading SAM2 model: {e}")
+    return _mask_gens[key]
+
+class TierController:
+    """
+    Serializes requests on the models and picks the model tier and AMG
+    points_per_side of each one. A request gets the best quality level whose
+    expected latency, times the number of requests queued behind it, fits in
+    what is left of the latency SLO after its own queueing time; if none fits,
+    the fastest level. Expected latencies are running averages of measured
+    ones, estimated from the relative tier and point grid costs until measured.
+    """
+    
+    def __init__(self, tiers: List[str], slo_s: float):
+        self.tiers = tiers
+        self.slo_s = slo_s
+        # Quality levels (tier, points_per_side), best first; points_per_side is 0 for box prompts
+        self.grid_levels = [(tier, pps) for tier in tiers for pps in POINTS_PER_SIDE_LEVELS]
+        self.box_levels = [(tier, 0) for tier in tiers]
+        self._latency_s: Dict[Tuple[str, int], float] = {}
+        self._waiting = 0
+        self._state_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+    
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+    
+    def _cost(self, level: Tuple[str, int]) -> float:
+        tier, pps = level
+        # backbone + decoder, the decoder runs once per grid point
+        return TIER_COSTS.get(tier, 1.0) * (0.5 + 0.5 * (pps / POINTS_PER_SIDE_LEVELS[0]) ** 2)
+    
+    def expected_latency(self, level: Tuple[str, int]) -> Optional[float]:
+        if level in self._latency_s:
+            return self._latency_s[level]
+        # Scale the measured latency of a level of the same kind by the relative costs
+        for measured, latency_s in self._latency_s.items():
+            if (measured[1] == 0) == (level[1] == 0):
+                return latency_s * self._cost(level) / self._cost(measured)
+        return None
+    
+    def choose(self, levels: List[Tuple[str, int]], waited_s: float, queued_behind: int) -> Tuple[str, int]:
+        budget_s = (self.slo_s - waited_s) / (1 + queued_behind)
+        for level in levels:
+            latency_s = self.expected_latency(level)
+            if latency_s is None or latency_s <= budget_s:
+                return level
+        return levels[-1]
+    
+    def record(self, level: Tuple[str, int], latency_s: float) -> None:
+        with self._state_lock:
+            previous = self._latency_s.get(level)
+            self._latency_s[level] = latency_s if previous is None else 0.7 * previous + 0.3 * latency_s
+    
+    @contextmanager
+    def run(self, point_grid: bool = True, tier: Optional[str] = None):
+        """
+        Wait for the models and yield the (tier, points_per_side) to run with,
+        for automatic segmentation with a point grid or with box prompts.
+        If tier is given it is used as is, and its latency is not recorded.
+        """
+        start = time.time()
+        with self._state_lock:
+            self._waiting += 1
+        try:
+            self._model_lock.acquire()
+        finally:
+            with self._state_lock:
+                self._waiting -= 1
+        try:
+            if tier is not None:
+                yield tier, 0
+                return
+            levels = self.grid_levels if point_grid else self.box_levels
+            level = self.choose(levels, time.time() - start, self._waiting)
+            run_start = time.time()
+            yield level
+            self.record(level, time.time() - run_start)
+        finally:
+            self._model_lock.release()
+
+controller = TierController(ENABLED_TIERS, LATENCY_SLO_S)
+
+def _features_path(image_id: str, tier: str) -> str:
+    # Features depend on the model and the input resolution
+    suffix = f"_{IMAGE_SIZE}" if IMAGE_SIZE else ""
+    return os.path.join(FEATURES_DIR, f"{image_id}_{tier}{suffix}.pt")
+
+def _cached_features_tier(image_id: str) -> Optional[str]:
+    """The best enabled tier with cached features for image_id, if any."""
+    return next((tier for tier in ENABLED_TIERS if os.path.exists(_features_path(image_id, tier))), None)
+
+def _save_features(predictor, image_id: str, tier: str) -> None:
+    """Save the features of the image set on predictor for later refinements."""
+    os.makedirs(FEATURES_DIR, exist_ok=True)
+    path = _features_path(image_id, tier)
+    # Write to a temporary file first, so that a crash never leaves a truncated features file
+    fd, tmp_path = tempfile.mkstemp(dir=FEATURES_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        predictor.save_features(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise
+    with _pending_lock:
+        _pending_images.pop(image_id, None)
+    _evict_features(keep_path=path)
+
+def _evict_features(keep_path: Optional[str] = None) -> None:
+    """Delete the cached features that expired or exceed the disk budget, least recently used first."""
+    now = time.time()
+    files = []  # (last use time, size, path, is a temporary file)
+    with os.scandir(FEATURES_DIR) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path, entry.name.endswith(".tmp")))
+    files.sort()
+    total_bytes = sum(size for _, size, _, _ in files)
+    for last_use, size, path, is_tmp in files:
+        if path == keep_path:
+            continue
+        if is_tmp:
+            # (a recent one is being written by another request)
+            evict = now - last_use > STALE_FEATURES_TMP_S
+        else:
+            expired = FEATURES_TTL_S > 0 and now - last_use > FEATURES_TTL_S
+            over_budget = FEATURES_MAX_MB > 0 and total_bytes > FEATURES_MAX_MB * 1024 ** 2
+            evict = expired or over_budget
+        if evict:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
 
-def _process_boxes_with_sam(image_np: np.ndarray, boxes: List[List[float]]) -> List[Dict]:
+def _touch_features(image_id: str, tier: str) -> bool:
+    """Mark the cached features of image_id as used, returns whether they are (still) cached."""
+    try:
+        os.utime(_features_path(image_id, tier))
+        return True
+    except FileNotFoundError:
+        return False
+
+def _load_features(predictor, image_id: str, tier: str) -> bool:
+    """Set the cached features of image_id on predictor, returns False if they are not cached."""
+    if not _touch_features(image_id, tier):
+        return False
+    try:
+        predictor.load_features(_features_path(image_id, tier))
+    except FileNotFoundError:
+        return False  # evicted in the meantime
+    return True
+
+def register_image(image: Image.Image) -> str:
+    """
+    Register an image for refine_pil.
+    
+    Args:
+        image: Input PIL Image
+    
+    Returns:
+        The image id (SHA-1 of the pixels). The image features are computed by
+        the first refinement, unless they are already cached (e.g. by box mode)
+    """
+    image_np = np.array(image.convert("RGB"))
+    image_id = hashlib.sha1(str(image_np.shape).encode() + image_np.tobytes()).hexdigest()
+    if _cached_features_tier(image_id) is None:
+        with _pending_lock:
+            _pending_images[image_id] = image_np
+            _pending_images.move_to_end(image_id)
+            while len(_pending_images) > MAX_PENDING_IMAGES:
+                _pending_images.popitem(last=False)
+    return image_id
+
+def _process_boxes_with_sam(
+    image_np: np.ndarray, boxes: List[List[float]], tier: str, image_id: Optional[str] = None
+) -> List[Dict]:
     """Process image with SAM2 using the provided bounding boxes."""
     from sam2.sam2_image_predictor import SAM2ImagePredictor
-    from sam2.build_sam import build_sam2
-    
-    print(f"🔍 [Box Mode] Loading SAM2 model from: {CONFIG_FILE}")
-    print(f"[Box Mode] Checkpoint path: {CHECKPOINT_FILE}")
     
-    # Use the global model if available, otherwise create a new one
-    if _model is not None:
-        predictor = SAM2ImagePredictor(_model)
-    else:
-        # This should not happen as _ensure_model() is called first
-        device = _get_device()
-        sam_model = build_sam2(config_file=CONFIG_FILE, ckpt_path=CHECKPOINT_FILE, device=device)
-        predictor = SAM2ImagePredictor(sam_model)
+    print(f"🔍 [Box Mode] Using SAM2 {tier} model")
+    predictor = SAM2ImagePredictor(_models[tier])
     
     predictor.set_image(image_np)
+    if image_id is not None and not _touch_features(image_id, tier):
+        # The features are already computed, keep them for refinements
+        _save_features(predictor, image_id, tier)
     
     all_masks = []
     for box in boxes:
@@ -143,7 +422,8 @@ def _process_boxes_with_sam(image_np: np.ndarray, boxes: List[List[float]]) -> L
         masks, scores, _ = predictor.predict(
             box=np.array(box_xyxy),
             multimask_output=False,
-            return_logits=False
+            return_logits=False,
+            output_mode="bbox_crop",
         )
         
         if len(masks) > 0:
@@ -155,36 +435,57 @@ def _process_boxes_with_sam(image_np: np.ndarray, boxes: List[List[float]]) -> L
     print(f"Generated {len(all_masks)} masks from {len(boxes)} boxes")
     return all_masks
 
-def segment_pil(image: Image.Image, boxes: Optional[List[List[float]]] = None) -> List[Dict]:
+def segment_pil(
+    image: Image.Image,
+    boxes: Optional[List[List[float]]] = None,
+    mask_format: str = "full",
+    image_id: Optional[str] = None,
+) -> List[Dict]:
     """
     Segment an image using SAM2.
     
     Args:
         image: Input PIL Image
         boxes: Optional list of bounding boxes in format [x, y, w, h] or [x1, y1, x2, y2]
+        mask_format: "full" returns each mask at image size, "bbox_crop" only
+            returns the part of the mask within its bounding box (x, y, width, height)
+        image_id: Optional id from register_image, to cache the image features
+            for refine_pil when they are computed anyway (box mode)
     
     Returns:
-        List of segmentation results, each containing id, bbox, score, and mask
+        List of segmentation results, each containing id, bbox, score, mask, and
+        the model_tier and points_per_side chosen by the controller
     """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask_format {mask_format}, expected one of {MASK_FORMATS}")
     _ensure_model()
     image_np = np.array(image.convert("RGB"))
     
-    try:
-        if boxes and len(boxes) > 0:
-            masks = _process_boxes_with_sam(image_np, boxes)
-        else:
-            # Fall back to automatic mask generation if no boxes provided
-            masks = _mask_gen.generate(image_np)
-            print(f"Generated {len(masks)} masks with automatic segmentation")
-    except Exception as e:
-        print(f"❌ Error generating masks: {e}")
-        raise
+    use_boxes = bool(boxes) and len(boxes) > 0
+    with controller.run(point_grid=not use_boxes) as (tier, points_per_side):
+        print(f"ℹ️ Segmenting with {tier} model, points_per_side={points_per_side} (queue depth {controller.queue_depth})")
+        try:
+            if use_boxes:
+                masks = _process_boxes_with_sam(image_np, boxes, tier, image_id=image_id)
+                points_per_side = None  # no point grid in box mode
+            else:
+                # Fall back to automatic mask generation if no boxes provided
+                masks = _get_mask_gen(tier, points_per_side).generate(image_np)
+                print(f"Generated {len(masks)} masks with automatic segmentation")
+        except Exception as e:
+            print(f"❌ Error generating masks: {e}")
+            raise
     
     results: List[Dict] = []
     for idx, m in enumerate(masks):
-        bbox = _mask_to_bbox(m["segmentation"])
+        segmentation = m["segmentation"]
+        bbox = _bbox_crop_to_bbox(segmentation)
         if bbox["width"] < 10 or bbox["height"] < 10:
             continue
+        if mask_format == "bbox_crop":
+            mask = segmentation["mask"]
+        else:
+            mask = bbox_crop_to_mask(segmentation)
         results.append({
             "id": str(idx),
             "x": bbox["x"],
@@ -192,8 +493,89 @@ def segment_pil(image: Image.Image, boxes: Optional[List[List[float]]] = None) -
             "width": bbox["width"],
             "height": bbox["height"],
             "score": float(m.get("stability_score", 0.0)),
-            "mask": m["segmentation"].astype(int).tolist(),  # Include actual mask array
+            "mask": mask.astype(int).tolist(),  # Include actual mask array
+            "model_tier": tier,
+            "points_per_side": points_per_side,
         })
     
     print(f"Returning {len(results)} valid masks")
-    return results 
\ No newline at end of file
+    return results 
+
+def _set_refine_image(image_id: str, tier: str):
+    """Set the image features of image_id on the refinement predictor of tier."""
+    global _refine_image
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+    if tier not in _refine_predictors:
+        _refine_predictors[tier] = SAM2ImagePredictor(_models[tier])
+    predictor = _refine_predictors[tier]
+    if _refine_image == (tier, image_id):
+        return predictor
+    
+    _refine_image = None
+    if not _load_features(predictor, image_id, tier):
+        if image_id not in _pending_images:
+            raise KeyError(f"Unknown image_id {image_id}, the image must be segmented first")
+        print(f"🔍 [Refine] Computing features for image {image_id} with {tier} model")
+        with _pending_lock:
+            image_np = _pending_images[image_id]
+        predictor.set_image(image_np)
+        _save_features(predictor, image_id, tier)
+    _refine_image = (tier, image_id)
+    return predictor
+
+def refine_pil(
+    image_id: str,
+    point_coords: List[List[float]],
+    point_labels: List[int],
+    low_res_logits: Optional[np.ndarray] = None,
+    mask_format: str = "full",
+) -> Dict:
+    """
+    Refine a mask of a registered image with clicks, only running the prompt
+    encoder and mask decoder on the cached image features.
+    
+    Args:
+        image_id: Image id returned by register_image
+        point_coords: List of [x, y] clicks in image pixels
+        point_labels: 1 for a positive click, 0 for a negative click
+        low_res_logits: Optional low-res logits returned by the previous
+            refinement of the same mask
+        mask_format: "full" or "bbox_crop", as in segment_pil
+    
+    Returns:
+        Refinement result containing image_id, bbox, score, mask and the
+        low_res_logits to pass to the next refinement
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask_format {mask_format}, expected one of {MASK_FORMATS}")
+    _ensure_model()
+    # Refine with the model whose features are cached, else the best one
+    tier = _cached_features_tier(image_id) or ENABLED_TIERS[0]
+    
+    mask_input = None if low_res_logits is None else np.asarray(low_res_logits, dtype=np.float32)[None]
+    # A single click is ambiguous, let SAM2 propose several masks and keep the best one
+    multimask_output = len(point_coords) == 1 and mask_input is None
+    with controller.run(tier=tier):
+        predictor = _set_refine_image(image_id, tier)
+        masks, scores, logits = predictor.predict(
+            point_coords=np.asarray(point_coords, dtype=np.float32),
+            point_labels=np.asarray(point_labels, dtype=np.int32),
+            mask_input=mask_input,
+            multimask_output=multimask_output,
+            output_mode="bbox_crop",
+        )
+    best = int(np.argmax(scores))
+    segmentation = masks[best]
+    if mask_format == "bbox_crop":
+        mask = segmentation["mask"]
+    else:
+        mask = bbox_crop_to_mask(segmentation)
+    return {
+        "image_id": image_id,
+        **_bbox_crop_to_bbox(segmentation),
+        "score": float(scores[best]),
+        "mask": mask.astype(int).tolist(),
+        "low_res_logits": logits[best],
+        "model_tier": tier,
+    }
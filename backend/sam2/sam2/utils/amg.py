@@ -151,6 +151,104 @@ def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     return mask.transpose()  # Put in C order
 
 
+def rle_to_mask_crop(rle: Dict[str, Any]) -> Tuple[np.ndarray, List[int]]:
+    """
+    Compute a binary mask from an uncompressed RLE, cropped to the tight box
+    around its foreground. Only the columns spanned by the foreground are
+    decoded. Returns the cropped mask and its box in XYXY format (with
+    exclusive end), or an empty mask and [0, 0, 0, 0] for an empty RLE.
+    """
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    fg_starts, fg_ends = starts[1::2], ends[1::2]
+    nonempty = fg_ends > fg_starts
+    fg_starts, fg_ends = fg_starts[nonempty], fg_ends[nonempty]
+    if len(fg_starts) == 0:
+        return np.zeros((0, 0), dtype=bool), [0, 0, 0, 0]
+
+    # Decode the (fortran ordered) columns spanned by the foreground
+    x0 = int(fg_starts[0]) // h
+    x1 = (int(fg_ends[-1]) - 1) // h + 1
+    offset = x0 * h
+    delta = np.zeros((x1 - x0) * h + 1, dtype=np.int32)
+    np.add.at(delta, fg_starts - offset, 1)
+    np.add.at(delta, fg_ends - offset, -1)
+    cols = (np.cumsum(delta[:-1]) > 0).reshape(x1 - x0, h).transpose()
+
+    rows = np.flatnonzero(cols.any(axis=1))
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    return cols[y0:y1], [x0, y0, x1, y1]
+
+
+def rle_to_bbox_crop(rle: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compute a bbox-cropped mask from an uncompressed RLE. The binary mask is
+    only kept within its tight bounding box, whose top left corner in the
+    image is given in XY format by 'offset'.
+    """
+    mask, (x0, y0, _, _) = rle_to_mask_crop(rle)
+    return {"size": list(rle["size"]), "offset": [x0, y0], "mask": mask}
+
+
+def batched_mask_to_bbox_crops(masks: torch.Tensor) -> List[Any]:
+    """
+    Crops binary masks of shape C1xC2x...xHxW to their tight bounding boxes,
+    only transferring the cropped masks to the CPU. Returns nested lists of
+    shape C1xC2x... of bbox-cropped masks, in the format of rle_to_bbox_crop.
+    """
+    if masks.dim() > 3:
+        return [batched_mask_to_bbox_crops(m) for m in masks]
+    h, w = masks.shape[-2:]
+    boxes = batched_mask_to_box(masks).tolist()
+    nonempty = masks.flatten(1).any(dim=1).tolist()
+    crops = []
+    for mask, (x0, y0, x1, y1), is_nonempty in zip(masks, boxes, nonempty):
+        if is_nonempty:
+            mask_crop = mask[y0 : y1 + 1, x0 : x1 + 1].detach().cpu().numpy()
+        else:
+            mask_crop = np.zeros((0, 0), dtype=bool)
+        crops.append({"size": [h, w], "offset": [x0, y0], "mask": mask_crop})
+    return crops
+
+
+def bbox_crop_to_mask(bbox_crop: Dict[str, Any]) -> np.ndarray:
+    """Compute a full size binary mask from a bbox-cropped mask."""
+    h, w = bbox_crop["size"]
+    x0, y0 = bbox_crop["offset"]
+    crop_h, crop_w = bbox_crop["mask"].shape
+    mask = np.zeros((h, w), dtype=bool)
+    mask[y0 : y0 + crop_h, x0 : x0 + crop_w] = bbox_crop["mask"]
+    return mask
+
+
+def mask_crop_to_rle(
+    mask_crop: np.ndarray, crop_box: List[int], orig_h: int, orig_w: int
+) -> Dict[str, Any]:
+    """
+    Encodes a mask given only within crop_box (XYXY, exclusive end) of an
+    orig_h x orig_w image to an uncompressed RLE of the full image, without
+    materializing the full mask. The output matches mask_to_rle_pytorch.
+    """
+    x0, y0, x1, y1 = crop_box
+    cols = np.zeros((orig_h, x1 - x0), dtype=np.int8)
+    cols[y0:y1] = mask_crop
+    # Put in fortran order and flatten, padding with background at both ends
+    flat = np.concatenate([[0], cols.ravel(order="F"), [0]])
+    diff = np.diff(flat)
+    offset = x0 * orig_h
+    run_starts = np.flatnonzero(diff == 1) + offset
+    run_ends = np.flatnonzero(diff == -1) + offset
+    boundaries = np.concatenate(
+        [[0], np.stack([run_starts, run_ends], axis=1).ravel(), [orig_h * orig_w]]
+    )
+    counts = np.diff(boundaries).tolist()
+    if len(counts) > 1 and counts[-1] == 0:
+        counts.pop()
+    return {"size": [orig_h, orig_w], "counts": counts}
+
+
 def area_from_rle(rle: Dict[str, Any]) -> int:
     return sum(rle["counts"][1::2])
 
@@ -293,6 +391,81 @@ def remove_small_regions(
     return mask, True
 
 
+def remove_small_regions_in_crop(
+    mask_crop: np.ndarray,
+    crop_box: List[int],
+    orig_h: int,
+    orig_w: int,
+    area_thresh: float,
+) -> Tuple[np.ndarray, List[int], bool]:
+    """
+    Same as running remove_small_regions with mode="holes" and then with
+    mode="islands" on the full orig_h x orig_w mask, for a mask given only
+    within crop_box (XYXY, exclusive end) which contains all its foreground.
+    Returns the new mask within its new tight box and an indicator of if the
+    mask has been modified. Requires opencv.
+    """
+    import cv2  # type: ignore
+
+    x0, y0, x1, y1 = crop_box
+    # Pad the crop with a 1px ring of the background outside of the box (where
+    # it is inside the image). Each side of the ring stands in for the strip of
+    # the image beyond that side of the box, so it carries the strip's area.
+    pad_t, pad_b = int(y0 > 0), int(y1 < orig_h)
+    pad_l, pad_r = int(x0 > 0), int(x1 < orig_w)
+    padded = np.pad(mask_crop, ((pad_t, pad_b), (pad_l, pad_r)))
+    weights = np.zeros(padded.shape, dtype=np.float64)
+    weights[pad_t : pad_t + y1 - y0, pad_l : pad_l + x1 - x0] = 1.0
+    if pad_t:
+        weights[0, 0] = y0 * orig_w
+    if pad_b:
+        weights[-1, 0] = (orig_h - y1) * orig_w
+    if pad_l:
+        weights[pad_t, 0] = (y1 - y0) * x0
+    if pad_r:
+        weights[pad_t, -1] = (y1 - y0) * (orig_w - x1)
+
+    # Fill small holes, where hole areas are measured in the full image
+    n_labels, regions = cv2.connectedComponents((~padded).astype(np.uint8), 8)
+    sizes = np.bincount(regions.ravel(), weights=weights.ravel(), minlength=n_labels)
+    small_regions = [i for i in range(1, n_labels) if sizes[i] < area_thresh]
+    changed = len(small_regions) > 0
+    if changed:
+        ring = np.ones(padded.shape, dtype=bool)
+        ring[pad_t : pad_t + y1 - y0, pad_l : pad_l + x1 - x0] = False
+        if np.isin(regions[ring], small_regions).any():
+            # A small background region outside of the box would be filled too,
+            # so fall back to processing the full mask.
+            mask = np.zeros((orig_h, orig_w), dtype=bool)
+            mask[y0:y1, x0:x1] = mask_crop
+            mask, _ = remove_small_regions(mask, area_thresh, mode="holes")
+            mask, _ = remove_small_regions(mask, area_thresh, mode="islands")
+            ys, xs = np.nonzero(mask)
+            box = [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]
+            return mask[box[1] : box[3], box[0] : box[2]], box, True
+        padded = np.isin(regions, [0] + small_regions)
+    mask_crop = padded[pad_t : pad_t + y1 - y0, pad_l : pad_l + x1 - x0]
+
+    # Remove small islands, which all lie inside the box
+    mask_crop, changed_islands = remove_small_regions(
+        mask_crop, area_thresh, mode="islands"
+    )
+    changed = changed or changed_islands
+    if not changed:
+        return mask_crop, list(crop_box), False
+
+    # Islands may have been removed, so shrink to the new tight box
+    ys, xs = np.nonzero(mask_crop)
+    box = [
+        x0 + int(xs.min()),
+        y0 + int(ys.min()),
+        x0 + int(xs.max()) + 1,
+        y0 + int(ys.max()) + 1,
+    ]
+    mask_crop = mask_crop[box[1] - y0 : box[3] - y0, box[0] - x0 : box[2] - x0]
+    return mask_crop, box, True
+
+
 def coco_encode_rle(uncompressed_rle: Dict[str, Any]) -> Dict[str, Any]:
     from pycocotools import mask as mask_utils  # type: ignore
 
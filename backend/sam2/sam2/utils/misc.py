@@ -4,9 +4,18 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import io
 import os
+import shutil
+import tempfile
+import time
 import warnings
-from threading import Thread
+import weakref
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
 
 import numpy as np
 import torch
@@ -58,9 +67,57 @@ def get_connected_components(mask):
     - counts: A tensor of shape (N, 1, H, W) containing the area of the connected
               components for foreground pixels and 0 for background pixels.
     """
-    from sam2 import _C
+    if mask.is_cuda:
+        try:
+            from sam2 import _C
+        except ImportError:
+            # the CUDA extension is not built, fall back to the CPU implementation
+            pass
+        else:
+            return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
 
-    return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+    labels, counts = _get_connected_components_cpu(mask)
+    return labels.to(mask.device), counts.to(mask.device)
+
+
+def _get_connected_components_cpu(mask):
+    """
+    CPU implementation of `get_connected_components` with the same outputs as the
+    CUDA kernel in sam2/csrc/connected_components.cu: the label of a component is
+    1 + the (row-major) index of the top-left pixel of its first 2x2 block, i.e.
+    1 + min((y // 2 * 2) * W + x // 2 * 2) over the pixels (y, x) of the component.
+    """
+    import cv2  # type: ignore
+
+    N, C, H, W = mask.shape
+    mask_np = mask.detach().to(device="cpu", dtype=torch.uint8).numpy()
+    mask_np = mask_np.reshape(N * C, H, W)
+    # Stack all masks into a single image, separated by a background row so that no
+    # component spans two masks, and label the whole batch in a single OpenCV call
+    stacked = np.zeros((N * C, H + 1, W), dtype=np.uint8)
+    stacked[:, :H] = mask_np != 0
+    n_labels, cc, stats, _ = cv2.connectedComponentsWithStats(
+        stacked.reshape(-1, W), connectivity=8, ltype=cv2.CV_32S
+    )
+    cc = np.ascontiguousarray(cc.reshape(N * C, H + 1, W)[:, :H])
+
+    # relabel each component by the index of its first 2x2 block (as in the CUDA kernel)
+    rows = np.arange(H, dtype=np.int32) & ~1
+    cols = np.arange(W, dtype=np.int32) & ~1
+    block_index = rows[:, None] * W + cols[None, :]
+    roots = np.full(n_labels, np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(roots, cc.ravel(), np.broadcast_to(block_index, cc.shape).ravel())
+    roots += 1
+    roots[0] = 0  # background is labeled 0
+    labels = roots[cc]
+
+    areas = stats[:, cv2.CC_STAT_AREA].astype(np.int32)
+    areas[0] = 0  # background has a count of 0
+    counts = areas[cc]
+
+    labels = torch.from_numpy(labels).reshape(N, C, H, W)
+    counts = torch.from_numpy(counts).reshape(N, C, H, W)
+    return labels, counts
 
 
 def mask_to_box(masks: torch.Tensor):
@@ -104,6 +161,13 @@ def _load_img_as_tensor(img_path, image_size):
 class AsyncVideoFrameLoader:
     """
     A list of video frames to be load asynchronously without blocking session start.
+
+    The frames are loaded by a pool of `num_workers` threads (PIL decodes and resizes
+    JPEG images without holding the GIL), in the order the tracker requests them:
+    starting after the last frame read (e.g. the frame the user clicks on, from which
+    tracking starts) and wrapping around to the earlier frames. A frame read before
+    it's loaded is loaded in the reading thread (or waited for if a worker is already
+    loading it). `ready` is the readiness map of the frames.
     """
 
     def __init__(
@@ -114,6 +178,7 @@ class AsyncVideoFrameLoader:
         img_mean,
         img_std,
         compute_device,
+        num_workers=1,
     ):
         self.img_paths = img_paths
         self.image_size = image_size
@@ -122,51 +187,766 @@ class AsyncVideoFrameLoader:
         self.img_std = img_std
         # items in `self.images` will be loaded asynchronously
         self.images = [None] * len(img_paths)
-        # catch and raise any exceptions in the async loading thread
+        # whether each frame is loaded, and the frames being loaded
+        self.ready = np.zeros(len(img_paths), dtype=bool)
+        self._loading = set()
+        # the next frame for the workers to load (if not loaded yet)
+        self._next_index = 0
+        self._cond = Condition()
+        # catch and raise any exceptions in the async loading threads
         self.exception = None
         # video_height and video_width be filled when loading the first image
         self.video_height = None
         self.video_width = None
         self.compute_device = compute_device
+        self._progress = None
 
         # load the first frame to fill video_height and video_width and also
         # to cache it (since it's most likely where the user will click)
         self.__getitem__(0)
 
         # load the rest of frames asynchronously without blocking the session start
-        def _load_frames():
-            try:
-                for n in tqdm(range(len(self.images)), desc="frame loading (JPEG)"):
-                    self.__getitem__(n)
-            except Exception as e:
+        self._progress = tqdm(
+            total=len(self.images), initial=1, desc="frame loading (JPEG)"
+        )
+        self.threads = [
+            Thread(target=self._load_frames, daemon=True) for _ in range(num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _claim_next(self):
+        """The next frame for a worker to load, or None when all frames are loaded."""
+        with self._cond:
+            num_frames = len(self.images)
+            for k in range(num_frames):
+                index = (self._next_index + k) % num_frames
+                if not self.ready[index] and index not in self._loading:
+                    self._loading.add(index)
+                    self._next_index = index + 1
+                    return index
+            return None
+
+    def _load_frames(self):
+        try:
+            while self.exception is None:
+                index = self._claim_next()
+                if index is None:
+                    break
+                self._load(index)
+        except Exception as e:
+            with self._cond:
                 self.exception = e
+                self._cond.notify_all()
 
-        self.thread = Thread(target=_load_frames, daemon=True)
-        self.thread.start()
+    def _load(self, index):
+        try:
+            img, video_height, video_width = _load_img_as_tensor(
+                self.img_paths[index], self.image_size
+            )
+            # normalize by mean and std
+            img -= self.img_mean
+            img /= self.img_std
+            if not self.offload_video_to_cpu:
+                img = img.to(self.compute_device, non_blocking=True)
+        except BaseException:
+            # let the next reader of the frame load it
+            with self._cond:
+                self._loading.discard(index)
+                self._cond.notify_all()
+            raise
+        # a frame is always either loading or loaded for the readers waiting on it
+        with self._cond:
+            self.video_height = video_height
+            self.video_width = video_width
+            self.images[index] = img
+            self.ready[index] = True
+            self._loading.discard(index)
+            self._cond.notify_all()
+        if self._progress is not None:
+            self._progress.update(1)
+        return img
 
     def __getitem__(self, index):
-        if self.exception is not None:
-            raise RuntimeError("Failure in frame loading thread") from self.exception
+        with self._cond:
+            while True:
+                if self.exception is not None:
+                    raise RuntimeError(
+                        "Failure in frame loading thread"
+                    ) from self.exception
+                img = self.images[index]
+                if img is not None:
+                    return img
+                if index not in self._loading:
+                    break
+                self._cond.wait()
+            # the tracker continues from this frame, so the workers load the next ones
+            self._next_index = index + 1
+            self._loading.add(index)
+        return self._load(index)
 
-        img = self.images[index]
-        if img is not None:
-            return img
+    def __len__(self):
+        return len(self.images)
 
-        img, video_height, video_width = _load_img_as_tensor(
-            self.img_paths[index], self.image_size
-        )
-        self.video_height = video_height
-        self.video_width = video_width
+
+class StreamingVideoFrameLoader:
+    """
+    A list of the frames of a video file that are decoded on demand (seeking in the
+    video) instead of all at session start. Only a bounded window of the most recently
+    accessed frames is held, resized to image_size x image_size as uint8 (1/4 of the
+    size of the normalized float32 frames), and each frame is normalized when it's
+    read. Frames decoded behind the last accessed frame are decoded in chunks ending
+    at it, so that tracking backward costs one seek per chunk rather than per frame.
+
+    The frames are decoded with decord if it's installed, and with OpenCV otherwise
+    (which only reads video files from a path).
+    """
+
+    def __init__(
+        self,
+        video_path,
+        image_size,
+        offload_video_to_cpu,
+        img_mean,
+        img_std,
+        compute_device,
+        max_buffered_frames=64,
+        chunk_size=16,
+    ):
+        """
+        Arguments:
+          video_path (str or bytes): the video file (or its content, with decord).
+          image_size (int): the frames are resized to image_size x image_size.
+          max_buffered_frames (int): the number of decoded frames held (LRU).
+          chunk_size (int): the number of frames decoded at once behind the last
+            accessed frame.
+        """
+        assert max_buffered_frames >= chunk_size >= 1
+        self.image_size = image_size
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.compute_device = compute_device
+        device = torch.device("cpu") if offload_video_to_cpu else compute_device
+        self.img_mean = img_mean.to(device)
+        self.img_std = img_std.to(device)
+        self.max_buffered_frames = max_buffered_frames
+        self.chunk_size = chunk_size
+        # frame_idx -> uint8 frame (3, image_size, image_size) on CPU
+        self._frames = OrderedDict()
+        self._last_index = -1
+        # frames are also read by the backbone prefetch thread
+        self._lock = Lock()
+        # the frame after the last decoded one (where the decoder is)
+        self._next_decoded_index = 0
+        self.num_decoded = 0
+        self.num_seeks = 0
+        try:
+            import decord
+        except ImportError:
+            decord = None
+        if decord is not None:
+            decord.bridge.set_bridge("torch")
+            if isinstance(video_path, bytes):
+                video_path = io.BytesIO(video_path)
+            frame = decord.VideoReader(video_path).next()
+            self.video_height, self.video_width, _ = frame.shape
+            if isinstance(video_path, io.BytesIO):
+                video_path.seek(0)
+            self._reader = decord.VideoReader(
+                video_path, width=image_size, height=image_size
+            )
+            self._num_frames = len(self._reader)
+            self._cap = None
+        else:
+            import cv2
+
+            if not isinstance(video_path, str):
+                raise NotImplementedError(
+                    "Reading videos from bytes requires decord (pip install eva-decord)"
+                )
+            self._cap = cv2.VideoCapture(video_path)
+            if not self._cap.isOpened():
+                raise RuntimeError(f"failed to open video {video_path}")
+            self.video_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.video_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self._num_frames = self._count_frames(
+                int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            )
+            self._reader = None
+        if self._num_frames == 0:
+            raise RuntimeError(f"no frames found in {video_path}")
+
+        # decode the first frame, since it's most likely where the user will click
+        self.__getitem__(0)
+
+    def _count_frames(self, reported_num_frames):
+        """
+        The number of frames of the video read with OpenCV. The frame count reported
+        by OpenCV is estimated from the container (e.g. from its duration and frame
+        rate) and overcounts on some videos (variable frame rate, badly muxed), so it's
+        only trusted if its last frame can be read. Otherwise the frames are counted
+        by reading through the video.
+        """
+        import cv2
+
+        if reported_num_frames > 0:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, reported_num_frames - 1)
+            if self._cap.grab():
+                self._next_decoded_index = reported_num_frames
+                return reported_num_frames
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        num_frames = 0
+        while self._cap.grab():
+            num_frames += 1
+        self._next_decoded_index = num_frames
+        return num_frames
+
+    def _decode(self, start, end):
+        """Decode the frames start, ..., end - 1 as uint8 (3, image_size, image_size)."""
+        seek = start != self._next_decoded_index
+        self.num_seeks += int(seek)
+        self.num_decoded += end - start
+        self._next_decoded_index = end
+        if self._reader is not None:
+            frames = self._reader.get_batch(list(range(start, end)))
+            return list(frames.permute(0, 3, 1, 2))
+
+        import cv2
+
+        if seek:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        frames = []
+        for index in range(start, end):
+            ok, frame = self._cap.read()
+            if not ok:
+                raise RuntimeError(f"failed to decode frame {index} of the video")
+            frame = cv2.resize(
+                frame,
+                (self.image_size, self.image_size),
+                interpolation=cv2.INTER_LINEAR,
+            )
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frames.append(torch.from_numpy(frame).permute(2, 0, 1))
+        return frames
+
+    def _get_uint8_frame(self, index):
+        with self._lock:
+            frame = self._frames.get(index)
+            if frame is not None:
+                self._frames.move_to_end(index)
+            else:
+                if index < self._last_index:
+                    # going backward: decode the chunk of frames before this one
+                    start = max(index - self.chunk_size + 1, 0)
+                    while start in self._frames and start < index:
+                        start += 1
+                else:
+                    start = index
+                for n, decoded in enumerate(self._decode(start, index + 1)):
+                    self._frames[start + n] = decoded
+                    self._frames.move_to_end(start + n)
+                # keep `index` last, so it's evicted last
+                self._frames.move_to_end(index)
+                while len(self._frames) > self.max_buffered_frames:
+                    self._frames.popitem(last=False)
+                frame = self._frames[index]
+            self._last_index = index
+        return frame
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._num_frames:
+            raise IndexError(index)
+        img = self._get_uint8_frame(index)
+        if not self.offload_video_to_cpu:
+            img = img.to(self.compute_device, non_blocking=True)
+        img = img.float() / 255.0
         # normalize by mean and std
         img -= self.img_mean
         img /= self.img_std
-        if not self.offload_video_to_cpu:
-            img = img.to(self.compute_device, non_blocking=True)
-        self.images[index] = img
         return img
 
     def __len__(self):
-        return len(self.images)
+        return self._num_frames
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered_frames": len(self._frames),
+                "buffered_bytes": sum(f.nbytes for f in self._frames.values()),
+                "decoded_frames": self.num_decoded,
+                "seeks": self.num_seeks,
+            }
+
+
+class FrameFeatureCache:
+    """
+    A byte-bounded LRU cache of the backbone features of video frames, so that
+    revisiting a frame (e.g. scrubbing back to add clicks, or tracking backward after
+    forward) doesn't rerun the image encoder.
+
+    The FPN features of each frame can be stored on another device (e.g. CPU memory)
+    and in another dtype (e.g. float16) than they are computed in; they are moved
+    back to the compute device and dtype on a cache hit. The position encodings
+    only depend on the feature sizes, so a single copy is kept for all frames.
+    """
+
+    def __init__(self, max_bytes, compute_device, storage_device=None, dtype=None):
+        """
+        Arguments:
+          max_bytes (int): the budget of the cached FPN features (the most recently
+            used frame is always kept, even if it's larger than the budget).
+          compute_device (torch.device): the device the features are returned on.
+          storage_device (torch.device or None): the device the features are cached
+            on (None to keep them on the compute device).
+          dtype (torch.dtype or None): the dtype the features are cached in (None to
+            keep their original dtype).
+        """
+        self.max_bytes = max_bytes
+        self.compute_device = compute_device
+        self.storage_device = storage_device
+        self.dtype = dtype
+        # frame_idx -> list of (stored feature, original dtype), in LRU order
+        self._entries = OrderedDict()
+        self._vision_pos_enc = None
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return sum(feat.numel() * feat.element_size() for feat, _ in entry)
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def vision_pos_enc(self):
+        """The position encodings of the features (the same for all frames)."""
+        return list(self._vision_pos_enc)
+
+    def get(self, frame_idx):
+        """Get the backbone output of a frame (or None if not cached)."""
+        entry = self._entries.get(frame_idx)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(frame_idx)
+        backbone_fpn = [
+            feat.to(self.compute_device, dtype, non_blocking=True)
+            for feat, dtype in entry
+        ]
+        return {
+            "backbone_fpn": backbone_fpn,
+            "vision_pos_enc": list(self._vision_pos_enc),
+        }
+
+    def put(self, frame_idx, backbone_out):
+        """Cache the backbone output of a frame, evicting the least recently used ones."""
+        if self._vision_pos_enc is None:
+            self._vision_pos_enc = list(backbone_out["vision_pos_enc"])
+        entry = [
+            (
+                feat.to(self.storage_device or feat.device, self.dtype or feat.dtype),
+                feat.dtype,
+            )
+            for feat in backbone_out["backbone_fpn"]
+        ]
+        old_entry = self._entries.pop(frame_idx, None)
+        if old_entry is not None:
+            self.num_bytes -= self._entry_bytes(old_entry)
+        self._entries[frame_idx] = entry
+        self.num_bytes += self._entry_bytes(entry)
+        while self.num_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.num_bytes -= self._entry_bytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.num_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "frames": len(self._entries),
+            "bytes": self.num_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class FramePrefetcher:
+    """
+    Computes the features of upcoming frames (in the order they will be requested)
+    on a background thread, while the caller works on the current frame. At most
+    `max_frames` computed frames (and `max_bytes` of their tensors) wait to be taken,
+    so the worker runs at most that many frames ahead of the caller.
+    """
+
+    def __init__(self, frame_order, compute_fn, max_frames, max_bytes, skip_fn=None):
+        """
+        Arguments:
+          frame_order (list): the frame indices, in the order they will be requested.
+          compute_fn (callable): computes the features of a frame index (a dict or
+            list of tensors), called on the worker thread.
+          max_frames (int): how many computed frames can wait to be taken.
+          max_bytes (int): the budget of the computed frames waiting to be taken
+            (the worker always computes at least one frame ahead).
+          skip_fn (callable or None): frames for which skip_fn(frame_idx) is True at
+            the time they're reached are not computed (e.g. already cached frames).
+        """
+        self.frame_order = list(frame_order)
+        self._positions = {frame_idx: i for i, frame_idx in enumerate(self.frame_order)}
+        self.compute_fn = compute_fn
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.skip_fn = skip_fn
+        self._ready = {}  # frame_idx -> (features, their size in bytes)
+        self._ready_bytes = 0
+        self._next = 0  # position in frame_order of the next frame to compute
+        self._computing = None  # frame index being computed
+        self._stopped = False
+        self.exception = None
+        self._cond = Condition()
+        # (start, end) times of the computed frames and of the caller's work between
+        # taking two frames, to measure how much the two overlap
+        self._compute_intervals = []
+        self._work_intervals = []
+        self._last_take_time = None
+        self.wait_s = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _num_bytes(features):
+        tensors = []
+        for v in features.values() if isinstance(features, dict) else features:
+            tensors.extend(v if isinstance(v, (list, tuple)) else [v])
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    # wait for room in the queue
+                    while not self._stopped and (
+                        len(self._ready) >= self.max_frames
+                        or (self._ready and self._ready_bytes >= self.max_bytes)
+                    ):
+                        self._cond.wait()
+                    if self._stopped or self._next >= len(self.frame_order):
+                        return
+                    frame_idx = self.frame_order[self._next]
+                    self._next += 1
+                    if self.skip_fn is not None and self.skip_fn(frame_idx):
+                        continue
+                    self._computing = frame_idx
+                start = time.perf_counter()
+                features = self.compute_fn(frame_idx)
+                end = time.perf_counter()
+                with self._cond:
+                    self._compute_intervals.append((start, end))
+                    self._computing = None
+                    if not self._stopped:
+                        num_bytes = self._num_bytes(features)
+                        self._ready[frame_idx] = (features, num_bytes)
+                        self._ready_bytes += num_bytes
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.exception = e
+                self._computing = None
+                self._cond.notify_all()
+
+    def take(self, frame_idx):
+        """
+        Take the prefetched features of a frame, waiting for them if the frame is
+        being computed or queued; returns None if the frame won't be prefetched.
+        """
+        start = time.perf_counter()
+        with self._cond:
+            if self._last_take_time is not None:
+                self._work_intervals.append((self._last_take_time, start))
+            while (
+                frame_idx not in self._ready
+                and self.exception is None
+                and (
+                    self._computing == frame_idx
+                    or self._positions.get(frame_idx, -1) >= self._next
+                )
+            ):
+                self._cond.wait()
+            if self.exception is not None:
+                raise RuntimeError("Failure in prefetch thread") from self.exception
+            item = self._ready.pop(frame_idx, None)
+            # drop any frames that were skipped by the caller, to free their room
+            position = self._positions.get(frame_idx, -1)
+            for skipped_idx in [
+                t for t in self._ready if self._positions[t] < position
+            ]:
+                self._ready_bytes -= self._ready.pop(skipped_idx)[1]
+            if item is not None:
+                self._ready_bytes -= item[1]
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._cond.notify_all()
+            end = time.perf_counter()
+            self.wait_s += end - start
+            self._last_take_time = end
+        return item[0] if item is not None else None
+
+    def stop(self):
+        """Stop the worker thread (after the frame it's computing) and drop the queue."""
+        with self._cond:
+            self._stopped = True
+            self._ready.clear()
+            self._ready_bytes = 0
+            self._cond.notify_all()
+        self.thread.join()
+
+    def stats(self):
+        """
+        The time spent computing frames on the worker, and how much of it overlapped
+        with the caller's work between taking two frames (rather than the caller
+        waiting for the frame).
+        """
+        with self._cond:
+            compute_intervals = list(self._compute_intervals)
+            work_intervals = list(self._work_intervals)
+        compute_s = sum(end - start for start, end in compute_intervals)
+        overlap_s, i = 0.0, 0
+        # both lists of intervals are sorted and non-overlapping
+        for start, end in compute_intervals:
+            while i < len(work_intervals) and work_intervals[i][1] <= start:
+                i += 1
+            j = i
+            while j < len(work_intervals) and work_intervals[j][0] < end:
+                overlap_s += min(end, work_intervals[j][1]) - max(
+                    start, work_intervals[j][0]
+                )
+                j += 1
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "compute_s": compute_s,
+            "work_s": sum(end - start for start, end in work_intervals),
+            "wait_s": self.wait_s,
+            "overlap_s": overlap_s,
+            "overlap_fraction": overlap_s / compute_s if compute_s > 0 else 0.0,
+        }
+
+
+class SpillingFrameOutputs(MutableMapping):
+    """
+    A {frame_idx: frame output} dict that only holds the outputs within `window`
+    frames of the most recently accessed frame in memory (i.e. those that memory
+    attention can still attend to when tracking it) and spills the large tensors of
+    the other outputs, losslessly compressed, to CPU memory or to files. Spilled
+    outputs are transparently recalled when read (e.g. when tracking backward over
+    frames tracked forward, or adding clicks on a tracked frame), so that the memory
+    held by a session stays flat on long videos.
+    """
+
+    # the per-frame tensors that are spilled (the others are small or shared)
+    SPILLED_KEYS = ("maskmem_features", "pred_masks")
+
+    def __init__(self, window, spill_dir=None, compression_level=1):
+        """
+        Arguments:
+          window (int): outputs more than `window` frames away from the most recently
+            accessed frame are spilled.
+          spill_dir (str or None): a directory to spill the outputs to as files (a
+            private subdirectory is created in it and removed with this dict); if None,
+            they are kept compressed in CPU memory.
+          compression_level (int): the zlib compression level.
+        """
+        self.window = window
+        self.compression_level = compression_level
+        self._outputs = {}  # frame_idx -> output, with its tensors in memory
+        # frame_idx -> (output without the spilled tensors, {key: spilled tensor info})
+        self._spilled = {}
+        self._anchor = None
+        self.spilled_bytes = 0
+        self.num_spills = 0
+        self.num_recalls = 0
+        self.spill_dir = None
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix="frame_outputs_", dir=spill_dir)
+            weakref.finalize(self, shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def __len__(self):
+        return len(self._outputs) + len(self._spilled)
+
+    def __iter__(self):
+        return iter(list(self._outputs) + list(self._spilled))
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._outputs or frame_idx in self._spilled
+
+    def __getitem__(self, frame_idx):
+        out = self._outputs.get(frame_idx)
+        if out is None:
+            if frame_idx not in self._spilled:
+                raise KeyError(frame_idx)
+            out = self._recall(frame_idx)
+        self._move_window(frame_idx)
+        return out
+
+    def __setitem__(self, frame_idx, out):
+        self._drop_spilled(frame_idx)
+        self._outputs[frame_idx] = out
+        self._move_window(frame_idx)
+
+    def __delitem__(self, frame_idx):
+        if frame_idx in self._outputs:
+            del self._outputs[frame_idx]
+        elif frame_idx in self._spilled:
+            self._drop_spilled(frame_idx)
+        else:
+            raise KeyError(frame_idx)
+
+    def pop(self, frame_idx, *default):
+        # (unlike reading an output, removing it doesn't move the window)
+        if frame_idx in self._spilled:
+            self._recall(frame_idx)
+        if frame_idx in self._outputs:
+            return self._outputs.pop(frame_idx)
+        if default:
+            return default[0]
+        raise KeyError(frame_idx)
+
+    def clear(self):
+        self._outputs.clear()
+        for frame_idx in list(self._spilled):
+            self._drop_spilled(frame_idx)
+
+    def _move_window(self, frame_idx):
+        if self._anchor == frame_idx:
+            return
+        self._anchor = frame_idx
+        for t in [t for t in self._outputs if abs(t - frame_idx) > self.window]:
+            self._spill(t)
+
+    def _spill(self, frame_idx):
+        out = self._outputs.pop(frame_idx)
+        skeleton, spilled = dict(out), {}
+        for key in self.SPILLED_KEYS:
+            tensor = skeleton.pop(key, None)
+            if tensor is None:
+                continue
+            data = tensor.detach().cpu().contiguous().view(torch.uint8).numpy()
+            data = zlib.compress(data.tobytes(), self.compression_level)
+            data = self._store(frame_idx, key, data)
+            spilled[key] = (data, tensor.dtype, tensor.shape, tensor.device)
+        self._spilled[frame_idx] = (skeleton, spilled)
+        self.num_spills += 1
+
+    def _store(self, frame_idx, key, data):
+        """Keep compressed data, returning what refers to it in `_spilled`."""
+        if self.spill_dir is None:
+            self.spilled_bytes += len(data)
+            return data
+        path = os.path.join(self.spill_dir, f"{frame_idx}_{key}.zlib")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def _read(self, data):
+        if self.spill_dir is None:
+            return data
+        with open(data, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def decompress(data, dtype, shape):
+        """A tensor spilled as compressed data (as returned by `export`), on CPU."""
+        data = bytearray(zlib.decompress(data))
+        return torch.frombuffer(data, dtype=torch.uint8).view(dtype).reshape(shape)
+
+    def export(self):
+        """
+        All the outputs as {frame_idx: (output, spilled)}, without recalling the spilled
+        ones (e.g. to save them): for those, `output` lacks the spilled tensors, which
+        are in `spilled` as {key: (compressed data, dtype, shape)} (see `decompress`);
+        for the others, `spilled` is empty.
+        """
+        exported = {frame_idx: (out, {}) for frame_idx, out in self._outputs.items()}
+        for frame_idx, (skeleton, spilled) in self._spilled.items():
+            exported[frame_idx] = (
+                skeleton,
+                {
+                    key: (self._read(data), dtype, shape)
+                    for key, (data, dtype, shape, _) in spilled.items()
+                },
+            )
+        return exported
+
+    def add_spilled(self, frame_idx, out, spilled, device):
+        """
+        Add an output exported spilled by `export` as is, to be recalled to `device`
+        when read.
+        """
+        self._drop_spilled(frame_idx)
+        self._outputs.pop(frame_idx, None)
+        self._spilled[frame_idx] = (
+            out,
+            {
+                key: (self._store(frame_idx, key, data), dtype, shape, device)
+                for key, (data, dtype, shape) in spilled.items()
+            },
+        )
+
+    def _recall(self, frame_idx):
+        skeleton, spilled = self._spilled.pop(frame_idx)
+        out = dict(skeleton)
+        for key, (data, dtype, shape, device) in spilled.items():
+            if self.spill_dir is not None:
+                path = data
+                data = self._read(path)
+                os.remove(path)
+            else:
+                self.spilled_bytes -= len(data)
+            out[key] = self.decompress(data, dtype, shape).to(device)
+        self._outputs[frame_idx] = out
+        self.num_recalls += 1
+        return out
+
+    def _drop_spilled(self, frame_idx):
+        item = self._spilled.pop(frame_idx, None)
+        if item is None:
+            return
+        for data, _, _, _ in item[1].values():
+            if self.spill_dir is not None:
+                os.remove(data)
+            else:
+                self.spilled_bytes -= len(data)
+
+    def stats(self):
+        in_memory_bytes = sum(
+            out[key].numel() * out[key].element_size()
+            for out in self._outputs.values()
+            for key in self.SPILLED_KEYS
+            if out.get(key) is not None
+        )
+        return {
+            "frames_in_memory": len(self._outputs),
+            "frames_spilled": len(self._spilled),
+            "in_memory_bytes": in_memory_bytes,
+            "spilled_bytes": self.spilled_bytes,
+            "spills": self.num_spills,
+            "recalls": self.num_recalls,
+        }
 
 
 def load_video_frames(
@@ -177,10 +957,14 @@ def load_video_frames(
     img_std=(0.229, 0.224, 0.225),
     async_loading_frames=False,
     compute_device=torch.device("cuda"),
+    num_loading_workers=None,
 ):
     """
     Load the video frames from video_path. The frames are resized to image_size as in
     the model and are loaded to GPU if offload_video_to_cpu=False. This is used by the demo.
+
+    With `async_loading_frames`, JPEG frames are loaded in a background thread and the
+    frames of a video file are decoded on demand (see `StreamingVideoFrameLoader`).
     """
     is_bytes = isinstance(video_path, bytes)
     is_str = isinstance(video_path, str)
@@ -192,6 +976,7 @@ def load_video_frames(
             offload_video_to_cpu=offload_video_to_cpu,
             img_mean=img_mean,
             img_std=img_std,
+            async_loading_frames=async_loading_frames,
             compute_device=compute_device,
         )
     elif is_str and os.path.isdir(video_path):
@@ -203,6 +988,7 @@ def load_video_frames(
             img_std=img_std,
             async_loading_frames=async_loading_frames,
             compute_device=compute_device,
+            num_loading_workers=num_loading_workers,
         )
     else:
         raise NotImplementedError(
@@ -218,6 +1004,7 @@ def load_video_frames_from_jpg_images(
     img_std=(0.229, 0.224, 0.225),
     async_loading_frames=False,
     compute_device=torch.device("cuda"),
+    num_loading_workers=None,
 ):
     """
     Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
@@ -226,6 +1013,9 @@ def load_video_frames_from_jpg_images(
     `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
 
     You can load a frame asynchronously by setting `async_loading_frames` to `True`.
+
+    The frames are decoded by `num_loading_workers` threads (by default, one per CPU
+    core, up to 8).
     """
     if isinstance(video_path, str) and os.path.isdir(video_path):
         jpg_folder = video_path
@@ -252,6 +1042,8 @@ def load_video_frames_from_jpg_images(
     img_paths = [os.path.join(jpg_folder, frame_name) for frame_name in frame_names]
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
     img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
+    if num_loading_workers is None:
+        num_loading_workers = min(os.cpu_count() or 1, 8)
 
     if async_loading_frames:
         lazy_images = AsyncVideoFrameLoader(
@@ -261,12 +1053,17 @@ def load_video_frames_from_jpg_images(
             img_mean,
             img_std,
             compute_device,
+            num_workers=num_loading_workers,
         )
         return lazy_images, lazy_images.video_height, lazy_images.video_width
 
     images = torch.zeros(num_frames, 3, image_size, image_size, dtype=torch.float32)
-    for n, img_path in enumerate(tqdm(img_paths, desc="frame loading (JPEG)")):
-        images[n], video_height, video_width = _load_img_as_tensor(img_path, image_size)
+    with ThreadPoolExecutor(num_loading_workers) as executor:
+        loaded = executor.map(lambda p: _load_img_as_tensor(p, image_size), img_paths)
+        for n, (img, video_height, video_width) in enumerate(
+            tqdm(loaded, total=num_frames, desc="frame loading (JPEG)")
+        ):
+            images[n] = img
     if not offload_video_to_cpu:
         images = images.to(compute_device)
         img_mean = img_mean.to(compute_device)
@@ -283,13 +1080,31 @@ def load_video_frames_from_video_file(
     offload_video_to_cpu,
     img_mean=(0.485, 0.456, 0.406),
     img_std=(0.229, 0.224, 0.225),
+    async_loading_frames=False,
     compute_device=torch.device("cuda"),
 ):
-    """Load the video frames from a video file."""
-    import decord
+    """
+    Load the video frames from a video file.
 
+    With `async_loading_frames`, the frames are decoded on demand by a
+    `StreamingVideoFrameLoader` (which holds a bounded window of uint8 frames) instead
+    of all being decoded to float32 before returning.
+    """
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
     img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
+    if async_loading_frames:
+        lazy_images = StreamingVideoFrameLoader(
+            video_path,
+            image_size,
+            offload_video_to_cpu,
+            img_mean,
+            img_std,
+            compute_device,
+        )
+        return lazy_images, lazy_images.video_height, lazy_images.video_width
+
+    import decord
+
     # Get the original video height and width
     decord.bridge.set_bridge("torch")
     video_height, video_width, _ = decord.VideoReader(video_path).next().shape
@@ -324,7 +1139,8 @@ def fill_holes_in_mask_scores(mask, max_area):
         # We fill holes with a small positive mask score (0.1) to change them to foreground.
         mask = torch.where(is_hole, 0.1, mask)
     except Exception as e:
-        # Skip the post-processing step on removing small holes if the CUDA kernel fails
+        # Skip the post-processing step on removing small holes if the connected
+        # components fail (e.g. neither the CUDA extension nor OpenCV is available)
         warnings.warn(
             f"{e}\n\nSkipping the post-processing step due to the error above. You can "
             "still use SAM 2 and it's OK to ignore the error above, although some post-processing "
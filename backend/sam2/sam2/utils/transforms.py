@@ -6,9 +6,11 @@
 
 import warnings
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from PIL import Image
 from torchvision.transforms import Normalize, Resize, ToTensor
 
 
@@ -34,15 +36,49 @@ class SAM2Transforms(nn.Module):
             )
         )
 
+        self._mean = torch.tensor(self.mean).view(-1, 1, 1)
+        self._std = torch.tensor(self.std).view(-1, 1, 1)
+
     def __call__(self, x):
-        x = self.to_tensor(x)
-        return self.transforms(x)
+        return self._transform_image(x)
 
     def forward_batch(self, img_list):
-        img_batch = [self.transforms(self.to_tensor(img)) for img in img_list]
-        img_batch = torch.stack(img_batch, dim=0)
+        img_batch = torch.empty(len(img_list), 3, self.resolution, self.resolution)
+        for img, out in zip(img_list, img_batch):
+            self._transform_image(img, out=out)
         return img_batch
 
+    def _transform_image(self, x, out=None):
+        """
+        Resizes and normalizes an image into a 3xRxR float tensor (written to
+        out if given). RGB uint8 images are resized before the float conversion,
+        so that no float copy of the full resolution image is allocated.
+        """
+        resized = self._resize_uint8(x)
+        if resized is None:
+            x = self.transforms(self.to_tensor(x))
+            return x if out is None else out.copy_(x)
+
+        x = torch.from_numpy(resized).permute(2, 0, 1)
+        if out is None:
+            out = torch.empty(x.shape, dtype=torch.float32)
+        out.copy_(x)
+        return out.div_(255.0).sub_(self._mean).div_(self._std)
+
+    def _resize_uint8(self, x):
+        """
+        Antialiased bilinear resize of an RGB uint8 image (HWC np.ndarray or PIL
+        Image) to the model resolution, or None for other inputs.
+        """
+        if isinstance(x, np.ndarray):
+            if x.dtype != np.uint8 or x.ndim != 3 or x.shape[2] != 3:
+                return None
+            x = Image.fromarray(x)
+        elif not isinstance(x, Image.Image) or x.mode != "RGB":
+            return None
+        size = (self.resolution, self.resolution)
+        return np.array(x.resize(size, Image.BILINEAR))
+
     def transform_coords(
         self, coords: torch.Tensor, normalize=False, orig_hw=None
     ) -> torch.Tensor:
@@ -103,7 +139,7 @@ class SAM2Transforms(nn.Module):
                 # We fill holes with negative mask score (-10.0) to change them to background.
                 masks = torch.where(is_hole, self.mask_threshold - 10.0, masks)
         except Exception as e:
-            # Skip the post-processing step if the CUDA kernel fails
+            # Skip the post-processing step if the connected components fail
             warnings.warn(
                 f"{e}\n\nSkipping the post-processing step due to the error above. You can "
                 "still use SAM 2 and it's OK to ignore the error above, although some post-processing "
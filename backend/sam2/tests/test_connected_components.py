@@ -0,0 +1,117 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import deque
+
+import numpy as np
+import pytest
+import torch
+from sam2.utils.misc import _get_connected_components_cpu, get_connected_components
+
+
+def reference_connected_components(mask):
+    """
+    The outputs of the CUDA kernel in sam2/csrc/connected_components.cu on a (H, W)
+    binary mask: 8-connected components labeled with 1 + the smallest index of the
+    top-left pixel of their 2x2 blocks, and the area of each pixel's component.
+    """
+    H, W = mask.shape
+    labels = np.zeros((H, W), dtype=np.int32)
+    counts = np.zeros((H, W), dtype=np.int32)
+    visited = np.zeros((H, W), dtype=bool)
+    for y0 in range(H):
+        for x0 in range(W):
+            if not mask[y0, x0] or visited[y0, x0]:
+                continue
+            component, queue = [], deque([(y0, x0)])
+            visited[y0, x0] = True
+            while queue:
+                y, x = queue.popleft()
+                component.append((y, x))
+                for dy in (-1, 0, 1):
+                    for dx in (-1, 0, 1):
+                        ny, nx = y + dy, x + dx
+                        if 0 <= ny < H and 0 <= nx < W:
+                            if mask[ny, nx] and not visited[ny, nx]:
+                                visited[ny, nx] = True
+                                queue.append((ny, nx))
+            label = 1 + min((y // 2 * 2) * W + x // 2 * 2 for y, x in component)
+            for y, x in component:
+                labels[y, x] = label
+                counts[y, x] = len(component)
+    return labels, counts
+
+
+def test_block_min_labels():
+    mask = torch.tensor(
+        [
+            [1, 1, 0, 0],
+            [0, 0, 0, 1],
+            [0, 0, 1, 0],
+            [1, 0, 0, 0],
+        ]
+    )[None, None]
+    labels, counts = _get_connected_components_cpu(mask)
+    # the diagonal component is labeled by the block of (1, 3), i.e. 1 + (0 * 4 + 2)
+    expected_labels = [
+        [1, 1, 0, 0],
+        [0, 0, 0, 3],
+        [0, 0, 3, 0],
+        [9, 0, 0, 0],
+    ]
+    expected_counts = [
+        [2, 2, 0, 0],
+        [0, 0, 0, 2],
+        [0, 0, 2, 0],
+        [1, 0, 0, 0],
+    ]
+    assert labels.dtype == torch.int32 and counts.dtype == torch.int32
+    assert labels[0, 0].tolist() == expected_labels
+    assert counts[0, 0].tolist() == expected_counts
+
+
+def test_label_is_block_index_not_pixel_index():
+    # a single pixel at (1, 1) is in the 2x2 block starting at (0, 0)
+    mask = torch.zeros(1, 1, 3, 3, dtype=torch.bool)
+    mask[0, 0, 1, 1] = True
+    labels, counts = _get_connected_components_cpu(mask)
+    assert labels[0, 0, 1, 1].item() == 1
+    assert counts[0, 0, 1, 1].item() == 1
+    assert labels.sum().item() == 1
+
+
+def test_masks_of_a_batch_are_labeled_separately():
+    # components touching the bottom and top rows of consecutive masks stay separate
+    mask = torch.zeros(3, 1, 4, 5, dtype=torch.bool)
+    mask[0, 0, 3, :] = True
+    mask[1, 0, 0, :] = True
+    mask[2] = True
+    labels, counts = _get_connected_components_cpu(mask)
+    assert labels[0, 0, 3].tolist() == [11, 11, 11, 11, 11]
+    assert counts[0, 0, 3].tolist() == [5, 5, 5, 5, 5]
+    assert labels[1, 0, 0].tolist() == [1, 1, 1, 1, 1]
+    assert counts[1, 0, 0].tolist() == [5, 5, 5, 5, 5]
+    assert (labels[2] == 1).all() and (counts[2] == 20).all()
+
+
+@pytest.mark.parametrize("height,width", [(7, 9), (8, 8), (16, 11)])
+@pytest.mark.parametrize("density", [0.2, 0.5, 0.8])
+def test_matches_reference(height, width, density):
+    generator = torch.Generator().manual_seed(height * width)
+    mask = torch.rand(4, 1, height, width, generator=generator) < density
+    labels, counts = _get_connected_components_cpu(mask)
+    for i in range(len(mask)):
+        ref_labels, ref_counts = reference_connected_components(mask[i, 0].numpy())
+        np.testing.assert_array_equal(labels[i, 0].numpy(), ref_labels)
+        np.testing.assert_array_equal(counts[i, 0].numpy(), ref_counts)
+
+
+def test_get_connected_components_on_cpu_tensors():
+    generator = torch.Generator().manual_seed(0)
+    mask = torch.rand(2, 1, 12, 10, generator=generator) < 0.5
+    labels, counts = get_connected_components(mask.to(torch.uint8))
+    ref_labels, ref_counts = _get_connected_components_cpu(mask)
+    assert torch.equal(labels, ref_labels) and torch.equal(counts, ref_counts)
@@ -0,0 +1,111 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def propagate(predictor, video_dir, num_objects, prefetch_frames):
+    """
+    Track num_objects boxes forward then backward from the middle of the video,
+    returns the mask logits of every frame, the time spent in propagate_in_video
+    and the prefetch stats of both directions.
+    """
+    predictor.backbone_prefetch_frames = prefetch_frames
+    # no feature cache beyond the current frame, so that each frame is encoded
+    # in each direction (as on videos longer than the cache)
+    inference_state = predictor.init_state(
+        video_path=video_dir, feature_cache_max_bytes=0
+    )
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    start_frame_idx = inference_state["num_frames"] // 2
+    for obj_id in range(num_objects):
+        x0 = (obj_id + 1) * width // (num_objects + 2)
+        box = np.array([x0, height // 4, x0 + width // 4, 3 * height // 4])
+        predictor.add_new_points_or_box(
+            inference_state, frame_idx=start_frame_idx, obj_id=obj_id, box=box
+        )
+
+    masks, stats = {}, []
+    start = time.perf_counter()
+    for reverse in [False, True]:
+        for frame_idx, _, video_res_masks in predictor.propagate_in_video(
+            inference_state, start_frame_idx=start_frame_idx, reverse=reverse
+        ):
+            masks[frame_idx] = video_res_masks.cpu()
+        stats.append(inference_state.get("backbone_prefetch_stats"))
+    return masks, time.perf_counter() - start, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare propagate_in_video with and without computing the "
+        "backbone features of the next frames on a background thread "
+        "(backbone_prefetch_frames), and report how much the two stages overlap"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory of JPEG frames of the video",
+    )
+    parser.add_argument(
+        "--num_objects", type=int, default=1, help="number of objects to track"
+    )
+    parser.add_argument(
+        "--prefetch_frames",
+        type=int,
+        default=2,
+        help="number of frames to compute ahead",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    with torch.inference_mode():
+        ref_masks, ref_time, _ = propagate(
+            predictor, args.video_dir, args.num_objects, prefetch_frames=0
+        )
+        masks, prefetch_time, stats = propagate(
+            predictor, args.video_dir, args.num_objects, args.prefetch_frames
+        )
+
+    max_diff = max((masks[t] - ref_masks[t]).abs().max().item() for t in ref_masks)
+    print(f"{len(ref_masks)} frames: max mask logit difference {max_diff:.2e}")
+    print(f"no prefetch: {ref_time:.2f}s, prefetch: {prefetch_time:.2f}s")
+    print(
+        "| direction | prefetched frames | backbone (s) | tracking (s) "
+        "| waiting for the backbone (s) | overlap |"
+    )
+    print("|---|---|---|---|---|---|")
+    for direction, s in zip(["forward", "backward"], stats):
+        print(
+            f"| {direction} | {s['hits']} | {s['compute_s']:.2f} | {s['work_s']:.2f} "
+            f"| {s['wait_s']:.2f} | {s['overlap_s']:.2f}s "
+            f"({s['overlap_fraction']:.0%} of backbone time) |"
+        )
+
+
+if __name__ == "__main__":
+    main()
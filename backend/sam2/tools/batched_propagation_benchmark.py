@@ -0,0 +1,108 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def propagate(predictor, video_dir, num_objects, batch_objects):
+    """
+    Track num_objects boxes through the video, returns the mask logits of every frame
+    and the frames per second of propagate_in_video.
+    """
+    predictor.batch_objects_in_propagation = batch_objects
+    inference_state = predictor.init_state(video_path=video_dir)
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    # a grid of boxes covering the frame
+    grid = int(np.ceil(np.sqrt(num_objects)))
+    box_w, box_h = width // (grid + 1), height // (grid + 1)
+    for obj_id in range(num_objects):
+        x0 = (obj_id % grid) * width // grid
+        y0 = (obj_id // grid) * height // grid
+        box = np.array([x0, y0, x0 + box_w, y0 + box_h])
+        predictor.add_new_points_or_box(
+            inference_state, frame_idx=0, obj_id=obj_id, box=box
+        )
+
+    masks = {}
+    start = time.perf_counter()
+    for frame_idx, _, video_res_masks in predictor.propagate_in_video(inference_state):
+        masks[frame_idx] = video_res_masks.cpu()
+    fps = len(masks) / (time.perf_counter() - start)
+    return masks, fps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare propagate_in_video tracking each object separately and "
+        "tracking all objects of a frame as one batch (batch_objects_in_propagation)"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory of JPEG frames of the video",
+    )
+    parser.add_argument(
+        "--num_objects",
+        type=int,
+        nargs="+",
+        default=[1, 5, 20],
+        help="numbers of objects to track",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    rows = []
+    with torch.inference_mode():
+        for num_objects in args.num_objects:
+            ref_masks, ref_fps = propagate(
+                predictor, args.video_dir, num_objects, batch_objects=False
+            )
+            masks, fps = propagate(
+                predictor, args.video_dir, num_objects, batch_objects=True
+            )
+            max_diff = max(
+                (masks[t] - ref_masks[t]).abs().max().item() for t in ref_masks
+            )
+            mismatches = sum(
+                ((masks[t] > 0) != (ref_masks[t] > 0)).sum().item() for t in ref_masks
+            )
+            rows.append((num_objects, ref_fps, fps, max_diff, mismatches))
+
+    print(
+        "| objects | per object (fps) | batched (fps) | speedup "
+        "| max mask logit diff | mismatching pixels |"
+    )
+    print("|---|---|---|---|---|---|")
+    for num_objects, ref_fps, fps, max_diff, mismatches in rows:
+        print(
+            f"| {num_objects} | {ref_fps:.2f} | {fps:.2f} | {fps / ref_fps:.2f}x "
+            f"| {max_diff:.2e} | {mismatches} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
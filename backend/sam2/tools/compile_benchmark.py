@@ -0,0 +1,100 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+
+def time_predictor(predictor, image, box, num_runs):
+    """Best set_image and predict times (in seconds) over num_runs, and the last output."""
+    encode_times, decode_times = [], []
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        predictor.set_image(image)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        outputs = predictor.predict(box=box, multimask_output=False)
+        decode_times.append(time.perf_counter() - start)
+    return min(encode_times), min(decode_times), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare eager and compiled (SAM2ImagePredictor(compile_model=True)) "
+        "image inference: one-time compile cost and steady-state speed"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_l.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_large.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--compile_cache_path",
+        type=str,
+        default="./outputs/sam2_compile_cache.bin",
+        help="compiled artifacts file; run the script twice to measure the "
+        "compile cost of a restart with the artifacts cached",
+    )
+    parser.add_argument(
+        "--num_runs", type=int, default=3, help="timed runs of each mode"
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_sam2(args.sam2_cfg, args.sam2_checkpoint, device=device)
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8)
+    box = np.array([256, 192, 768, 576])
+
+    predictor = SAM2ImagePredictor(model)
+    predictor.set_image(image)  # warm up
+    eager_encode, eager_decode, eager_outputs = time_predictor(
+        predictor, image, box, args.num_runs
+    )
+
+    cached = os.path.exists(args.compile_cache_path)
+    start = time.perf_counter()
+    predictor = SAM2ImagePredictor(
+        model, compile_model=True, compile_cache_path=args.compile_cache_path
+    )
+    predictor.warmup()
+    compile_time = time.perf_counter() - start
+    compiled_encode, compiled_decode, compiled_outputs = time_predictor(
+        predictor, image, box, args.num_runs
+    )
+    max_diff = np.abs(eager_outputs[2] - compiled_outputs[2]).max()
+
+    print(
+        f"compile + warmup: {compile_time:.1f}s "
+        f"({'with' if cached else 'without'} cached artifacts)"
+    )
+    print(f"max low-res logit difference vs. eager: {max_diff:.2e}")
+    print("| stage | eager (ms) | compiled (ms) | speedup |")
+    print("|---|---|---|---|")
+    for stage, eager, compiled in [
+        ("set_image", eager_encode, compiled_encode),
+        ("predict (box)", eager_decode, compiled_decode),
+    ]:
+        print(
+            f"| {stage} | {1000 * eager:.0f} | {1000 * compiled:.0f} | {eager / compiled:.2f}x |"
+        )
+
+
+if __name__ == "__main__":
+    main()
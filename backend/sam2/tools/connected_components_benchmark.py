@@ -0,0 +1,130 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+from collections import deque
+
+import numpy as np
+import torch
+from sam2.utils.misc import _get_connected_components_cpu, get_connected_components
+
+
+def reference_connected_components(mask):
+    """
+    Straightforward reference of the outputs of the CUDA kernel in
+    sam2/csrc/connected_components.cu on a (H, W) binary mask: 8-connected
+    components labeled with 1 + the smallest index of the top-left pixel of their
+    2x2 blocks, and counts holding the area of each pixel's component.
+    """
+    H, W = mask.shape
+    labels = np.zeros((H, W), dtype=np.int32)
+    counts = np.zeros((H, W), dtype=np.int32)
+    visited = np.zeros((H, W), dtype=bool)
+    for y0 in range(H):
+        for x0 in range(W):
+            if not mask[y0, x0] or visited[y0, x0]:
+                continue
+            component, queue = [], deque([(y0, x0)])
+            visited[y0, x0] = True
+            while queue:
+                y, x = queue.popleft()
+                component.append((y, x))
+                for dy in (-1, 0, 1):
+                    for dx in (-1, 0, 1):
+                        ny, nx = y + dy, x + dx
+                        if 0 <= ny < H and 0 <= nx < W:
+                            if mask[ny, nx] and not visited[ny, nx]:
+                                visited[ny, nx] = True
+                                queue.append((ny, nx))
+            label = 1 + min((y // 2 * 2) * W + x // 2 * 2 for y, x in component)
+            for y, x in component:
+                labels[y, x] = label
+                counts[y, x] = len(component)
+    return labels, counts
+
+
+def random_masks(num_masks, height, width, density, seed):
+    """Random blobby binary masks of shape (N, 1, H, W) (thresholded smoothed noise)."""
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.rand(
+        num_masks, 1, height // 4 + 1, width // 4 + 1, generator=generator
+    )
+    noise = torch.nn.functional.interpolate(noise, (height, width), mode="bilinear")
+    noise += 0.2 * torch.rand(num_masks, 1, height, width, generator=generator)
+    return noise > torch.quantile(noise.flatten(1), 1 - density, dim=1).view(
+        -1, 1, 1, 1
+    )
+
+
+def check_parity(num_masks, height, width):
+    num_mismatches = 0
+    for n, density in enumerate([0.05, 0.3, 0.5, 0.7, 0.95]):
+        masks = random_masks(num_masks, height, width, density, seed=n)
+        labels, counts = _get_connected_components_cpu(masks)
+        for i in range(num_masks):
+            ref_labels, ref_counts = reference_connected_components(masks[i, 0].numpy())
+            if not (
+                np.array_equal(labels[i, 0].numpy(), ref_labels)
+                and np.array_equal(counts[i, 0].numpy(), ref_counts)
+            ):
+                num_mismatches += 1
+        if torch.cuda.is_available():
+            # also compare against the CUDA kernel itself when it's available
+            cuda_labels, cuda_counts = get_connected_components(masks.cuda())
+            num_mismatches += int(not torch.equal(cuda_labels.cpu(), labels))
+            num_mismatches += int(not torch.equal(cuda_counts.cpu(), counts))
+    return num_mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the CPU connected components used by the mask post-processing "
+        "against the CUDA kernel semantics and measure their per-mask latency"
+    )
+    parser.add_argument(
+        "--parity_size",
+        type=int,
+        default=64,
+        help="mask size of the parity check against the (slow) reference",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[256, 1024],
+        help="mask sizes to benchmark (256 is the low-res mask size of SAM 2)",
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        default=[1, 3, 32, 192],
+        help="numbers of masks per call to benchmark",
+    )
+    parser.add_argument("--num_runs", type=int, default=10, help="timed runs per case")
+    args = parser.parse_args()
+
+    num_mismatches = check_parity(8, args.parity_size, args.parity_size)
+    print(f"parity vs. CUDA kernel semantics: {num_mismatches} mismatching masks")
+
+    print("| size | masks | ms / call | ms / mask |")
+    print("|---|---|---|---|")
+    for size in args.sizes:
+        for batch_size in args.batch_sizes:
+            masks = random_masks(batch_size, size, size, density=0.5, seed=0)
+            get_connected_components(masks)  # warm up
+            start = time.perf_counter()
+            for _ in range(args.num_runs):
+                get_connected_components(masks)
+            call_ms = 1000 * (time.perf_counter() - start) / args.num_runs
+            print(
+                f"| {size} | {batch_size} | {call_ms:.2f} | {call_ms / batch_size:.3f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
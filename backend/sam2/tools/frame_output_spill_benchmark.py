@@ -0,0 +1,139 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def held_bytes(inference_state):
+    """Bytes of the non-conditioning frame outputs held in memory, and spilled to CPU."""
+    in_memory, spilled = 0, 0
+    for obj_output_dict in inference_state["output_dict_per_obj"].values():
+        outputs = obj_output_dict["non_cond_frame_outputs"]
+        if isinstance(outputs, dict):
+            in_memory += sum(
+                out[key].numel() * out[key].element_size()
+                for out in outputs.values()
+                for key in ("maskmem_features", "pred_masks")
+            )
+        else:
+            stats = outputs.stats()
+            in_memory += stats["in_memory_bytes"]
+            spilled += stats["spilled_bytes"]
+    return in_memory, spilled
+
+
+def propagate(predictor, video_dir, num_objects, start_frame_idx, spill_to):
+    """
+    Track num_objects boxes forward then backward from start_frame_idx (the backward
+    pass reads memories of the forward pass), returns the mask logits of every frame,
+    the held bytes after each frame of the forward pass and the propagation time.
+    """
+    inference_state = predictor.init_state(
+        video_path=video_dir, spill_frame_outputs_to=spill_to
+    )
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    for obj_id in range(num_objects):
+        x0 = (obj_id + 1) * width // (num_objects + 2)
+        box = np.array([x0, height // 4, x0 + width // 4, 3 * height // 4])
+        predictor.add_new_points_or_box(
+            inference_state, frame_idx=start_frame_idx, obj_id=obj_id, box=box
+        )
+
+    masks, held = {}, []
+    start = time.perf_counter()
+    for reverse in [False, True]:
+        for frame_idx, _, video_res_masks in predictor.propagate_in_video(
+            inference_state, start_frame_idx=start_frame_idx, reverse=reverse
+        ):
+            masks[frame_idx] = video_res_masks.cpu()
+            if not reverse:
+                held.append(held_bytes(inference_state))
+    total_time = time.perf_counter() - start
+    recalls = sum(
+        d["non_cond_frame_outputs"].stats()["recalls"]
+        for d in inference_state["output_dict_per_obj"].values()
+        if not isinstance(d["non_cond_frame_outputs"], dict)
+    )
+    return masks, held, total_time, recalls
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the memory held by the non-conditioning frame outputs "
+        "when keeping them all and when spilling those out of the memory window "
+        "(init_state(spill_frame_outputs_to=...)) to compressed CPU memory or files"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory of JPEG frames of the video (longer than the memory window)",
+    )
+    parser.add_argument(
+        "--num_objects", type=int, default=1, help="number of objects to track"
+    )
+    parser.add_argument(
+        "--start_frame_idx", type=int, default=4, help="frame with the input boxes"
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    results = {}
+    with torch.inference_mode(), tempfile.TemporaryDirectory() as spill_dir:
+        for mode, spill_to in [("keep all", None), ("cpu", "cpu"), ("disk", spill_dir)]:
+            results[mode] = propagate(
+                predictor,
+                args.video_dir,
+                args.num_objects,
+                args.start_frame_idx,
+                spill_to,
+            )
+
+    ref_masks = results["keep all"][0]
+    num_tracked = len(results["keep all"][1])
+    checkpoints = sorted({num_tracked // 4, num_tracked // 2, num_tracked})
+    print(
+        "| mode | "
+        + " | ".join(f"MiB in memory (+ spilled) after {n} frames" for n in checkpoints)
+        + " | propagate (s) | recalls | max mask logit diff |"
+    )
+    print("|---|" + "---|" * (len(checkpoints) + 3))
+    for mode, (masks, held, total_time, recalls) in results.items():
+        max_diff = max((masks[t] - ref_masks[t]).abs().max().item() for t in ref_masks)
+        cells = [
+            f"{held[n - 1][0] / 1024**2:.1f} (+ {held[n - 1][1] / 1024**2:.1f})"
+            for n in checkpoints
+        ]
+        print(
+            f"| {mode} | "
+            + " | ".join(cells)
+            + f" | {total_time:.1f} | {recalls} | {max_diff:.2e} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
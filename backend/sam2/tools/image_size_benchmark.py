@@ -0,0 +1,148 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+
+def load_validation_set(image_dir, mask_dir):
+    """
+    Load the (image, box, gt_mask) samples of the validation set. Each image in
+    image_dir has a PNG mask of the same name in mask_dir, where every distinct
+    nonzero value is an object; each object is prompted with its bounding box.
+    Without mask_dir, each image is prompted with a box around its center half.
+    """
+    samples = []
+    for file_name in sorted(os.listdir(image_dir)):
+        if os.path.splitext(file_name)[-1].lower() not in [".jpg", ".jpeg", ".png"]:
+            continue
+        image = np.array(Image.open(os.path.join(image_dir, file_name)).convert("RGB"))
+        h, w = image.shape[:2]
+        if mask_dir is None:
+            box = np.array([w // 4, h // 4, 3 * w // 4, 3 * h // 4])
+            samples.append((image, [(box, None)]))
+            continue
+        mask_path = os.path.join(mask_dir, os.path.splitext(file_name)[0] + ".png")
+        ann = np.array(Image.open(mask_path))
+        objects = []
+        for obj_id in np.unique(ann[ann > 0]):
+            gt_mask = ann == obj_id
+            ys, xs = np.nonzero(gt_mask)
+            box = np.array([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1])
+            objects.append((box, gt_mask))
+        samples.append((image, objects))
+    return samples
+
+
+def mask_iou(mask1, mask2):
+    union = np.logical_or(mask1, mask2).sum()
+    return np.logical_and(mask1, mask2).sum() / union if union > 0 else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare mask quality and speed of SAM 2 image inference "
+        "across input resolutions (build_sam2(..., image_size=...))"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_l.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_large.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--image_dir",
+        type=str,
+        required=True,
+        help="directory containing the validation images",
+    )
+    parser.add_argument(
+        "--mask_dir",
+        type=str,
+        default=None,
+        help="directory containing the ground-truth PNG masks of each image "
+        "(default: measure IoU against the masks predicted at the largest image size)",
+    )
+    parser.add_argument(
+        "--image_sizes",
+        type=int,
+        nargs="+",
+        default=[512, 768, 1024],
+        help="input resolutions to compare (multiples of 32)",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    samples = load_validation_set(args.image_dir, args.mask_dir)
+    num_objects = sum(len(objects) for _, objects in samples)
+    print(f"loaded {len(samples)} images with {num_objects} objects")
+
+    image_sizes = sorted(args.image_sizes, reverse=True)
+    reference_masks = None
+    rows = []
+    for image_size in image_sizes:
+        predictor = SAM2ImagePredictor(
+            build_sam2(
+                args.sam2_cfg,
+                args.sam2_checkpoint,
+                device=device,
+                image_size=image_size,
+            )
+        )
+        # warm up
+        predictor.set_image(samples[0][0])
+        encode_time, decode_time, ious, pred_masks = 0.0, 0.0, [], []
+        for image, objects in samples:
+            start = time.time()
+            predictor.set_image(image)
+            encode_time += time.time() - start
+            for box, gt_mask in objects:
+                start = time.time()
+                masks, _, _ = predictor.predict(box=box, multimask_output=False)
+                decode_time += time.time() - start
+                pred_masks.append(masks[0] > 0)
+                if gt_mask is not None:
+                    ious.append(mask_iou(masks[0] > 0, gt_mask))
+        if args.mask_dir is None:
+            if reference_masks is None:
+                reference_masks = pred_masks
+            ious = [mask_iou(m, r) for m, r in zip(pred_masks, reference_masks)]
+        rows.append(
+            (
+                image_size,
+                np.mean(ious),
+                1000 * encode_time / len(samples),
+                1000 * decode_time / num_objects,
+            )
+        )
+
+    iou_name = "mIoU (GT)" if args.mask_dir else f"mIoU (vs {image_sizes[0]})"
+    print(
+        f"| image_size | {iou_name} | set_image (ms) | predict (ms) | set_image speedup |"
+    )
+    print("|---|---|---|---|---|")
+    for image_size, miou, encode_ms, decode_ms in rows:
+        speedup = rows[0][2] / encode_ms
+        print(
+            f"| {image_size} | {miou:.3f} | {encode_ms:.0f} | {decode_ms:.0f} | {speedup:.2f}x |"
+        )
+
+
+if __name__ == "__main__":
+    main()
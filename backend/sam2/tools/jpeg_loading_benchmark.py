@@ -0,0 +1,104 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from sam2.utils.misc import load_video_frames_from_jpg_images
+
+
+def write_synthetic_frames(video_dir, num_frames, width, height):
+    """Write JPEG frames of a square moving over a noisy background."""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    size = height // 4
+    for n in range(num_frames):
+        frame = background.copy()
+        x = (n * 8) % (width - size)
+        frame[height // 3 : height // 3 + size, x : x + size] = (255, 0, 0)
+        Image.fromarray(frame).save(os.path.join(video_dir, f"{n:05d}.jpg"))
+
+
+def time_loading(video_dir, image_size, async_loading_frames, num_workers):
+    """The time to return (i.e. to the first frame) and to load all the frames."""
+    start = time.perf_counter()
+    images, _, _ = load_video_frames_from_jpg_images(
+        video_dir,
+        image_size,
+        offload_video_to_cpu=True,
+        async_loading_frames=async_loading_frames,
+        compute_device=torch.device("cpu"),
+        num_loading_workers=num_workers,
+    )
+    first_frame_time = time.perf_counter() - start
+    if async_loading_frames:
+        for thread in images.threads:
+            thread.join()
+        assert images.ready.all()
+    return first_frame_time, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time loading a directory of JPEG frames with different numbers "
+        "of decoding threads, in the foreground and asynchronously"
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        default=None,
+        help="directory of JPEG frames (synthetic frames are written if not given)",
+    )
+    parser.add_argument(
+        "--num_frames", type=int, default=200, help="number of synthetic frames"
+    )
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        default=(1280, 720),
+        help="synthetic frame width and height",
+    )
+    parser.add_argument("--image_size", type=int, default=1024)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="numbers of decoding threads to compare",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_dir = args.video_dir
+        if video_dir is None:
+            video_dir = tmp_dir
+            write_synthetic_frames(video_dir, args.num_frames, *args.resolution)
+        print(f"{len(os.listdir(video_dir))} frames, {os.cpu_count()} CPU cores")
+        print(
+            "| workers | foreground load (s) | async first frame (s) | async all frames (s) |"
+        )
+        print("|---|---|---|---|")
+        for num_workers in args.num_workers:
+            _, foreground_time = time_loading(
+                video_dir, args.image_size, False, num_workers
+            )
+            first_frame_time, all_frames_time = time_loading(
+                video_dir, args.image_size, True, num_workers
+            )
+            print(
+                f"| {num_workers} | {foreground_time:.2f} | {first_frame_time:.3f} | "
+                f"{all_frames_time:.2f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
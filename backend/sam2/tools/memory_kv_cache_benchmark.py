@@ -0,0 +1,113 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+
+def propagate(predictor, video_dir, num_objects, use_memory_kv_cache):
+    """
+    Track num_objects boxes through the video, returns the mask logits of every
+    (frame, object), the memory attention outputs and the time spent in
+    propagate_in_video and in memory attention.
+    """
+    predictor.use_memory_kv_cache = use_memory_kv_cache
+    inference_state = predictor.init_state(video_path=video_dir)
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    for obj_id in range(num_objects):
+        x0 = (obj_id + 1) * width // (num_objects + 2)
+        box = np.array([x0, height // 4, x0 + width // 4, 3 * height // 4])
+        predictor.add_new_points_or_box(
+            inference_state, frame_idx=0, obj_id=obj_id, box=box
+        )
+
+    memory_attention_time, memory_attention_outputs = [0.0], []
+    memory_attention_forward = predictor.memory_attention.forward
+
+    def timed_memory_attention(*args, **kwargs):
+        start = time.perf_counter()
+        out = memory_attention_forward(*args, **kwargs)
+        memory_attention_time[0] += time.perf_counter() - start
+        memory_attention_outputs.append(out.cpu())
+        return out
+
+    predictor.memory_attention.forward = timed_memory_attention
+    try:
+        masks = {}
+        start = time.perf_counter()
+        for frame_idx, _, video_res_masks in predictor.propagate_in_video(
+            inference_state
+        ):
+            masks[frame_idx] = video_res_masks.cpu()
+        total_time = time.perf_counter() - start
+    finally:
+        predictor.memory_attention.forward = memory_attention_forward
+    return masks, memory_attention_outputs, total_time, memory_attention_time[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the projected memory K/V cache (use_memory_kv_cache) "
+        "gives the same masks as projecting all memories on every frame, and time both"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory of JPEG frames of the video",
+    )
+    parser.add_argument(
+        "--num_objects", type=int, default=3, help="number of objects to track"
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    with torch.inference_mode():
+        ref_masks, ref_feats, ref_time, ref_attn_time = propagate(
+            predictor, args.video_dir, args.num_objects, use_memory_kv_cache=False
+        )
+        masks, feats, cached_time, cached_attn_time = propagate(
+            predictor, args.video_dir, args.num_objects, use_memory_kv_cache=True
+        )
+
+    max_feat_diff = max((f - r).abs().max().item() for f, r in zip(feats, ref_feats))
+    max_diff = max((masks[t] - ref_masks[t]).abs().max().item() for t in ref_masks)
+    mismatches = sum(
+        ((masks[t] > 0) != (ref_masks[t] > 0)).sum().item() for t in ref_masks
+    )
+    print(
+        f"{len(ref_masks)} frames x {args.num_objects} objects: max memory attention "
+        f"output difference {max_feat_diff:.2e} (max abs value "
+        f"{max(r.abs().max().item() for r in ref_feats):.2f}), max mask logit "
+        f"difference {max_diff:.2e}, {mismatches} mismatching mask pixels"
+    )
+    print("| | propagate (s) | memory attention (s) |")
+    print("|---|---|---|")
+    print(f"| uncached | {ref_time:.2f} | {ref_attn_time:.2f} |")
+    print(f"| K/V cache | {cached_time:.2f} | {cached_attn_time:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+
+import torch
+from PIL import Image
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def list_images(input_dir):
+    """List the image files under input_dir, as paths relative to input_dir."""
+    image_paths = []
+    for root, _, files in os.walk(input_dir):
+        for file_name in files:
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.append(
+                    os.path.relpath(os.path.join(root, file_name), input_dir)
+                )
+    return sorted(image_paths)
+
+
+def features_path(output_dir, image_path):
+    """
+    The features file of an image, mirroring its path under the input dir (keeping its
+    extension, so that e.g. "a.jpg" and "a.png" don't share a features file).
+    """
+    return os.path.join(output_dir, image_path + ".pt")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute SAM 2 image features to be restored with "
+        "SAM2ImagePredictor.load_features instead of running set_image again"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_l.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_large.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        required=True,
+        help="directory containing the images to precompute features for",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="directory to save the features to (one .pt file per image, "
+        "with the same relative path as the image)",
+    )
+    parser.add_argument(
+        "--half",
+        action="store_true",
+        help="whether to store the features in float16 (half the disk space)",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="whether to recompute features that already exist in output_dir",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = SAM2ImagePredictor(
+        build_sam2(args.sam2_cfg, args.sam2_checkpoint, device=device)
+    )
+
+    image_paths = list_images(args.input_dir)
+    print(f"found {len(image_paths)} images in {args.input_dir}")
+    num_skipped = 0
+    for n_image, image_path in enumerate(image_paths):
+        output_path = features_path(args.output_dir, image_path)
+        if os.path.exists(output_path) and not args.overwrite:
+            num_skipped += 1
+            continue
+        print(f"{n_image + 1}/{len(image_paths)} - computing features for {image_path}")
+        image = Image.open(os.path.join(args.input_dir, image_path)).convert("RGB")
+        predictor.set_image(image)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        predictor.save_features(output_path, half=args.half)
+
+    print(
+        f"completed features for {len(image_paths) - num_skipped} images "
+        f"(skipped {num_skipped} existing) in {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from pycocotools.mask import encode as encode_masks
+from sam2.build_sam import build_sam2_video_predictor
+
+# the mask encoding of the demo server
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "demo", "backend", "server")
+)
+from inference.mask_encoding import encode_host_masks, masks_to_host  # noqa: E402
+
+
+def add_boxes(predictor, inference_state, num_objects):
+    """Prompt num_objects boxes in a grid covering the first frame."""
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    grid = int(np.ceil(np.sqrt(num_objects)))
+    box_w, box_h = width // (grid + 1), height // (grid + 1)
+    for obj_id in range(num_objects):
+        x0 = (obj_id % grid) * width // grid
+        y0 = (obj_id // grid) * height // grid
+        box = np.array([x0, y0, x0 + box_w, y0 + box_h])
+        predictor.add_new_points_or_box(
+            inference_state, frame_idx=0, obj_id=obj_id, box=box
+        )
+
+
+def encode_inline(video_res_masks, score_thresh):
+    """The previous demo encoding: one pycocotools call per object, in the loop."""
+    masks_binary = (video_res_masks > score_thresh)[:, 0].cpu().numpy()
+    mask_rles = []
+    for mask in masks_binary:
+        mask_rle = encode_masks(np.array(mask, dtype=np.uint8, order="F"))
+        mask_rle["counts"] = mask_rle["counts"].decode()
+        mask_rles.append(mask_rle)
+    return mask_rles
+
+
+def propagate(predictor, inference_state, mode, rle_pool, score_thresh=0.0):
+    """
+    Propagate with the masks of each frame not encoded ("none", returning the mask
+    logits), encoded in the loop ("inline") or encoded in rle_pool while the next frame
+    is tracked ("pipelined"), returns the RLEs of every frame and the frames per second.
+    """
+    rles = {}
+    pending = None
+    start = time.perf_counter()
+    for frame_idx, _, video_res_masks in predictor.propagate_in_video(inference_state):
+        if mode == "none":
+            rles[frame_idx] = video_res_masks.clone()
+        elif mode == "inline":
+            rles[frame_idx] = encode_inline(video_res_masks, score_thresh)
+        else:
+            encoding = rle_pool.submit(
+                encode_host_masks, *masks_to_host(video_res_masks, score_thresh)
+            )
+            if pending is not None:
+                rles[pending[0]] = pending[1].result()
+            pending = (frame_idx, encoding)
+    if pending is not None:
+        rles[pending[0]] = pending[1].result()
+    fps = len(rles) / (time.perf_counter() - start)
+    return rles, fps
+
+
+def time_encoding(all_masks, encode, score_thresh=0.0, repeats=5):
+    """The time (in ms) to encode the masks of a frame, without tracking."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for video_res_masks in all_masks:
+            encode(video_res_masks, score_thresh)
+    return 1000 * (time.perf_counter() - start) / (repeats * len(all_masks))
+
+
+def encode_batched(video_res_masks, score_thresh):
+    return encode_host_masks(*masks_to_host(video_res_masks, score_thresh))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the propagation frame rate of the demo server encoding "
+        "the masks of each object inline with encoding the masks of each frame as a "
+        "batch in a worker pool, pipelined with tracking the next frame"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory of JPEG frames of the video",
+    )
+    parser.add_argument(
+        "--num_objects",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="numbers of objects to track",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=2, help="number of encoding threads"
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    rle_pool = ThreadPoolExecutor(max_workers=args.num_workers)
+    rows = []
+    with torch.inference_mode():
+        for num_objects in args.num_objects:
+            inference_state = predictor.init_state(video_path=args.video_dir)
+            add_boxes(predictor, inference_state, num_objects)
+            # a first propagation to warm up (and to fill the feature cache)
+            propagate(predictor, inference_state, "none", rle_pool)
+            logits, model_fps = propagate(predictor, inference_state, "none", rle_pool)
+            inline_ms = time_encoding(logits.values(), encode_inline)
+            batched_ms = time_encoding(logits.values(), encode_batched)
+            # the part of the batched encoding left on the tracking thread
+            to_host_ms = time_encoding(logits.values(), masks_to_host)
+            ref_rles, inline_fps = propagate(
+                predictor, inference_state, "inline", rle_pool
+            )
+            rles, pipelined_fps = propagate(
+                predictor, inference_state, "pipelined", rle_pool
+            )
+            same = all(rles[t] == ref_rles[t] for t in ref_rles)
+            num_frames = len(ref_rles)
+            rows.append(
+                (
+                    num_objects,
+                    num_frames,
+                    inline_ms,
+                    batched_ms,
+                    to_host_ms,
+                    model_fps,
+                    inline_fps,
+                    pipelined_fps,
+                    same,
+                )
+            )
+
+    height, width = inference_state["video_height"], inference_state["video_width"]
+    print(f"{width}x{height} masks, {os.cpu_count()} CPU cores, {device}")
+    print(
+        "| objects | frames | inline encoding (ms/frame) | batched encoding (ms/frame) "
+        "| batched, on the tracking thread (ms/frame) | no encoding (fps) "
+        "| inline per object (fps) | batched pipelined (fps) | speedup | same RLEs |"
+    )
+    print("|---|---|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        num_objects, num_frames, inline_ms, batched_ms, to_host_ms = row[:5]
+        model_fps, inline_fps, fps, same = row[5:]
+        print(
+            f"| {num_objects} | {num_frames} | {inline_ms:.2f} | {batched_ms:.2f} "
+            f"| {to_host_ms:.2f} | {model_fps:.2f} | {inline_fps:.2f} | {fps:.2f} "
+            f"| {fps / inline_fps:.2f}x | {same} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+
+def write_synthetic_video(path, duration, fps, width, height):
+    """Write a video of a square moving over a gradient background (with OpenCV)."""
+    import cv2
+
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    background = np.zeros((height, width, 3), dtype=np.uint8)
+    background[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)[None]
+    background[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    size = height // 4
+    for n in range(int(duration * fps)):
+        frame = background.copy()
+        x = (n * 4) % (width - size)
+        frame[height // 3 : height // 3 + size, x : x + size] = (0, 0, 255)
+        writer.write(frame)
+    writer.release()
+
+
+def max_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(args, streaming, results):
+    """Time init_state and its peak memory (in a fresh process) in one mode."""
+    from sam2.build_sam import build_sam2_video_predictor
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    predictor = build_sam2_video_predictor(
+        args.sam2_cfg, args.sam2_checkpoint, device=device
+    )
+    rss_before = max_rss_mib()
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    inference_state = predictor.init_state(
+        video_path=args.video,
+        offload_video_to_cpu=True,
+        async_loading_frames=streaming,
+    )
+    init_time = time.perf_counter() - start
+    result = {
+        "init_state_s": init_time,
+        "num_frames": inference_state["num_frames"],
+        "peak_rss_increase_mib": max_rss_mib() - rss_before,
+    }
+    if streaming:
+        images = inference_state["images"]
+        start = time.perf_counter()
+        for frame_idx in range(len(images)):
+            images[frame_idx]
+        result["forward_scan_fps"] = len(images) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for frame_idx in reversed(range(len(images))):
+            images[frame_idx]
+        result["reverse_scan_fps"] = len(images) / (time.perf_counter() - start)
+        result["peak_rss_increase_after_scans_mib"] = max_rss_mib() - rss_before
+        result.update(images.stats())
+    results.put(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the init_state latency and peak memory of decoding a "
+        "video file on demand (async_loading_frames=True) with decoding all its frames"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_t.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_tiny.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video",
+        type=str,
+        default=None,
+        help="MP4 video to load (a synthetic video is written if not given)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60, help="synthetic video duration (s)"
+    )
+    parser.add_argument("--fps", type=int, default=24, help="synthetic video fps")
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        default=(1280, 720),
+        help="synthetic video width and height",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.video is None:
+            args.video = os.path.join(tmp_dir, "synthetic.mp4")
+            write_synthetic_video(args.video, args.duration, args.fps, *args.resolution)
+
+        ctx = multiprocessing.get_context("spawn")
+        rows = []
+        for name, streaming in [("full decode", False), ("streaming", True)]:
+            if not streaming:
+                try:
+                    import decord  # noqa: F401
+                except ImportError:
+                    rows.append((name, None))
+                    continue
+            results = ctx.Queue()
+            process = ctx.Process(target=run_mode, args=(args, streaming, results))
+            process.start()
+            result = results.get()
+            process.join()
+            rows.append((name, result))
+
+    num_frames = next(result["num_frames"] for _, result in rows if result)
+    print(f"{num_frames} frames")
+    print("| | init_state (s) | peak RSS increase (MiB) |")
+    print("|---|---|---|")
+    for name, result in rows:
+        if result is None:
+            # the frames would be held as N x 3 x 1024 x 1024 float32
+            size_mib = num_frames * 3 * 1024**2 * 4 / 1024**2
+            print(f"| {name} | skipped (decord not installed) | >= {size_mib:.0f} |")
+        else:
+            print(
+                f"| {name} | {result['init_state_s']:.2f} | "
+                f"{result['peak_rss_increase_mib']:.0f} |"
+            )
+    for name, result in rows:
+        if result is not None and "forward_scan_fps" in result:
+            print(
+                f"{name}: reading all frames at {result['forward_scan_fps']:.1f} fps "
+                f"forward and {result['reverse_scan_fps']:.1f} fps in reverse "
+                f"({result['decoded_frames']} frames decoded, {result['seeks']} seeks), "
+                f"{result['buffered_frames']} frames buffered in "
+                f"{result['buffered_bytes'] / 1024**2:.0f} MiB, peak RSS increase "
+                f"{result['peak_rss_increase_after_scans_mib']:.0f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()